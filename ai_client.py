@@ -1,135 +1,289 @@
 from openai import AsyncOpenAI
+import asyncio
 import logging
-from config import NANOGPT_API_KEY
-from db import supabase
-from collections import defaultdict
+import random
+import time
+from functools import partial
+from config import (
+    NANOGPT_API_KEY, NANOGPT_BASE_URL,
+    AI_MAX_CONCURRENCY, AI_TIMEOUT_SECONDS, AI_BREAKER_FAILURES, AI_BREAKER_RECOVERY_SECONDS,
+    AI_CACHE_MAX_ENTRIES, AI_CACHE_MAX_BYTES, AI_LOG_SAMPLE_RATE, AI_HISTORY_MAX_CHATS,
+    AI_CONTEXT_TOKENS, AI_CONTEXT_SUMMARY, AI_SUMMARY_CONCURRENCY
+)
+from db import get_app_config
+from app_config import AppConfig, parse_bool
+from state_backend import chat_state
+from ai_scheduler import AIScheduler, CircuitOpenError, RequestCoalesced
+from response_cache import AIResponseCache, make_cache_key
+from context import SummaryCache, build_messages, message_tokens
+from normalize import normalized
+from metrics import AI_SECONDS, AI_CACHE_HITS, AI_PROMPT_TOKENS, AI_CONTEXT_DROPPED, ERRORS
 
 client = AsyncOpenAI(
     api_key=NANOGPT_API_KEY,
-    base_url='https://nano-gpt.com/api/v1',
+    base_url=NANOGPT_BASE_URL,
 )
 
-# Cache for AI config
-_ai_config_cache = {}
+# Concurrency cap, deadlines, per-chat coalescing and circuit breaker for AI calls
+ai_scheduler = AIScheduler(
+    max_concurrency=AI_MAX_CONCURRENCY,
+    timeout=AI_TIMEOUT_SECONDS,
+    failure_threshold=AI_BREAKER_FAILURES,
+    recovery_seconds=AI_BREAKER_RECOVERY_SECONDS
+)
+AI_FALLBACK_REPLY = "Sorry, I am having trouble thinking right now."
 
-import time
+# Replies of triggers that opt in with ai_cache_ttl
+_response_cache = AIResponseCache(max_entries=AI_CACHE_MAX_ENTRIES, max_bytes=AI_CACHE_MAX_BYTES)
 
-# In-memory chat history for context
-# Structure: {chat_id: {"messages": [], "session_start": 0}}
-_chat_history = defaultdict(lambda: {"messages": [], "session_start": 0})
-MAX_HISTORY_LENGTH = 5  # Keep last 5 messages per chat
-MEMORY_EXPIRATION_SECONDS = 6 * 3600  # 6 hours
+# Summaries of history that left a chat's prompt (off the history ring, or over the budget).
+# They get their own scheduler, so they never take a slot from (or trip the breaker of) replies
+_summaries = SummaryCache(max_chats=AI_HISTORY_MAX_CHATS)
+summary_scheduler = AIScheduler(
+    max_concurrency=AI_SUMMARY_CONCURRENCY,
+    timeout=AI_TIMEOUT_SECONDS,
+    failure_threshold=AI_BREAKER_FAILURES,
+    recovery_seconds=AI_BREAKER_RECOVERY_SECONDS
+)
+SUMMARY_PROMPT = (
+    "Summarize this conversation in a few sentences, keeping names, facts and open questions. "
+    "Reply with the summary only."
+)
 
-def get_ai_config(key: str, default: str = None) -> str:
+def _log_sampled() -> bool:
+    """Whether to log this request's prompt and reply (DEBUG level, AI_LOG_SAMPLE_RATE of requests)."""
+    return (
+        AI_LOG_SAMPLE_RATE > 0
+        and logging.getLogger().isEnabledFor(logging.DEBUG)
+        and random.random() < AI_LOG_SAMPLE_RATE
+    )
+
+# The app_config table, parsed once per reload; reads are in-memory lookups
+AI_CONFIG_SCHEMA = {
+    "ai_model": (str, "gpt-4o-mini"),
+    "ai_temperature": (float, 0.7),
+    "ai_context_tokens": (int, AI_CONTEXT_TOKENS),
+    "ai_context_summary": (parse_bool, AI_CONTEXT_SUMMARY),
+    "ai_summary_model": (str, None),
+}
+app_config = AppConfig(get_app_config, AI_CONFIG_SCHEMA)
+
+def get_ai_config(key: str, default=None):
     """
-    Get AI config value from database.
-    Caches values to avoid repeated DB calls.
+    Typed app_config value from the loaded snapshot (no DB call).
     Use refresh_ai_config() to reload from DB.
     """
-    if key in _ai_config_cache:
-        return _ai_config_cache[key]
-    
-    try:
-        response = supabase.table("app_config").select("value").eq("key", key).single().execute()
-        if response.data:
-            _ai_config_cache[key] = response.data['value']
-            return _ai_config_cache[key]
-    except Exception as e:
-        logging.warning(f"Failed to get AI config '{key}': {e}")
-    
-    return default
+    return app_config.get(key, default)
 
-def refresh_ai_config():
-    """Reload AI config from database."""
-    global _ai_config_cache
-    _ai_config_cache = {}
-    try:
-        response = supabase.table("app_config").select("*").execute()
-        for item in response.data:
-            _ai_config_cache[item['key']] = item['value']
-        logging.info(f"🔄 AI config reloaded: {list(_ai_config_cache.keys())}")
-    except Exception as e:
-        logging.error(f"Failed to refresh AI config: {e}")
+async def refresh_ai_config() -> bool:
+    """Reload AI config from database; the previous values stay in use if it fails."""
+    return await app_config.reload()
+
+def get_context_budget(model: str) -> int:
+    """Prompt token budget for model: ai_context_tokens:<model>, then ai_context_tokens, then AI_CONTEXT_TOKENS."""
+    return get_ai_config(f"ai_context_tokens:{model}", get_ai_config("ai_context_tokens"))
+
+def summaries_enabled() -> bool:
+    return get_ai_config("ai_context_summary")
+
+async def summarize_turns(model: str, previous: str | None, turns: list) -> str:
+    """One summary of an earlier summary plus the turns that followed it; runs in the background."""
+    lines = [f"Earlier summary: {previous}"] if previous else []
+    lines.extend(f"{turn['role']}: {turn['content']}" for turn in turns)
+    summary_model = get_ai_config("ai_summary_model") or model
+
+    async def request() -> str:
+        completion = await client.chat.completions.create(
+            model=summary_model,
+            temperature=0.2,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": "\n".join(lines)},
+            ],
+        )
+        return completion.choices[0].message.content
+
+    # No chat key: SummaryCache already runs one summary per chat at a time
+    return await summary_scheduler.submit(None, request)
+
+def build_prompt(system_prompt: str, user_message: str, model: str, chat_id: int = None) -> tuple:
+    """
+    The messages of a request as they would be sent now: the chat's recent history
+    within the model's token budget, after the summary of earlier turns when
+    summaries are on. Returns (messages, dropped history messages oldest first).
+    """
+    history = get_chat_history(chat_id) if chat_id else []
+    # A new session (empty history) starts without the previous session's summary
+    summary = _summaries.get(chat_id) if chat_id and history and summaries_enabled() else None
+    return build_messages(system_prompt, history, user_message, get_context_budget(model), summary)
 
 def get_chat_history(chat_id: int) -> list:
     """Get chat history for context, with expiration check from session start."""
-    history_data = _chat_history[chat_id]
-    
-    # Check for expiration from the START of the session
-    if history_data["messages"] and (time.time() - history_data["session_start"] > MEMORY_EXPIRATION_SECONDS):
-        logging.info(f"⏳ Chat history session expired for chat {chat_id} (6 hours passed since start)")
-        clear_chat_history(chat_id)
-        return []
-        
-    return history_data["messages"]
+    return chat_state.get_history(chat_id)
 
 def add_to_history(chat_id: int, role: str, content: str):
     """Add message to chat history. Starts session timer on first message."""
-    current_time = time.time()
-    history_data = _chat_history[chat_id]
-    
-    # If starting a new session (no messages or expired)
-    if not history_data["messages"] or (current_time - history_data["session_start"] > MEMORY_EXPIRATION_SECONDS):
-        history_data["messages"] = []
-        history_data["session_start"] = current_time
-        logging.info(f"🆕 Started new 6-hour AI session for chat {chat_id}")
+    chat_state.add_history(chat_id, role, content)
 
-    history_data["messages"].append({"role": role, "content": content})
-    
-    # Trim to max length
-    if len(history_data["messages"]) > MAX_HISTORY_LENGTH:
-        history_data["messages"] = history_data["messages"][-MAX_HISTORY_LENGTH:]
+def record_exchange(chat_id: int, user_message: str, reply: str, model: str):
+    """
+    Adds a user message and the reply to the chat's history. With summaries on,
+    the turns this pushes off the history ring go into the chat's summary.
+    """
+    if not summaries_enabled():
+        add_to_history(chat_id, "user", user_message)
+        add_to_history(chat_id, "assistant", reply)
+        return
+    before = get_chat_history(chat_id)
+    if not before:
+        # New session: the old summary is about a conversation that has expired
+        _summaries.clear(chat_id)
+    add_to_history(chat_id, "user", user_message)
+    add_to_history(chat_id, "assistant", reply)
+    kept = len(get_chat_history(chat_id))
+    evicted = before[:max(len(before) + 2 - kept, 0)]
+    if evicted:
+        _summaries.add(chat_id, evicted, partial(summarize_turns, model), in_history=False)
 
 def clear_chat_history(chat_id: int):
     """Clear chat history for a specific chat."""
-    _chat_history[chat_id] = {"messages": [], "session_start": 0}
+    chat_state.clear_history(chat_id)
+    _summaries.clear(chat_id)
     logging.info(f"🗑 Chat history cleared for chat {chat_id}")
 
-async def get_ai_response(system_prompt: str, user_message: str, model: str = None, chat_id: int = None) -> str:
+def export_ai_state() -> dict:
+    """AI config cache, for local snapshots (chat history is saved with chat_state)."""
+    return {"config": app_config.export()}
+
+def restore_ai_state(state: dict):
+    """Restore what export_ai_state() produced."""
+    app_config.restore(state.get("config", {}))
+
+def get_config_stats() -> dict:
+    """Version, size and age of the loaded app_config snapshot."""
+    return app_config.stats()
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters and size of the AI response cache."""
+    return _response_cache.stats()
+
+def get_summary_stats() -> dict:
+    """Cached history summaries, background refreshes and their scheduler."""
+    return {**_summaries.stats(), "scheduler": summary_scheduler.stats()}
+
+async def close_ai():
+    """Stop summary refreshes still running."""
+    await _summaries.close()
+
+async def get_ai_response(system_prompt: str, user_message, model: str = None, chat_id: int = None,
+                          cache_ttl: float = None, on_delta=None) -> str | None:
     """
     Generates a response using NanoGPT with optional context memory.
     
+    Requests go through ai_scheduler. Returns None if a newer message from the same
+    chat replaced this request while it was queued; returns AI_FALLBACK_REPLY on
+    errors or while the circuit breaker is open.
+    
     Args:
         system_prompt: System prompt for AI
-        user_message: User message to respond to
+        user_message: User message to respond to (text or the update's NormalizedMessage)
         model: Optional custom model name. If None or 'default', uses app_config.ai_model
         chat_id: Optional chat ID for context memory. If provided, uses conversation history.
+        cache_ttl: Optional seconds to cache the reply (per-trigger opt-in). A cached reply
+            skips the network call but is recorded in history like a fresh one.
+        on_delta: Optional async callback. If set, the completion is streamed and each
+            chunk of text is passed to it as it arrives; the full text is still returned.
     """
+    message = normalized(user_message)
+    user_message = message.text
     try:
         # Use custom model or fallback to app_config
         if model and model.lower() != 'default':
             used_model = model
         else:
-            used_model = get_ai_config('ai_model', 'gpt-4o-mini')
+            used_model = get_ai_config('ai_model')
         
-        temperature = float(get_ai_config('ai_temperature', '0.7'))
+        temperature = get_ai_config('ai_temperature')
         
-        # Build messages with context
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add history if chat_id provided
-        if chat_id:
-            history = get_chat_history(chat_id)
-            messages.extend(history)
-        
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
-        
-        logging.info(f"🤖 AI Request [Model: {used_model}, Temp: {temperature}, History: {len(messages)-2}]:\nUser: {user_message}")
-        completion = await client.chat.completions.create(
-            model=used_model,
-            temperature=temperature,
-            messages=messages,
-        )
-        response_content = completion.choices[0].message.content
-        logging.info(f"🤖 AI Response:\n{response_content}")
+        if cache_ttl:
+            # Keyed on the context that would be sent: the budgeted history window and the summary
+            context = build_prompt(system_prompt, user_message, used_model, chat_id)[0][1:-1]
+            cached = _response_cache.get(make_cache_key(system_prompt, used_model, temperature, message.cache_text, context))
+            if cached is not None:
+                AI_CACHE_HITS.inc(used_model)
+                logging.debug(f"🤖 AI cache hit [Model: {used_model}] for chat {chat_id}")
+                if chat_id:
+                    record_exchange(chat_id, user_message, cached, used_model)
+                return cached
         
-        # Save to history if chat_id provided
-        if chat_id:
-            add_to_history(chat_id, "user", user_message)
-            add_to_history(chat_id, "assistant", response_content)
+        async def request() -> str:
+            # Built when the request actually runs, so a queued request sees the latest history
+            messages, dropped = build_prompt(system_prompt, user_message, used_model, chat_id)
+            AI_PROMPT_TOKENS.inc(used_model, amount=sum(message_tokens(message) for message in messages))
+            if dropped:
+                AI_CONTEXT_DROPPED.inc(used_model, amount=len(dropped))
+                if chat_id and summaries_enabled():
+                    # Used from the next request on; this one goes ahead without waiting
+                    _summaries.add(chat_id, dropped, partial(summarize_turns, used_model))
+            
+            # Full prompts and replies are logged for a sample of requests only, at DEBUG
+            sampled = _log_sampled()
+            if sampled:
+                logging.debug(f"🤖 AI Request [Model: {used_model}, Temp: {temperature}, Context: {len(messages)-2}]:\nUser: {user_message}")
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                if on_delta is None:
+                    completion = await client.chat.completions.create(
+                        model=used_model,
+                        temperature=temperature,
+                        messages=messages,
+                    )
+                    response_content = completion.choices[0].message.content
+                else:
+                    stream = await client.chat.completions.create(
+                        model=used_model,
+                        temperature=temperature,
+                        messages=messages,
+                        stream=True,
+                    )
+                    parts = []
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            await on_delta(delta)
+                    response_content = "".join(parts)
+                outcome = "ok"
+            except asyncio.CancelledError:
+                # The scheduler's deadline (or shutdown) cancelled the call
+                outcome = "cancelled"
+                raise
+            finally:
+                AI_SECONDS.observe(time.perf_counter() - started, used_model, outcome)
+            if sampled:
+                logging.debug(f"🤖 AI Response:\n{response_content}")
+            
+            if cache_ttl and response_content:
+                key = make_cache_key(system_prompt, used_model, temperature, message.cache_text, messages[1:-1])
+                _response_cache.put(key, response_content, cache_ttl)
+            
+            # Save to history if chat_id provided
+            if chat_id:
+                record_exchange(chat_id, user_message, response_content, used_model)
+            
+            return response_content
         
-        return response_content
+        return await ai_scheduler.submit(chat_id or None, request)
+    except RequestCoalesced:
+        logging.info(f"🤖 AI request for chat {chat_id} replaced by a newer message")
+        return None
+    except CircuitOpenError:
+        logging.warning("🤖 AI circuit open, sending fallback reply")
+        return AI_FALLBACK_REPLY
     except Exception as e:
-        logging.error(f"NanoGPT Error: {e}")
-        return "Sorry, I am having trouble thinking right now."
+        ERRORS.inc("ai")
+        logging.error(f"NanoGPT Error: {e!r}")
+        return AI_FALLBACK_REPLY
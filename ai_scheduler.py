@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+
+
+class CircuitOpenError(Exception):
+    """The upstream is failing; the request was rejected without being sent."""
+
+
+class RequestCoalesced(Exception):
+    """A newer request for the same key replaced this one before it was sent."""
+
+
+class AIScheduler:
+    """
+    Front door for upstream AI calls.
+
+    - At most max_concurrency requests run at once; the rest wait their turn.
+    - Every request gets a deadline of timeout seconds.
+    - Requests sharing a key (a chat) run one at a time. While one is in flight,
+      only the newest arrival is kept waiting; older waiters get RequestCoalesced.
+    - After failure_threshold consecutive failures the circuit opens and requests
+      fail fast with CircuitOpenError. After recovery_seconds one probe request
+      is let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 30.0,
+                 failure_threshold: int = 5, recovery_seconds: float = 30.0):
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._active_keys = set()
+        self._pending = {}
+
+        # Circuit breaker
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+        # Metrics
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.started = 0
+
+    @property
+    def circuit_state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._probe_in_flight or time.monotonic() - self._opened_at >= self.recovery_seconds:
+            return "half-open"
+        return "open"
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.waiting + len(self._pending),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "avg_wait_seconds": round(self.wait_seconds_total / self.started, 4) if self.started else 0.0,
+            "max_wait_seconds": round(self.wait_seconds_max, 4),
+            "circuit": self.circuit_state,
+        }
+
+    async def submit(self, key, request_factory):
+        """
+        Run request_factory() (a coroutine function) under the scheduler's rules.
+
+        Args:
+            key: Coalescing key (e.g. chat_id); None disables coalescing
+            request_factory: Called only when the request actually runs, so it can
+                read the freshest state (e.g. chat history) at that moment
+        """
+        if key is None:
+            return await self._run(request_factory, time.monotonic())
+
+        submitted = time.monotonic()
+        if key in self._active_keys:
+            await self._wait_for_turn(key)
+        else:
+            self._active_keys.add(key)
+
+        try:
+            return await self._run(request_factory, submitted)
+        finally:
+            self._release(key)
+
+    async def _wait_for_turn(self, key):
+        superseded = self._pending.get(key)
+        if superseded is not None and not superseded.done():
+            superseded.set_exception(RequestCoalesced())
+            self.coalesced += 1
+
+        turn = asyncio.get_running_loop().create_future()
+        self._pending[key] = turn
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if self._pending.get(key) is turn:
+                del self._pending[key]
+            elif turn.done() and not turn.cancelled() and turn.exception() is None:
+                # We were handed the key but will not use it
+                self._release(key)
+            raise
+
+    def _release(self, key):
+        """Pass the key to the waiting request, if any."""
+        turn = self._pending.pop(key, None)
+        if turn is not None and not turn.done():
+            turn.set_result(None)
+        else:
+            self._active_keys.discard(key)
+
+    def _check_circuit(self):
+        if self._opened_at is None:
+            return False
+        if self._probe_in_flight or time.monotonic() - self._opened_at < self.recovery_seconds:
+            self.rejected += 1
+            raise CircuitOpenError()
+        self._probe_in_flight = True
+        return True
+
+    def _record(self, ok: bool, probe: bool):
+        if probe:
+            self._probe_in_flight = False
+        if ok:
+            self._failures = 0
+            if self._opened_at is not None:
+                logging.info("✅ AI circuit closed")
+            self._opened_at = None
+            return
+
+        self._failures += 1
+        if probe or (self._opened_at is None and self._failures >= self.failure_threshold):
+            self._opened_at = time.monotonic()
+            logging.warning(f"⚡ AI circuit opened after {self._failures} consecutive failures")
+
+    async def _run(self, request_factory, submitted: float):
+        probe = self._check_circuit()
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            if probe:
+                self._probe_in_flight = False
+            raise
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - submitted
+        self.started += 1
+        self.wait_seconds_total += waited
+        if waited > self.wait_seconds_max:
+            self.wait_seconds_max = waited
+
+        self.in_flight += 1
+        ok = False
+        try:
+            result = await asyncio.wait_for(request_factory(), self.timeout)
+            ok = True
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            raise
+        except asyncio.CancelledError:
+            # Cancelled by our caller, not an upstream failure
+            ok = None
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            if ok is None:
+                if probe:
+                    self._probe_in_flight = False
+            else:
+                self._record(ok, probe)
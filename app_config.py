@@ -0,0 +1,108 @@
+import logging
+import time
+from types import MappingProxyType
+
+# A key absent from app_config (cached like any other lookup)
+_MISSING = object()
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+class ConfigSnapshot:
+    """
+    One version of the app_config table; never changes once built.
+
+    Values are parsed by the schema (key or "prefix:" of the key -> (type,
+    default)) the first time a key is read and kept, including the default
+    for keys the table does not have, so every later read is a dict lookup.
+    A value that does not parse is logged once and read as the default.
+    """
+
+    __slots__ = ("values", "version", "loaded_at", "_schema", "_typed")
+
+    def __init__(self, values: dict, version: int = 0, schema: dict = None):
+        self.values = MappingProxyType(dict(values))
+        self.version = version
+        self.loaded_at = time.time()
+        self._schema = schema or {}
+        self._typed = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _spec(self, key: str) -> tuple:
+        spec = self._schema.get(key)
+        if spec is None and ":" in key:
+            # Per-model overrides like ai_context_tokens:<model> parse like the base key, without its default
+            base = self._schema.get(key.split(":", 1)[0])
+            spec = (base[0], _MISSING) if base else None
+        return spec or (None, _MISSING)
+
+    def _parse(self, key: str):
+        kind, default = self._spec(key)
+        raw = self.values.get(key, _MISSING)
+        if raw is _MISSING or raw is None or kind is None:
+            return default if raw is _MISSING or raw is None else raw
+        try:
+            return kind(raw)
+        except (TypeError, ValueError):
+            logging.warning(f"⚙️ Invalid app_config value {raw!r} for {key}, using {default!r}")
+            return default
+
+    def get(self, key: str, default=None):
+        """The typed value of key; default if neither the table nor the schema has one."""
+        value = self._typed.get(key, _MISSING)
+        if value is _MISSING and key not in self._typed:
+            value = self._typed[key] = self._parse(key)
+        return default if value is _MISSING else value
+
+
+class AppConfig:
+    """
+    The app_config table held in memory as a ConfigSnapshot.
+
+    reload() fetches the whole table and replaces the snapshot with one
+    assignment, so readers see either the old or the new version, never a
+    mix; a failed fetch keeps the current one. Reads never touch the DB.
+    """
+
+    def __init__(self, fetch, schema: dict = None):
+        self._fetch = fetch
+        self.schema = schema or {}
+        self.snapshot = ConfigSnapshot({}, 0, self.schema)
+        self.loaded = False
+
+    def get(self, key: str, default=None):
+        return self.snapshot.get(key, default)
+
+    def _install(self, values: dict):
+        self.snapshot = ConfigSnapshot(values, self.snapshot.version + 1, self.schema)
+
+    async def reload(self) -> bool:
+        rows = await self._fetch()
+        if rows is None:
+            logging.error(f"Failed to reload app_config, keeping version {self.snapshot.version}")
+            return False
+        self._install({item['key']: item['value'] for item in rows})
+        self.loaded = True
+        logging.info(f"🔄 app_config v{self.snapshot.version} loaded: {list(self.snapshot.values)}")
+        return True
+
+    def restore(self, values: dict):
+        """Start from saved values until the first reload (a loaded table is never overwritten)."""
+        if not self.loaded and values:
+            self._install(values)
+
+    def export(self) -> dict:
+        return dict(self.snapshot.values)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.snapshot.version,
+            "keys": len(self.snapshot),
+            "age_seconds": round(time.time() - self.snapshot.loaded_at, 1),
+        }
@@ -0,0 +1,452 @@
+"""
+Microbenchmarks for trigger matching, cooldowns and AI history.
+
+Builds synthetic trigger sets (10 to 10k triggers, half chat-specific and
+half global, Cyrillic and Latin keywords, some multi-word, some with their
+own fuzzy threshold) and message corpora of short, medium and long messages,
+about a fifth of them containing a keyword (some with a typo). Matching
+runs like the handlers run it, behind the TriggerIndex.may_match()
+pre-filter, on one NormalizedMessage per update. Reports operations per
+second, p50/p99 latency and peak traced memory per case, and for matching
+the share of messages the pre-filter ruled out. The normalize cases count
+the objects and bytes allocated per update to normalize a message (and
+build the notification snippet for the ones that hit), next to the
+repeated lower()/split() and per-character escaping it replaced.
+
+    python bench/bench_matching.py                       # run and compare with the baseline
+    python bench/bench_matching.py --save-baseline       # store this run as the new baseline
+    python bench/bench_matching.py --quick --output out.json  # smaller suite, own baseline
+
+Each case is warmed up and then run --repeat times; latency and
+throughput are computed from each item's fastest call. The suite runs
+--rounds times and every metric keeps its best round. A case regresses
+when its p50 latency grows or its throughput drops by more than --threshold
+(default 50%, twice that for p99) and by more than --min-delta-us per
+operation, or when its peak memory, which does not jitter, grows by more
+than --memory-threshold (default 30%) against the baseline; the script then
+exits with status 1. Baselines are machine specific: regenerate them with
+--save-baseline on the machine that compares.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import ChatHistoryStore  # noqa: E402
+from normalize import NormalizedMessage  # noqa: E402
+from trigger_index import TriggerIndex  # noqa: E402
+from utils import CooldownManager, check_message_for_triggers  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CYRILLIC_SYLLABLES = ["при", "вет", "ска", "дка", "дос", "тав", "ка", "за", "каз", "оп", "ла", "та", "цен", "ник",
+                      "сег", "од", "ня", "мо", "ло", "ко", "кни", "га", "руб", "лей", "вы", "бор", "сто", "ить"]
+LATIN_SYLLABLES = ["pri", "ce", "or", "der", "de", "li", "ve", "ry", "hel", "lo", "sup", "port", "pay", "ment",
+                   "to", "mor", "row", "bo", "ok", "sa", "le", "ti", "cket", "shop", "ping", "mo", "ney"]
+# Filler words of messages use other syllables, so mostly the inserted keywords match
+CYRILLIC_FILLER = ["сл", "ов", "ну", "же", "бы", "ещ", "ё", "хо", "ро", "шо", "ве", "чер", "ям", "ус", "фи", "эх",
+                   "щу", "юг", "ъе", "ыр"]
+LATIN_FILLER = ["wh", "at", "ju", "st", "qu", "ix", "ya", "zz", "fu", "nky", "gr", "ea", "th", "ink", "ab", "ou"]
+MESSAGE_LENGTHS = {"short": (2, 6), "medium": (10, 30), "long": (60, 150)}
+CHATS = [-1001000000000 - n for n in range(50)]
+
+
+def make_word(rng: random.Random, cyrillic: bool, filler: bool = False) -> str:
+    if filler:
+        syllables = CYRILLIC_FILLER if cyrillic else LATIN_FILLER
+    else:
+        syllables = CYRILLIC_SYLLABLES if cyrillic else LATIN_SYLLABLES
+    return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+
+def make_triggers(count: int, seed: int = 1) -> list:
+    """Trigger rows shaped like the Supabase table."""
+    rng = random.Random(seed)
+    triggers = []
+    for trigger_id in range(1, count + 1):
+        cyrillic = rng.random() < 0.6
+        keywords = []
+        for _ in range(rng.randint(1, 3)):
+            words = [make_word(rng, cyrillic) for _ in range(1 if rng.random() < 0.8 else 2)]
+            if len(words[0]) < 5:
+                words[0] += rng.choice(CYRILLIC_SYLLABLES if cyrillic else LATIN_SYLLABLES)
+            keywords.append(" ".join(words))
+        row = {
+            "id": trigger_id,
+            "triggers": keywords,
+            "response": "ok",
+            "type": "text",
+            "cooldown": 60,
+            "chat_id": rng.choice(CHATS) if rng.random() < 0.5 else None,
+        }
+        if rng.random() < 0.1:
+            row["fuzzy_threshold"] = rng.choice([75, 80, 90, 95])
+        triggers.append(row)
+    return triggers
+
+
+def _typo(rng: random.Random, word: str) -> str:
+    if len(word) < 4:
+        return word
+    position = rng.randrange(1, len(word) - 1)
+    return word[:position] + word[position + 1:]
+
+
+def make_corpus(triggers: list, length: str, count: int, hit_rate: float = 0.2, seed: int = 2) -> list:
+    """(chat_id, text) pairs; about hit_rate of them contain a trigger keyword."""
+    rng = random.Random(seed)
+    low, high = MESSAGE_LENGTHS[length]
+    messages = []
+    for _ in range(count):
+        words = [make_word(rng, rng.random() < 0.6, filler=True) for _ in range(rng.randint(low, high))]
+        chat_id = rng.choice(CHATS)
+        if triggers and rng.random() < hit_rate:
+            keyword = rng.choice(rng.choice(triggers)["triggers"])
+            if rng.random() < 0.3:
+                keyword = _typo(rng, keyword)
+            words.insert(rng.randrange(len(words) + 1), keyword)
+        messages.append((chat_id, " ".join(words)))
+    return messages
+
+
+def _summary(latencies_ns: list, elapsed: float, peak_bytes: int, **extra) -> dict:
+    latencies_ns.sort()
+    count = len(latencies_ns)
+    return {
+        "ops_per_second": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_us": round(latencies_ns[count // 2] / 1000, 2),
+        "p99_us": round(latencies_ns[min(count - 1, int(count * 0.99))] / 1000, 2),
+        "peak_memory_kb": round(peak_bytes / 1024, 1),
+        **extra,
+    }
+
+
+# Each case runs once to warm up, then this many times; every item counts with its
+# fastest call, which filters out short hiccups
+REPEAT = 3
+
+
+def _timed(make_operation, items) -> tuple:
+    """
+    Runs a fresh make_operation() on every item, once untimed and then REPEAT times.
+    Returns (each item's fastest latency in ns, their sum in seconds): a
+    slow stretch only counts if it hit every run of the same item.
+    """
+    clock = time.perf_counter_ns
+    operation = make_operation()
+    for item in items:
+        operation(item)
+    best = None
+    for _ in range(REPEAT):
+        operation = make_operation()
+        latencies = []
+        gc.collect()
+        for item in items:
+            t0 = clock()
+            operation(item)
+            latencies.append(clock() - t0)
+        best = latencies if best is None else list(map(min, best, latencies))
+    return best, sum(best) / 1e9
+
+
+def _peak_memory(build, operation, items) -> int:
+    """Peak traced memory of building the structure and running the operation (a separate, slower pass)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        target = build()
+        for item in items:
+            operation(target, item)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _allocations(operation, items) -> tuple:
+    """
+    (blocks, bytes) allocated per item by operation, counting what it returns:
+    results are kept alive until the end, so nothing allocated is missed.
+    """
+    kept = [None] * len(items)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for position, item in enumerate(items):
+            kept[position] = operation(item)
+        stats = tracemalloc.take_snapshot().statistics("filename")
+    finally:
+        tracemalloc.stop()
+    return sum(stat.count for stat in stats) / len(items), sum(stat.size for stat in stats) / len(items)
+
+
+def bench_matching(trigger_count: int, length: str, messages: int) -> dict:
+    triggers = make_triggers(trigger_count)
+    corpus = make_corpus(triggers, length, messages)
+
+    started = time.perf_counter()
+    index = TriggerIndex(triggers)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    def match(built, item):
+        # As the handlers do it: normalized once, the pre-filter first, full matching only for candidates
+        chat_id, text = item
+        message = NormalizedMessage(text)
+        if built.may_match(message, chat_id):
+            check_message_for_triggers(message, built, chat_id=chat_id)
+
+    latencies, elapsed = _timed(lambda: partial(match, index), corpus)
+    hits = sum(check_message_for_triggers(text, index, chat_id=chat_id) is not None for chat_id, text in corpus)
+    # On a fresh index: the timed one may have switched a filter that rejects too little off
+    fresh = TriggerIndex(triggers)
+    rejected = sum(not fresh.may_match(text, chat_id) for chat_id, text in corpus)
+    peak = _peak_memory(lambda: TriggerIndex(triggers), match, corpus[:200])
+    return _summary(
+        latencies, elapsed, peak,
+        hit_rate=round(hits / len(corpus), 3),
+        prefilter_rejection_rate=round(rejected / len(corpus), 3),
+        build_ms=round(build_ms, 2)
+    )
+
+
+# What the handlers did per update before NormalizedMessage
+LEGACY_MARKDOWN_CHARS = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+
+
+def _legacy_normalize(item) -> list:
+    text, hit = item
+    produced = []
+    text_lower = text.lower()  # pre-filter
+    produced += [text_lower, text_lower.split()]
+    text_lower = text.lower()  # full matching
+    produced += [text_lower, text_lower.split()]
+    if hit:
+        snippet = text[:50]
+        for char in LEGACY_MARKDOWN_CHARS:
+            escaped = snippet.replace(char, '\\' + char)
+            if escaped is not snippet:
+                produced.append(escaped)
+            snippet = escaped
+        produced.append(f"{text[:50]}{'...' if len(text) > 50 else ''}")
+    return produced
+
+
+def _normalize(item) -> list:
+    text, hit = item
+    message = NormalizedMessage(text)
+    if hit:
+        message.snippet_markdown, message.snippet
+    return [message]
+
+
+def bench_normalization(length: str, messages: int) -> dict:
+    triggers = make_triggers(100)
+    index = TriggerIndex(triggers)
+    corpus = [
+        (text, check_message_for_triggers(text, index, chat_id=chat_id) is not None)
+        for chat_id, text in make_corpus(triggers, length, messages)
+    ]
+
+    latencies, elapsed = _timed(lambda: _normalize, corpus)
+    legacy_latencies, legacy_elapsed = _timed(lambda: _legacy_normalize, corpus)
+    blocks, size = _allocations(_normalize, corpus)
+    legacy_blocks, legacy_size = _allocations(_legacy_normalize, corpus)
+    peak = _peak_memory(lambda: None, lambda _, item: _normalize(item), corpus)
+    legacy = _summary(legacy_latencies, legacy_elapsed, 0)
+    return _summary(
+        latencies, elapsed, peak,
+        blocks_per_update=round(blocks, 2),
+        bytes_per_update=round(size, 1),
+        legacy_blocks_per_update=round(legacy_blocks, 2),
+        legacy_bytes_per_update=round(legacy_size, 1),
+        legacy_p50_us=legacy["p50_us"],
+    )
+
+
+def bench_cooldowns(chats: int, operations: int) -> dict:
+    rng = random.Random(3)
+    events = []
+    now = 1_700_000_000.0
+    for _ in range(operations):
+        now += rng.random() * 0.05
+        events.append((-1001000000000 - rng.randrange(chats), rng.randrange(1, 200), now))
+
+    def claim(manager, event):
+        chat_id, trigger_id, timestamp = event
+        if manager.can_trigger(chat_id, trigger_id, 60, timestamp=timestamp):
+            manager.mark_triggered(chat_id, trigger_id, timestamp=timestamp, cooldown_seconds=60)
+
+    managers = []
+
+    def make_operation():
+        managers.append(CooldownManager())
+        return partial(claim, managers[-1])
+
+    latencies, elapsed = _timed(make_operation, events)
+    peak = _peak_memory(CooldownManager, claim, events)
+    return _summary(latencies, elapsed, peak, entries=len(managers[-1]))
+
+
+def bench_history(chats: int, operations: int) -> dict:
+    rng = random.Random(4)
+    events = [(-1001000000000 - rng.randrange(chats), make_word(rng, True) * 5) for _ in range(operations)]
+
+    def build():
+        return ChatHistoryStore(max_chats=5000, max_messages=5)
+
+    def add_and_read(store, event):
+        chat_id, text = event
+        store.get(chat_id)
+        store.add(chat_id, "user", text)
+
+    stores = []
+
+    def make_operation():
+        stores.append(build())
+        return partial(add_and_read, stores[-1])
+
+    latencies, elapsed = _timed(make_operation, events)
+    peak = _peak_memory(build, add_and_read, events)
+    return _summary(latencies, elapsed, peak, chats=len(stores[-1]))
+
+
+def _cases(quick: bool) -> list:
+    trigger_counts = [10, 100, 1000] if quick else [10, 100, 1000, 10000]
+    messages = 500 if quick else 2000
+    operations = 20000 if quick else 100000
+    cases = []
+    for trigger_count in trigger_counts:
+        for length in MESSAGE_LENGTHS:
+            cases.append((f"match/triggers={trigger_count}/{length}",
+                          partial(bench_matching, trigger_count, length, messages)))
+    for length in MESSAGE_LENGTHS:
+        cases.append((f"normalize/{length}", partial(bench_normalization, length, messages)))
+    for chats in (100, 10000):
+        cases.append((f"cooldown/chats={chats}", partial(bench_cooldowns, chats, operations)))
+        cases.append((f"history/chats={chats}", partial(bench_history, chats, operations)))
+    return cases
+
+
+def _best(first: dict, second: dict) -> dict:
+    """The better value of each timing metric of two runs of a case."""
+    best = dict(first)
+    for key, value in second.items():
+        if key == "ops_per_second":
+            best[key] = max(best[key], value)
+        elif key.endswith("_us") or key == "peak_memory_kb":
+            best[key] = min(best[key], value)
+    return best
+
+
+def run_suite(quick: bool, rounds: int = 1) -> dict:
+    """
+    Runs every case once per round and keeps the best of each metric. Rounds
+    go through the whole suite, so a slow stretch of the machine lasting a
+    few seconds spoils one round of a case, not all of its runs.
+    """
+    results = {}
+    for round_number in range(1, rounds + 1):
+        for name, bench in _cases(quick):
+            result = bench()
+            results[name] = _best(results[name], result) if name in results else result
+            print(f"[{round_number}/{rounds}] {name}: {result}", file=sys.stderr)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_us: float,
+            memory_threshold: float = 0.3) -> list:
+    """
+    Cases that got slower than the baseline by more than threshold, and by more
+    than min_delta_us per operation (p99 is the noisiest statistic and gets
+    twice the threshold), or whose peak memory grew by more than memory_threshold.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric, allowed in (("p50_us", threshold), ("p99_us", 2 * threshold)):
+            # Sub-microsecond jitter is not a regression
+            if (current[metric] > previous[metric] * (1 + allowed)
+                    and current[metric] - previous[metric] > min_delta_us):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {current[metric]}")
+        if (current["ops_per_second"] < previous["ops_per_second"] / (1 + threshold)
+                and _us_per_operation(current) - _us_per_operation(previous) > min_delta_us):
+            regressions.append(f"{name}: ops_per_second {previous['ops_per_second']} -> {current['ops_per_second']}")
+        if current["peak_memory_kb"] > previous["peak_memory_kb"] * (1 + memory_threshold):
+            regressions.append(f"{name}: peak_memory_kb {previous['peak_memory_kb']} -> {current['peak_memory_kb']}")
+    return regressions
+
+
+def _us_per_operation(result: dict) -> float:
+    return 1e6 / result["ops_per_second"] if result["ops_per_second"] else float("inf")
+
+
+def main():
+    global REPEAT
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="up to 1000 triggers and fewer messages")
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--baseline", help="default: bench/baseline_matching.json (_quick.json with --quick)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=0.3, help="allowed relative peak memory growth")
+    parser.add_argument("--min-delta-us", type=float, default=2.0, help="ignore latency changes below this")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per case, after one warm-up run")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the whole suite, the best counts")
+    args = parser.parse_args()
+    REPEAT = args.repeat
+    if args.baseline is None:
+        name = "baseline_matching_quick.json" if args.quick else "baseline_matching.json"
+        args.baseline = os.path.join(BENCH_DIR, name)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": run_suite(args.quick, args.rounds),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=sys.stderr)
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("quick") != args.quick:
+        # Corpus sizes differ, so the numbers are not comparable
+        print("Baseline was recorded with a different --quick setting", file=sys.stderr)
+        sys.exit(2)
+    regressions = compare(report["results"], baseline["results"], args.threshold, args.min_delta_us,
+                          args.memory_threshold)
+    if regressions:
+        print("Regressions against the baseline:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+    print("No regressions against the baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+End-to-end replay of recorded updates through the real Dispatcher and handlers.router.
+
+Telegram, Supabase and the OpenAI-compatible AI API are replaced by local
+fake servers, each with a configurable response latency, and the bot runs
+exactly as main.run_bot() runs it (trigger loading, photo queue, outbound
+dispatcher, AI scheduler, ...). Reports per-update latency (from arrival
+to the handler finishing, replies included), throughput, event-loop lag
+and the calls each fake service received.
+
+Record real traffic by running the bot with RECORD_UPDATES_PATH set
+(personal data is stripped), or synthesize a load:
+
+    python bench/replay.py --recording updates.jsonl.gz --speed 1     # original timing
+    python bench/replay.py --recording updates.jsonl.gz --speed 0     # as fast as possible
+    python bench/replay.py --synthesize 5000 --rate 200 --ai-latency-ms 800
+
+Triggers come from --triggers (a JSON list of rows as stored in Supabase)
+or are synthesized (--synthetic-triggers, with --ai-share of them AI
+triggers).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOKEN = "123456:replay"
+BOT_ID = 123456
+# Shaped like a JWT, which the supabase client insists on
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.replay"
+
+
+class FakeService:
+    """aiohttp app on localhost that answers after latency_ms and counts calls per endpoint."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.port = None
+        self._runner = None
+
+    def routes(self, app: web.Application):
+        raise NotImplementedError
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def start(self) -> str:
+        app = web.Application()
+        self.routes(app)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class FakeBotAPI(FakeService):
+    def __init__(self, latency_ms: float = 0.0, username: str = "replay_bot"):
+        super().__init__(latency_ms)
+        self.username = username
+        self._message_ids = iter(range(10 ** 6, 10 ** 9))
+
+    def routes(self, app):
+        app.router.add_post("/bot{token}/{method}", self.handle)
+
+    def _message(self, chat_id, text: str = None) -> dict:
+        chat_id = int(chat_id)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "replay"},
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+        await self.delay()
+        if method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "replay", "username": self.username}
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(data.get("chat_id", 0), data.get("text", ""))
+        elif method in ("sendPhoto", "sendSticker"):
+            result = self._message(data.get("chat_id", 0))
+        elif method == "sendMediaGroup":
+            media = json.loads(data.get("media", "[]"))
+            result = [self._message(data.get("chat_id", 0)) for _ in media]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeSupabase(FakeService):
+    """Just enough PostgREST for db.py: trigger and app_config reads, chat_photos inserts."""
+
+    def __init__(self, triggers: list, app_config: dict, latency_ms: float = 0.0):
+        super().__init__(latency_ms)
+        self.triggers = triggers
+        self.app_config = app_config
+        self.photo_rows = 0
+
+    def routes(self, app):
+        app.router.add_route("*", "/rest/v1/{table}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        table = request.match_info["table"]
+        self.calls[f"{request.method} {table}"] += 1
+        await self.delay()
+        query = request.query
+        if table == "triggers":
+            # Incremental sync asks for rows changed since the watermark: nothing changes during a replay
+            rows = [] if "updated_at" in query else self.triggers
+            return web.json_response(rows)
+        if table == "app_config":
+            if "key" in query:
+                key = query["key"].removeprefix("eq.")
+                if key not in self.app_config:
+                    return web.json_response({"code": "PGRST116", "message": "no rows"}, status=406)
+                return web.json_response({"value": self.app_config[key]})
+            return web.json_response([{"key": key, "value": value} for key, value in self.app_config.items()])
+        if table == "chat_photos" and request.method == "POST":
+            rows = await request.json()
+            self.photo_rows += len(rows)
+            return web.json_response(rows, status=201)
+        return web.json_response([])
+
+
+class FakeOpenAI(FakeService):
+    """/chat/completions with a canned answer, streamed in a few chunks when asked to."""
+
+    def routes(self, app):
+        app.router.add_post("/v1/chat/completions", self.handle)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.calls[body.get("model", "?")] += 1
+        answer = f"Replay answer to: {body['messages'][-1]['content'][:40]}"
+        base = {"id": "replay", "created": int(time.time()), "model": body.get("model", "")}
+        if not body.get("stream"):
+            await self.delay()
+            return web.json_response({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop"}],
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunks = [answer[i:i + 12] for i in range(0, len(answer), 12)]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            event = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+def synthesize_updates(count: int, rate: float, triggers: list, photo_share: float = 0.02) -> list:
+    """(offset, update) pairs in the recording format, medium messages at rate per second."""
+    from bench_matching import make_corpus
+
+    rng = random.Random(5)
+    now = int(time.time())
+    updates = []
+    for update_id, (chat_id, text) in enumerate(make_corpus(triggers, "medium", count), 1):
+        offset = round(update_id / rate, 3) if rate > 0 else 0.0
+        message = {
+            "message_id": update_id,
+            "date": now + int(offset),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "title"},
+            "from": {"id": 10 ** 12 + rng.randrange(500), "is_bot": False, "first_name": "first_name"},
+        }
+        if rng.random() < photo_share:
+            message["photo"] = [{"file_id": f"photo{update_id}", "file_unique_id": f"u{update_id}",
+                                 "width": 800, "height": 600}]
+            message["caption"] = f"@replay_bot {text}"
+        else:
+            message["text"] = text
+        updates.append((offset, {"update_id": update_id, "message": message}))
+    return updates
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def replay(dp, bot, updates: list, speed: float, concurrency: int, results: dict):
+    """Feed updates to the dispatcher at speed x their recorded pace (0 = as fast as possible)."""
+    from aiogram.types import Update
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    latencies = results["latencies"]
+    in_flight = set()
+
+    async def handle(update, arrived: float):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            results["errors"][type(e).__name__] += 1
+        finally:
+            latencies.append(loop.time() - arrived)
+            slots.release()
+
+    started = loop.time()
+    results["started"] = started
+    for offset, raw in updates:
+        if speed > 0:
+            delay = started + offset / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        arrived = loop.time()
+        await slots.acquire()
+        update = Update.model_validate(raw, context={"bot": bot})
+        task = asyncio.create_task(handle(update, arrived))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    results["finished"] = loop.time()
+
+
+async def run(args) -> dict:
+    from bench_matching import make_triggers
+
+    if args.triggers:
+        with open(args.triggers, encoding="utf-8") as f:
+            triggers = json.load(f)
+    else:
+        rng = random.Random(6)
+        triggers = make_triggers(args.synthetic_triggers)
+        for row in triggers:
+            row["enabled"] = True
+            if rng.random() < args.ai_share:
+                row["type"] = "ai"
+                row["response"] = "You are a helpful assistant."
+
+    bot_username = "replay_bot"
+    if args.recording:
+        from update_recorder import read_bot_username, read_recording
+        updates = read_recording(args.recording)
+        # Recorded mentions of the bot keep its real username
+        bot_username = read_bot_username(args.recording) or bot_username
+    else:
+        updates = synthesize_updates(args.synthesize, args.rate, triggers)
+
+    bot_api = FakeBotAPI(args.bot_latency_ms, bot_username)
+    supabase = FakeSupabase(triggers, {"ai_model": "replay-model", "ai_temperature": "0.7"}, args.db_latency_ms)
+    ai = FakeOpenAI(args.ai_latency_ms)
+    bot_url = await bot_api.start()
+    supabase_url = await supabase.start()
+    ai_url = await ai.start()
+
+    tmp = tempfile.mkdtemp(prefix="replay-")
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+        "NANOGPT_API_KEY": "replay",
+        "NANOGPT_BASE_URL": f"{ai_url}/v1",
+        "ADMIN_ID": os.environ.get("ADMIN_ID", "1"),
+        "SNAPSHOT_PATH": "",
+        "PHOTO_SPILL_PATH": os.path.join(tmp, "spill.jsonl"),
+        "LOOP_MONITOR_INTERVAL": "0",
+        "RECORD_UPDATES_PATH": "",
+        "WORKERS": "1",
+        "METRICS_PORT": os.environ.get("METRICS_PORT", "0"),
+    })
+    if args.unlimited_sends:
+        os.environ.update({"SEND_GLOBAL_RATE": "1e9", "SEND_CHAT_RATE": "1e9", "SEND_GROUP_RATE": "1e9"})
+
+    # Imported only now: config reads the environment on import
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import main as bot_main
+    import handlers
+    import ai_client
+    from utils import LoopStallMonitor
+
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(bot_url)))
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+    # As main.main() does before serving
+    await handlers.bot_identity.refresh(bot)
+
+    monitor = LoopStallMonitor(interval=0.01, report_seconds=0)
+    monitor_task = asyncio.create_task(monitor.run())
+    results = {"latencies": [], "errors": Counter()}
+    try:
+        await bot_main.run_bot(dp, bot, lambda: replay(dp, bot, updates, args.speed, args.concurrency, results))
+    finally:
+        monitor_task.cancel()
+        await bot_api.close()
+        await supabase.close()
+        await ai.close()
+
+    latencies = sorted(results["latencies"])
+    elapsed = results["finished"] - results["started"]
+    return {
+        "updates": len(updates),
+        "handled": len(latencies),
+        "errors": dict(results["errors"]),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "event_loop_lag": {
+            **monitor.stats(),
+            "mean_ms": round(monitor.total_stall / monitor.samples * 1000, 3) if monitor.samples else 0.0,
+        },
+        "calls": {
+            "telegram": dict(bot_api.calls),
+            "supabase": dict(supabase.calls),
+            "ai_by_model": dict(ai.calls),
+        },
+        "pipeline": handlers.pipeline.stats(),
+        "outbound": handlers.outbound.stats(),
+        "ai_scheduler": ai_client.ai_scheduler.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--recording", help="file written by the bot with RECORD_UPDATES_PATH")
+    source.add_argument("--synthesize", type=int, default=2000, help="number of synthetic updates")
+    parser.add_argument("--rate", type=float, default=100, help="synthetic updates per second")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=100, help="updates handled at once")
+    parser.add_argument("--triggers", help="JSON file with trigger rows")
+    parser.add_argument("--synthetic-triggers", type=int, default=500)
+    parser.add_argument("--ai-share", type=float, default=0.1, help="share of synthetic triggers of type ai")
+    parser.add_argument("--bot-latency-ms", type=float, default=30)
+    parser.add_argument("--db-latency-ms", type=float, default=20)
+    parser.add_argument("--ai-latency-ms", type=float, default=500)
+    parser.add_argument("--unlimited-sends", action="store_true", help="lift the outbound flood limits")
+    parser.add_argument("--output", help="also write the report JSON here")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Throughput of the sharded setup on a synthetic load.
+
+The ingress side is the real one: a Dispatcher with ShardRouter that puts
+each update on the queue of the worker owning its chat. Each worker process
+runs serve_shard() with a handler doing the CPU-bound part of the bot's
+work (trigger matching against a synthetic trigger set and a cooldown claim
+on the chosen state backend); Telegram, Supabase and the AI API are left
+out. Runs once per worker count and reports updates per second.
+
+    python bench/shard_load.py --workers 1 2 4 --updates 20000 --state sqlite
+
+Scaling is bounded by the number of CPU cores on the machine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, Router  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+from sharding import ShardRouter, WorkerPool, serve_shard  # noqa: E402
+from bench_matching import make_corpus, make_triggers  # noqa: E402
+
+TOKEN = "123456:bench"
+
+
+def make_updates(count: int, triggers: list) -> list:
+    """Medium-length messages from the matching benchmark's corpus, spread over its 50 chats."""
+    corpus = make_corpus(triggers, "medium", count)
+    return [
+        Update.model_validate({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": "Bench"},
+                "from": {"id": 1000 + update_id % 97, "is_bot": False, "first_name": "Bench"},
+                "text": text,
+            },
+        })
+        for update_id, (chat_id, text) in enumerate(corpus, 1)
+    ]
+
+
+def bench_worker(index: int, updates, results, options: dict):
+    """Worker process: match every update, claim cooldowns, report how many were handled."""
+    os.environ.setdefault("BOT_TOKEN", TOKEN)
+    from trigger_index import TriggerIndex
+    from utils import check_message_for_triggers
+    from state_backend import create_state_backend
+
+    index_ = TriggerIndex(make_triggers(options["triggers"]))
+    state = create_state_backend(options["state"], options["state_path"])
+    handled = 0
+
+    router = Router()
+
+    @router.message()
+    async def probe(message: Message):
+        nonlocal handled
+        trigger = check_message_for_triggers(message.text, index_, chat_id=message.chat.id)
+        if trigger:
+            state.claim_cooldown(message.chat.id, trigger["id"], trigger["cooldown"], message.date.timestamp())
+        handled += 1
+
+    async def run():
+        bot = Bot(TOKEN)
+        dp = Dispatcher()
+        dp.include_router(router)
+        results.put(("ready", index))
+        await serve_shard(updates, dp, bot, options["concurrency"])
+        await bot.session.close()
+
+    asyncio.run(run())
+    state.close()
+    results.put(("done", handled))
+
+
+async def run_once(workers: int, args, state_path: str) -> dict:
+    options = {"triggers": args.triggers, "state": args.state, "state_path": state_path,
+               "concurrency": args.concurrency}
+    pool = WorkerPool(None, workers)
+    results = pool._context.Queue()
+    pool.target = _Target(results, options)
+    pool.start()
+    for _ in range(workers):
+        await asyncio.to_thread(results.get)
+
+    updates = make_updates(args.updates, make_triggers(args.triggers))
+    bot = Bot(TOKEN)
+    dp = Dispatcher()
+    dp.update.outer_middleware(ShardRouter(pool.queues))
+
+    start = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    await pool.stop(timeout=600)
+    elapsed = time.perf_counter() - start
+    handled = 0
+    for _ in range(workers):
+        handled += (await asyncio.to_thread(results.get))[1]
+    await bot.session.close()
+    return {
+        "workers": workers,
+        "handled": handled,
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(handled / elapsed, 1),
+    }
+
+
+class _Target:
+    """Picklable worker target carrying the result queue and options."""
+
+    def __init__(self, results, options: dict):
+        self.results = results
+        self.options = options
+
+    def __call__(self, index: int, updates):
+        bench_worker(index, updates, self.results, self.options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--triggers", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--state", choices=("memory", "sqlite"), default="memory")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            state_path = os.path.join(tmp, f"state-{workers}.sqlite3")
+            runs.append(asyncio.run(run_once(workers, args, state_path)))
+    base = runs[0]["updates_per_second"] / runs[0]["workers"]
+    for run in runs:
+        run["scaling_efficiency"] = round(run["updates_per_second"] / (base * run["workers"]), 2)
+    print(json.dumps({"cpu_count": os.cpu_count(), "state": args.state, "runs": runs}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
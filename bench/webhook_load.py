@@ -0,0 +1,248 @@
+"""
+Load test for update ingestion: long polling vs. the webhook server.
+
+Runs a fake Telegram Bot API on localhost, a Dispatcher with a probe handler
+(optionally sleeping --work-ms to imitate handler work) and feeds it synthetic
+message updates, either through getUpdates or by POSTing them to the local
+webhook endpoint. Reports throughput and the latency from an update being
+offered to its handler finishing.
+
+    python bench/webhook_load.py --mode webhook --updates 5000 --rate 500
+    python bench/webhook_load.py --mode polling --updates 5000 --rate 500
+
+With --target the script only POSTs to an already running webhook (for
+example the bot started with BOT_MODE=webhook) and measures HTTP response
+latency, since handler completion is not visible from outside.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+
+
+def make_update(update_id: int, chats: int) -> dict:
+    chat_id = -1000000000000 - update_id % chats
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Bench"},
+            "from": {"id": 1000 + update_id % 97, "is_bot": False, "first_name": "Bench"},
+            "text": f"synthetic message {update_id}",
+        },
+    }
+
+
+class FakeBotAPI:
+    """Minimal Bot API: getUpdates serves the pending updates, everything else returns ok."""
+
+    def __init__(self):
+        self.pending = []
+        self._available = asyncio.Event()
+
+    def offer(self, update: dict):
+        self.pending.append(update)
+        self._available.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            data = await request.post()
+            offset = int(data.get("offset") or 0)
+            timeout = float(data.get("timeout") or 0)
+            self.pending = [u for u in self.pending if u["update_id"] >= offset]
+            if not self.pending:
+                self._available.clear()
+                try:
+                    await asyncio.wait_for(self._available.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            result = self.pending[:100]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+def report(mode: str, latencies: list, elapsed: float, extra: dict = None) -> dict:
+    latencies = sorted(latencies)
+    result = {
+        "mode": mode,
+        "updates": len(latencies),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+    if latencies:
+        result.update({
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        })
+    result.update(extra or {})
+    return result
+
+
+async def produce(args, offer):
+    """Offer args.updates updates at args.rate per second (0 = as fast as possible)."""
+    interval = 1 / args.rate if args.rate > 0 else 0
+    start = time.perf_counter()
+    for update_id in range(1, args.updates + 1):
+        if interval:
+            delay = start + update_id * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await offer(make_update(update_id, args.chats))
+
+
+async def run_local(args) -> dict:
+    api = FakeBotAPI()
+    api_runner = await api.start(args.api_port)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.api_port}"))
+    bot = Bot(TOKEN, session=session)
+
+    offered = {}
+    latencies = []
+    done = asyncio.Event()
+
+    router = Router()
+
+    @router.message()
+    async def probe(message: Message):
+        if args.work_ms:
+            await asyncio.sleep(args.work_ms / 1000)
+        latencies.append(time.perf_counter() - offered[message.message_id])
+        if len(latencies) >= args.updates:
+            done.set()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+
+    posted = {"rejected": 0}
+    if args.mode == "polling":
+        runner = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+        async def offer(update):
+            offered[update["update_id"]] = time.perf_counter()
+            api.offer(update)
+    else:
+        server = WebhookServer(dp, bot, "/webhook", SECRET, args.queue_size, args.workers)
+        await server.start("127.0.0.1", args.port)
+        http = ClientSession()
+        url = f"http://127.0.0.1:{args.port}/webhook"
+        semaphore = asyncio.Semaphore(args.connections)
+        posts = set()
+
+        async def post(update):
+            async with semaphore:
+                while True:
+                    offered.setdefault(update["update_id"], time.perf_counter())
+                    async with http.post(url, json=update, headers={SECRET_HEADER: SECRET}) as response:
+                        if response.status != 503:
+                            return
+                    # Like Telegram, deliver rejected updates again a bit later
+                    posted["rejected"] += 1
+                    await asyncio.sleep(0.05)
+
+        async def offer(update):
+            task = asyncio.create_task(post(update))
+            posts.add(task)
+            task.add_done_callback(posts.discard)
+
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    await produce(args, offer)
+    try:
+        await asyncio.wait_for(done.wait(), args.deadline)
+    except asyncio.TimeoutError:
+        print(f"Only {len(latencies)}/{args.updates} updates handled before the deadline", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    if args.mode == "polling":
+        await dp.stop_polling()
+        await runner
+    else:
+        await server.close()
+        await http.close()
+    await bot.session.close()
+    await api_runner.cleanup()
+    return report(args.mode, latencies, elapsed, {"rejected_posts": posted["rejected"]} if args.mode == "webhook" else None)
+
+
+async def run_target(args) -> dict:
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(args.connections)
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+
+    async with ClientSession() as http:
+        async def post(update):
+            nonlocal failures
+            async with semaphore:
+                sent = time.perf_counter()
+                async with http.post(args.target, json=update, headers=headers) as response:
+                    if response.status == 200:
+                        latencies.append(time.perf_counter() - sent)
+                    else:
+                        failures += 1
+
+        tasks = []
+
+        async def offer(update):
+            tasks.append(asyncio.create_task(post(update)))
+
+        start = time.perf_counter()
+        await produce(args, offer)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return report("target", latencies, elapsed, {"failed_posts": failures})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="webhook")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=0, help="updates per second, 0 = unthrottled")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--work-ms", type=float, default=0, help="simulated handler time")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent webhook POSTs")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--api-port", type=int, default=8082)
+    parser.add_argument("--deadline", type=float, default=120)
+    parser.add_argument("--target", help="URL of a running webhook to load instead")
+    parser.add_argument("--secret", default="", help="secret token for --target")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_target(args) if args.target else run_local(args))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 NANOGPT_API_KEY = os.getenv("NANOGPT_API_KEY")
 NANOGPT_MODEL = os.getenv("NANOGPT_MODEL", "gpt-4o-mini")
+NANOGPT_BASE_URL = os.getenv("NANOGPT_BASE_URL", "https://nano-gpt.com/api/v1")
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN is not set in environment variables")
@@ -19,3 +20,128 @@ if not NANOGPT_API_KEY:
 ADMIN_ID = os.getenv("ADMIN_ID")
 if not ADMIN_ID:
     print("WARNING: ADMIN_ID is not set. Admin notifications will not be sent.")
+
+# Supabase data access: per-call timeout and size of the blocking-call executor
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "4"))
+
+# Event-loop stall monitor: probe interval in seconds (0 disables) and report period
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_MONITOR_REPORT_SECONDS = float(os.getenv("LOOP_MONITOR_REPORT_SECONDS", "300"))
+
+# Write-behind queue for chat_photos inserts
+PHOTO_BATCH_SIZE = int(os.getenv("PHOTO_BATCH_SIZE", "50"))
+PHOTO_FLUSH_SECONDS = float(os.getenv("PHOTO_FLUSH_SECONDS", "2"))
+PHOTO_QUEUE_MAX = int(os.getenv("PHOTO_QUEUE_MAX", "1000"))
+PHOTO_SPILL_PATH = os.getenv("PHOTO_SPILL_PATH", "chat_photos.spill.jsonl")
+
+# Background trigger sync: seconds between incremental fetches (0 disables)
+# and how many cycles between full reloads (catches hard deletes)
+TRIGGER_SYNC_INTERVAL = float(os.getenv("TRIGGER_SYNC_INTERVAL", "30"))
+TRIGGER_FULL_SYNC_EVERY = int(os.getenv("TRIGGER_FULL_SYNC_EVERY", "20"))
+
+# AI conversation memory: max chats kept (LRU) and how often idle sessions are swept
+AI_HISTORY_MAX_CHATS = int(os.getenv("AI_HISTORY_MAX_CHATS", "5000"))
+AI_HISTORY_SWEEP_SECONDS = float(os.getenv("AI_HISTORY_SWEEP_SECONDS", "600"))
+
+# Local state snapshot for fast warm restarts (empty path disables)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "bot_state.sqlite3")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))
+
+# AI request scheduler: concurrency cap, per-request deadline and circuit breaker
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "30"))
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RECOVERY_SECONDS = float(os.getenv("AI_BREAKER_RECOVERY_SECONDS", "30"))
+
+# AI response cache (used by triggers that set ai_cache_ttl)
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1000"))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# Stream AI replies into the chat by editing a placeholder (triggers can override with ai_stream)
+AI_STREAMING = os.getenv("AI_STREAMING", "false").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Outbound Telegram sends: messages per second globally, per private chat and per group,
+# burst size per chat, and how often a flood-limited send is retried
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Admin notifications: seconds collected into one digest (0 sends each event immediately;
+# triggers can opt out with notify_immediately)
+ADMIN_DIGEST_SECONDS = float(os.getenv("ADMIN_DIGEST_SECONDS", "60"))
+
+# How updates arrive: "polling" (default) or "webhook" on a local aiohttp server.
+# WEBHOOK_URL is the public address registered with Telegram (empty skips setWebhook,
+# e.g. when it is registered elsewhere); without WEBHOOK_SECRET a random one is used
+# when we register the webhook ourselves.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+
+# Horizontal sharding: WORKERS > 1 runs one ingress process (polling or webhook, see BOT_MODE)
+# that hands every update to worker process hash(chat_id) % WORKERS. WORKER_INDEX is set
+# by the ingress for its workers; each worker handles up to WORKER_CONCURRENCY updates at once.
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_INDEX = os.getenv("WORKER_INDEX")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "16"))
+
+# Where cooldowns and AI history live: "memory" (per process) or "sqlite" (STATE_DB_PATH,
+# shared by all workers, so state stays correct when chats move between them)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_shared_state.sqlite3")
+
+# Per-process files get the worker's index so workers do not overwrite each other
+if WORKER_INDEX is not None:
+    SNAPSHOT_PATH = f"{SNAPSHOT_PATH}.{WORKER_INDEX}" if SNAPSHOT_PATH else SNAPSHOT_PATH
+    PHOTO_SPILL_PATH = f"{PHOTO_SPILL_PATH}.{WORKER_INDEX}" if PHOTO_SPILL_PATH else PHOTO_SPILL_PATH
+
+# Record every incoming update (personal data stripped) to this gzip file for bench/replay.py
+# (empty disables)
+RECORD_UPDATES_PATH = os.getenv("RECORD_UPDATES_PATH", "")
+
+# Prometheus-style metrics on http://METRICS_HOST:METRICS_PORT/metrics (0 disables).
+# Sharded workers serve theirs on METRICS_PORT + 1 + WORKER_INDEX.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+if WORKER_INDEX is not None and METRICS_PORT:
+    METRICS_PORT += 1 + int(WORKER_INDEX)
+
+# Share of AI requests whose full prompt and reply are logged (only when logging at DEBUG)
+AI_LOG_SAMPLE_RATE = float(os.getenv("AI_LOG_SAMPLE_RATE", "0.05"))
+
+# Trigger pipeline: messages of a chat are handled one at a time, in order, from a
+# queue of PIPELINE_CHAT_QUEUE. Past PIPELINE_SHED_WATERMARK of a queue only
+# PIPELINE_SHED_SAMPLE of ordinary messages are kept; replies to the bot are dropped last.
+PIPELINE_CHAT_QUEUE = int(os.getenv("PIPELINE_CHAT_QUEUE", "20"))
+PIPELINE_SHED_WATERMARK = float(os.getenv("PIPELINE_SHED_WATERMARK", "0.5"))
+PIPELINE_SHED_SAMPLE = float(os.getenv("PIPELINE_SHED_SAMPLE", "0.25"))
+
+# Token budget for the prompt context of AI triggers (system prompt, history and message),
+# overridable in app_config: ai_context_tokens, or ai_context_tokens:<model> per model.
+# With ai_context_summary (app_config, or AI_CONTEXT_SUMMARY) history that falls off the
+# history ring or no longer fits is rolled into a summary made in the background by
+# ai_summary_model (default: the same model).
+AI_CONTEXT_TOKENS = int(os.getenv("AI_CONTEXT_TOKENS", "3000"))
+AI_CONTEXT_SUMMARY = os.getenv("AI_CONTEXT_SUMMARY", "false").lower() in ("1", "true", "yes", "on")
+# Summaries run beside replies, at most this many at once, with their own circuit breaker
+AI_SUMMARY_CONCURRENCY = int(os.getenv("AI_SUMMARY_CONCURRENCY", "2"))
+
+# Seconds between background refreshes of the bot's own identity (getMe)
+BOT_IDENTITY_REFRESH_SECONDS = float(os.getenv("BOT_IDENTITY_REFRESH_SECONDS", str(6 * 3600)))
+# Photos remembered by file_unique_id; a photo seen again is not saved or forwarded twice
+PHOTO_DEDUP_MAX = int(os.getenv("PHOTO_DEDUP_MAX", "10000"))
+
+# Trigger matching in MATCH_WORKERS separate processes (0 matches on the event loop).
+# Only used while at least MATCH_OFFLOAD_MIN_TRIGGERS triggers are loaded; smaller sets
+# are matched inline, where it is cheaper than the round trip to a worker.
+MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", "0"))
+MATCH_OFFLOAD_MIN_TRIGGERS = int(os.getenv("MATCH_OFFLOAD_MIN_TRIGGERS", "2000"))
@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+
+# Tokens a chat message costs on top of its content (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# A turn is cut down rather than dropped only if at least this much of it fits
+MIN_TRUNCATED_TOKENS = 32
+TRUNCATION_MARK = "…"
+
+
+@lru_cache(maxsize=16384)
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count of text: one token per 4 bytes of UTF-8, which comes
+    out near real tokenizers for English (about 4 characters per token)
+    and Cyrillic (about 2). Cached per distinct text, so every history
+    entry is measured once however often it is sent.
+    """
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """The start of text, cut to about tokens tokens."""
+    total = estimate_tokens(text)
+    if total <= tokens:
+        return text
+    return text[:max(len(text) * tokens // total - 1, 0)].rstrip() + TRUNCATION_MARK
+
+
+def fit_history(history: list, budget: int) -> tuple:
+    """
+    Newest-first selection of history messages within budget tokens.
+    The newest turn that does not fit whole is truncated when enough of it
+    fits; everything older is left out.
+
+    Returns (kept messages oldest first, dropped messages oldest first).
+    """
+    kept = []
+    remaining = budget
+    cut = 0
+    for position in range(len(history) - 1, -1, -1):
+        message = history[position]
+        cost = message_tokens(message)
+        if cost <= remaining:
+            kept.append(message)
+            remaining -= cost
+            continue
+        cut = position + 1
+        content_budget = remaining - MESSAGE_OVERHEAD_TOKENS
+        if content_budget >= MIN_TRUNCATED_TOKENS:
+            kept.append({"role": message["role"], "content": truncate_to_tokens(message["content"], content_budget)})
+        break
+    kept.reverse()
+    return kept, history[:cut]
+
+
+def turns_fingerprint(messages: list) -> str:
+    """Identifies a run of history messages, to tell whether a summary covers them."""
+    digest = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        digest.update(message["role"].encode())
+        digest.update(b"\x1f")
+        digest.update(message["content"].encode())
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+
+class _ChatSummary:
+    __slots__ = ("summary", "covered", "pending", "task")
+
+    def __init__(self):
+        self.summary = None
+        # Fingerprints of turns still in the history that are summarized (or about to be)
+        self.covered = set()
+        self.pending = []
+        self.task = None
+
+
+class SummaryCache:
+    """
+    Per-chat rolling summaries of the history turns that left the prompt:
+    turns that fell off the history ring, and turns still in it that no
+    longer fit the token budget.
+
+    add() queues the turns the summary does not cover yet, and a background
+    task per chat folds them into it with summarize(previous summary, turns),
+    so every turn is summarized once. get() returns the current summary
+    without waiting. max_chats summaries are kept in LRU order.
+    """
+
+    def __init__(self, max_chats: int = 1000):
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> _ChatSummary
+        self.refreshes = 0
+        self.failures = 0
+        self.summarized_turns = 0
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "refreshing": sum(entry.task is not None for entry in self._chats.values()),
+            "pending_turns": sum(len(entry.pending) for entry in self._chats.values()),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "summarized_turns": self.summarized_turns,
+        }
+
+    def get(self, chat_id: int) -> str | None:
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            return None
+        self._chats.move_to_end(chat_id)
+        return entry.summary
+
+    def clear(self, chat_id: int):
+        entry = self._chats.pop(chat_id, None)
+        if entry is not None and entry.task is not None:
+            entry.task.cancel()
+
+    def add(self, chat_id: int, turns: list, summarize, in_history: bool = True):
+        """
+        Queue turns for the chat's summary, skipping the ones it already covers.
+
+        Args:
+            turns: History messages, oldest first
+            summarize: async summarize(previous summary or None, turns) -> summary
+            in_history: False for turns that fell off the history ring (they
+                will not be seen again), True for turns still in it
+        """
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = _ChatSummary()
+            while len(self._chats) > self.max_chats:
+                _, evicted = self._chats.popitem(last=False)
+                if evicted.task is not None:
+                    evicted.task.cancel()
+        self._chats.move_to_end(chat_id)
+
+        for turn in turns:
+            fingerprint = turns_fingerprint([turn])
+            if fingerprint in entry.covered:
+                if not in_history:
+                    entry.covered.discard(fingerprint)
+                continue
+            if in_history:
+                entry.covered.add(fingerprint)
+            entry.pending.append(turn)
+        if entry.pending and entry.task is None:
+            entry.task = asyncio.create_task(self._refresh(chat_id, entry, summarize))
+
+    async def _refresh(self, chat_id: int, entry: _ChatSummary, summarize):
+        try:
+            # Turns queued while a summary is being made go into the next one
+            while entry.pending:
+                turns, entry.pending = entry.pending, []
+                try:
+                    summary = await summarize(entry.summary, turns)
+                except Exception as e:
+                    self.failures += 1
+                    logging.warning(f"🤖 Failed to summarize {len(turns)} turns of chat {chat_id}: {e!r}")
+                    continue
+                if summary:
+                    entry.summary = summary
+                    self.refreshes += 1
+                    self.summarized_turns += len(turns)
+        finally:
+            entry.task = None
+
+    async def close(self):
+        tasks = [entry.task for entry in self._chats.values() if entry.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def build_messages(system_prompt: str, history: list, user_message: str, budget: int,
+                   summary: str = None) -> tuple:
+    """
+    Chat messages for one request within budget tokens: the system prompt and
+    the user message always go in, then as much recent history as the rest of
+    the budget allows, preceded by the summary of earlier turns (if given).
+
+    Returns (messages, dropped history messages oldest first).
+    """
+    system = {"role": "system", "content": system_prompt}
+    user = {"role": "user", "content": user_message}
+    remaining = budget - message_tokens(system) - message_tokens(user)
+
+    kept, dropped = fit_history(history, max(remaining, 0))
+    messages = [system]
+    if summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        summary_cost = message_tokens(summary_message)
+        # Worth it only while it leaves at least as much room for the recent turns
+        if summary_cost * 2 <= remaining:
+            kept, dropped = fit_history(history, remaining - summary_cost)
+            messages.append(summary_message)
+    messages.extend(kept)
+    messages.append(user)
+    return messages, dropped
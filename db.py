@@ -1,20 +1,83 @@
-from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from supabase import create_client, Client, ClientOptions
+from config import SUPABASE_URL, SUPABASE_KEY, DB_TIMEOUT_SECONDS, DB_MAX_WORKERS
+from metrics import DB_SECONDS
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# One client for the whole process: its HTTP session (and connection pool) is reused
+# by every query. The HTTP timeout matches the per-call timeout below so a timed-out
+# call also frees its executor thread.
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT_SECONDS)
+)
 
-async def get_all_triggers():
-    """Fetches all triggers from Supabase."""
+# The supabase client is synchronous; queries run on this bounded pool so they never
+# block the event loop, and at most DB_MAX_WORKERS round trips are in flight at once.
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+async def run_query(query, name: str = "query", timeout: float = DB_TIMEOUT_SECONDS):
+    """
+    Executes a supabase query builder off the event loop.
+    Its duration is recorded under name in the DB latency histogram.
+
+    Raises asyncio.TimeoutError if the call takes longer than timeout seconds.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        response = supabase.table("triggers").select("*").eq("enabled", True).execute()
+        response = await asyncio.wait_for(loop.run_in_executor(_executor, query.execute), timeout)
+        outcome = "ok"
+        return response
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, name, outcome)
+
+def shutdown_db():
+    """Stops the DB executor. Queued queries are cancelled."""
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+async def get_all_triggers() -> list | None:
+    """Fetches all enabled triggers from Supabase, ordered by id. Returns None on failure."""
+    try:
+        response = await run_query(supabase.table("triggers").select("*").eq("enabled", True).order("id"), "get_all_triggers")
         return response.data
     except Exception as e:
-        print(f"Error fetching triggers: {e}")
-        return []
+        print(f"Error fetching triggers: {e!r}")
+        return None
 
-def save_chat_photo(chat_id: int, user_id: int, message_id: int, photo_data: dict, caption: str = None):
+async def get_triggers_changed_since(since) -> list | None:
+    """
+    Fetches triggers (enabled or not) with updated_at at or after the watermark.
+    Returns None on failure.
     """
-    Saves photo information to the database.
+    try:
+        response = await run_query(
+            supabase.table("triggers").select("*").gte("updated_at", since).order("updated_at"),
+            "get_triggers_changed_since"
+        )
+        return response.data
+    except Exception as e:
+        print(f"Error fetching trigger changes: {e!r}")
+        return None
+
+async def get_app_config() -> list | None:
+    """Fetches all app_config rows. Returns None on failure."""
+    try:
+        response = await run_query(supabase.table("app_config").select("*"), "get_app_config")
+        return response.data
+    except Exception as e:
+        print(f"Error fetching app config: {e!r}")
+        return None
+
+def build_photo_row(chat_id: int, user_id: int, message_id: int, photo_data: dict, caption: str = None) -> dict:
+    """
+    Builds a chat_photos row.
     
     Args:
         chat_id: Telegram chat ID
@@ -23,21 +86,23 @@ def save_chat_photo(chat_id: int, user_id: int, message_id: int, photo_data: dic
         photo_data: Dict with file_id, file_unique_id, width, height, file_size
         caption: Optional caption text
     """
+    return {
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "message_id": message_id,
+        "file_id": photo_data.get("file_id"),
+        "file_unique_id": photo_data.get("file_unique_id"),
+        "file_size": photo_data.get("file_size"),
+        "width": photo_data.get("width"),
+        "height": photo_data.get("height"),
+        "caption": caption
+    }
+
+async def insert_chat_photos(rows: list) -> list | None:
+    """Bulk-inserts chat_photos rows in one request. Returns None on failure."""
     try:
-        data = {
-            "chat_id": chat_id,
-            "user_id": user_id,
-            "message_id": message_id,
-            "file_id": photo_data.get("file_id"),
-            "file_unique_id": photo_data.get("file_unique_id"),
-            "file_size": photo_data.get("file_size"),
-            "width": photo_data.get("width"),
-            "height": photo_data.get("height"),
-            "caption": caption
-        }
-        response = supabase.table("chat_photos").insert(data).execute()
-        print(f"📸 Photo saved: chat={chat_id}, user={user_id}")
+        response = await run_query(supabase.table("chat_photos").insert(rows), "insert_chat_photos")
         return response.data
     except Exception as e:
-        print(f"Error saving photo: {e}")
+        print(f"Error saving {len(rows)} photos: {e!r}")
         return None
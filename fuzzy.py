@@ -0,0 +1,136 @@
+import numpy as np
+from rapidfuzz import fuzz, process
+
+FUZZY_THRESHOLD = 85  # Default per-trigger threshold (thefuzz-style rounded ratio)
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FuzzyMatcher:
+    """
+    Batched fuzzy keyword matcher for one trigger bucket.
+
+    Scores are the same as `thefuzz.fuzz.ratio` (rapidfuzz ratio rounded to an
+    int), so a keyword matches a word when round(ratio) >= its trigger's threshold.
+
+    Before scoring, keyword/word pairs are pruned with two filters that can
+    never drop a real match:
+    - length bounds: ratio <= 200 * min(len) / (len_a + len_b)
+    - shared bigram: two strings within indel distance d share at least
+      max(len) - 1 - 2 * d bigrams, so when that bound is positive they must
+      have one in common (looked up through an inverted bigram index).
+    The surviving pairs are scored in one `process.cdist` call.
+    """
+
+    __slots__ = (
+        "_keywords", "_ranks", "_thresholds", "_rank_start",
+        "_groups", "_bigram_index", "_cutoff", "_length_cache"
+    )
+
+    def __init__(self, keywords_by_rank: tuple, thresholds: tuple):
+        """
+        Args:
+            keywords_by_rank: Normalized keywords for each trigger, in priority order
+            thresholds: Fuzzy threshold for each trigger (same order)
+        """
+        keywords = []
+        ranks = []
+        keyword_thresholds = []
+        rank_start = []
+        for rank, (trigger_keywords, threshold) in enumerate(zip(keywords_by_rank, thresholds)):
+            rank_start.append(len(keywords))
+            for keyword in dict.fromkeys(trigger_keywords):
+                keywords.append(keyword)
+                ranks.append(rank)
+                keyword_thresholds.append(threshold)
+        rank_start.append(len(keywords))
+
+        # Keyword ids grouped by (length, threshold): the pruning bounds depend only on these
+        groups = {}
+        bigram_index = {}
+        for kw_id, keyword in enumerate(keywords):
+            groups.setdefault((len(keyword), keyword_thresholds[kw_id]), []).append(kw_id)
+            for gram in _bigrams(keyword):
+                bigram_index.setdefault(gram, set()).add(kw_id)
+
+        self._keywords = tuple(keywords)
+        self._ranks = tuple(ranks)
+        self._thresholds = np.array(keyword_thresholds, dtype=np.float64)
+        self._rank_start = tuple(rank_start)
+        self._groups = tuple((length, threshold, frozenset(ids)) for (length, threshold), ids in groups.items())
+        self._bigram_index = {gram: frozenset(ids) for gram, ids in bigram_index.items()}
+        # Lowest raw score that can still round up to the smallest threshold
+        self._cutoff = min(max(min(keyword_thresholds) - 0.5, 0.0), 100.0) if keyword_thresholds else 0.0
+        # word length -> (ids that need a shared bigram, ids that must always be scored)
+        self._length_cache = {}
+
+    def _candidates_for_length(self, word_len: int) -> tuple:
+        cached = self._length_cache.get(word_len)
+        if cached is not None:
+            return cached
+
+        filtered = set()
+        bypass = set()
+        for kw_len, threshold, ids in self._groups:
+            total = kw_len + word_len
+            c = 2 * threshold - 1
+            # Length bound: 200 * min / total >= threshold - 0.5
+            if 400 * min(kw_len, word_len) < c * total:
+                continue
+            # Largest indel distance that still reaches the threshold
+            max_distance = (total * (201 - 2 * threshold)) // 200
+            if max(kw_len, word_len) - 1 - 2 * max_distance >= 1:
+                filtered |= ids
+            else:
+                bypass |= ids
+
+        cached = (frozenset(filtered), frozenset(bypass))
+        self._length_cache[word_len] = cached
+        return cached
+
+    def first_match(self, words: list, limit: int = None) -> int | None:
+        """
+        Returns the lowest trigger rank (below limit) with a keyword that fuzzy-matches
+        any of the words, or None.
+        """
+        if limit is None:
+            limit = len(self._rank_start) - 1
+        id_limit = self._rank_start[limit]
+        if not id_limit or not words:
+            return None
+
+        bigram_index = self._bigram_index
+        candidate_ids = set()
+        candidate_words = []
+        for word in dict.fromkeys(words):
+            filtered, bypass = self._candidates_for_length(len(word))
+            ids = set(bypass)
+            if filtered:
+                for gram in _bigrams(word):
+                    hits = bigram_index.get(gram)
+                    if hits:
+                        ids |= hits & filtered
+            ids = {kw_id for kw_id in ids if kw_id < id_limit}
+            if ids:
+                candidate_ids |= ids
+                candidate_words.append(word)
+
+        if not candidate_ids:
+            return None
+
+        kw_ids = sorted(candidate_ids)
+        scores = process.cdist(
+            [self._keywords[kw_id] for kw_id in kw_ids],
+            candidate_words,
+            scorer=fuzz.ratio,
+            score_cutoff=self._cutoff,
+            dtype=np.float64,
+        )
+        # Same rounding as thefuzz: int(round(ratio)) >= threshold
+        thresholds = self._thresholds[kw_ids]
+        hit_rows = np.flatnonzero((np.rint(scores) >= thresholds[:, None]).any(axis=1))
+        if not hit_rows.size:
+            return None
+        return self._ranks[kw_ids[hit_rows[0]]]
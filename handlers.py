@@ -1,17 +1,92 @@
+import asyncio
+import logging
 from aiogram import Router, F, types
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
-from db import get_all_triggers, save_chat_photo
-from utils import check_message_for_triggers, CooldownManager
+from config import (
+    PHOTO_BATCH_SIZE, PHOTO_FLUSH_SECONDS, PHOTO_QUEUE_MAX, PHOTO_SPILL_PATH,
+    TRIGGER_SYNC_INTERVAL, TRIGGER_FULL_SYNC_EVERY, AI_STREAMING, STREAM_EDIT_INTERVAL,
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_GROUP_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES,
+    ADMIN_ID, ADMIN_DIGEST_SECONDS, WORKERS, BOT_IDENTITY_REFRESH_SECONDS, PHOTO_DEDUP_MAX,
+    PIPELINE_CHAT_QUEUE, PIPELINE_SHED_WATERMARK, PIPELINE_SHED_SAMPLE,
+    MATCH_WORKERS, MATCH_OFFLOAD_MIN_TRIGGERS
+)
+from db import build_photo_row, insert_chat_photos
+from photo_queue import PhotoWriteQueue
+from streaming import StreamingReply
+from outbound import OutboundDispatcher, PRIORITY_NOTIFY
+from notifications import NotificationAggregator
+from pipeline import ChatPipeline, PRIORITY_HIGH, PRIORITY_LOW
+from utils import BotIdentity, RecentKeys
+from normalize import NormalizedMessage, escape_markdown, normalized
+from match_pool import MatchPool
+from metrics import (
+    STAGE_SECONDS, TRIGGER_HITS, COOLDOWN_BLOCKED, ERRORS, PREFILTER_CHECKED, PREFILTER_REJECTED
+)
+from state_backend import chat_state
+from trigger_index import TriggerIndex
+from trigger_sync import TriggerSync, SupabaseTriggerSource
 from ai_client import get_ai_response, refresh_ai_config, get_ai_config, clear_chat_history
 
 router = Router()
-cooldown_manager = CooldownManager()
+photo_queue = PhotoWriteQueue(
+    insert_chat_photos,
+    max_batch=PHOTO_BATCH_SIZE,
+    flush_interval=PHOTO_FLUSH_SECONDS,
+    max_pending=PHOTO_QUEUE_MAX,
+    spill_path=PHOTO_SPILL_PATH
+)
+# All replies and admin notifications go out through here (rate limits, per-chat order).
+# Sharded workers split the global rate; per-chat limits hold since a chat has one worker.
+outbound = OutboundDispatcher(
+    global_rate=SEND_GLOBAL_RATE / max(WORKERS, 1),
+    chat_rate=SEND_CHAT_RATE,
+    group_rate=SEND_GROUP_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    max_retries=SEND_MAX_RETRIES
+)
+# Admin notifications are batched into digests unless ADMIN_DIGEST_SECONDS is 0
+notifier = NotificationAggregator(outbound, ADMIN_ID, window=ADMIN_DIGEST_SECONDS)
+# Per-chat ordered queues for trigger handling, with load shedding during floods
+pipeline = ChatPipeline(
+    max_queue=PIPELINE_CHAT_QUEUE,
+    shed_watermark=PIPELINE_SHED_WATERMARK,
+    shed_sample=PIPELINE_SHED_SAMPLE
+)
+# Filled at startup (main), so handlers need no getMe per message
+bot_identity = BotIdentity(refresh_seconds=BOT_IDENTITY_REFRESH_SECONDS)
+# file_unique_id of photos already saved and forwarded
+seen_photos = RecentKeys(max_entries=PHOTO_DEDUP_MAX)
+# Matches in worker processes when the trigger set is large (MATCH_WORKERS)
+match_pool = MatchPool(workers=MATCH_WORKERS, min_triggers=MATCH_OFFLOAD_MIN_TRIGGERS)
 TRIGGERS_CACHE = []
+TRIGGERS_INDEX = TriggerIndex([])
+
+async def set_triggers(triggers: list):
+    """
+    Swaps in a new trigger snapshot. The index is compiled in an executor thread,
+    reusing the buckets of the current one that did not change, and replaced
+    only once it is complete.
+    """
+    global TRIGGERS_CACHE, TRIGGERS_INDEX
+    loop = asyncio.get_running_loop()
+    index = await loop.run_in_executor(None, TriggerIndex, triggers, TRIGGERS_INDEX)
+    snapshot_path = await loop.run_in_executor(None, match_pool.prepare, index)
+    match_pool.load(index, snapshot_path)
+    TRIGGERS_INDEX = index
+    TRIGGERS_CACHE = triggers
+
+trigger_sync = TriggerSync(
+    SupabaseTriggerSource(),
+    on_snapshot=set_triggers,
+    interval=TRIGGER_SYNC_INTERVAL,
+    full_sync_every=TRIGGER_FULL_SYNC_EVERY
+)
 
 async def refresh_triggers():
-    global TRIGGERS_CACHE
-    TRIGGERS_CACHE = await get_all_triggers()
-    print(f"Loaded {len(TRIGGERS_CACHE)} triggers.")
+    """Full reload of the trigger table."""
+    if await trigger_sync.full_sync():
+        print(f"Loaded {len(TRIGGERS_CACHE)} triggers.")
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin."""
@@ -58,9 +133,9 @@ async def reloadai_handler(message: types.Message):
         await message.answer("⛔ Access denied. Admin only.")
         return
     
-    refresh_ai_config()
-    model = get_ai_config('ai_model', 'gpt-4o-mini')
-    temp = get_ai_config('ai_temperature', '0.7')
+    await refresh_ai_config()
+    model = get_ai_config('ai_model')
+    temp = get_ai_config('ai_temperature')
     await message.answer(f"🔄 AI config reloaded!\n\n📊 **Current settings:**\n• Model: `{model}`\n• Temperature: `{temp}`", parse_mode="Markdown")
 
 @router.message(Command("aiconfig"))
@@ -70,8 +145,8 @@ async def aiconfig_handler(message: types.Message):
         await message.answer("⛔ Access denied. Admin only.")
         return
     
-    model = get_ai_config('ai_model', 'gpt-4o-mini')
-    temp = get_ai_config('ai_temperature', '0.7')
+    model = get_ai_config('ai_model')
+    temp = get_ai_config('ai_temperature')
     await message.answer(
         f"🤖 <b>AI Configuration</b>\n\n"
         f"• <b>Model:</b> <code>{model}</code>\n"
@@ -86,11 +161,74 @@ async def clearhistory_handler(message: types.Message):
     clear_chat_history(message.chat.id)
     await message.answer("🗑 История разговора с AI очищена.", parse_mode="HTML")
 
+async def save_photo(message: types.Message, photo: types.PhotoSize):
+    """Queues the chat_photos row; the queue bulk-inserts rows in the background."""
+    photo_data = {
+        "file_id": photo.file_id,
+        "file_unique_id": photo.file_unique_id,
+        "file_size": photo.file_size,
+        "width": photo.width,
+        "height": photo.height
+    }
+    await photo_queue.put(build_photo_row(
+        chat_id=message.chat.id,
+        user_id=message.from_user.id,
+        message_id=message.message_id,
+        photo_data=photo_data,
+        caption=message.caption
+    ))
+
+async def forward_photo_to_admin(message: types.Message, photo: types.PhotoSize, reason: str):
+    """Sends the photo to the admin (in the next digest, or right away) with who sent it and where."""
+    user = message.from_user
+    chat_title = message.chat.title or "Private Chat"
+    username = f"@{user.username}" if user.username else "No username"
+    
+    # Build message link
+    msg_link = "No link"
+    if message.chat.username:
+        msg_link = f"https://t.me/{message.chat.username}/{message.message_id}"
+    elif message.chat.id < 0:
+        cid = str(message.chat.id).replace("-100", "")
+        msg_link = f"https://t.me/c/{cid}/{message.message_id}"
+    
+    info_text = (
+        f"📸 <b>New Photo</b> ({reason})\n\n"
+        f"👤 <b>From:</b> {user.full_name} ({username})\n"
+        f"💬 <b>Chat:</b> {chat_title}\n"
+        f"🔗 <a href=\"{msg_link}\">View message</a>"
+    )
+    
+    if message.caption:
+        info_text += f"\n📝 <b>Caption:</b> {message.caption[:100]}"
+    
+    if ADMIN_DIGEST_SECONDS > 0:
+        # Sent with the next digest as part of a media group
+        notifier.add_photo(message.bot, photo.file_id, info_text)
+    else:
+        # Queued behind trigger replies; not awaited
+        forward = outbound.submit(int(ADMIN_ID), lambda: message.bot.send_photo(
+            chat_id=ADMIN_ID,
+            photo=photo.file_id,
+            caption=info_text,
+            parse_mode="HTML"
+        ), priority=PRIORITY_NOTIFY)
+        forward.add_done_callback(
+            lambda f: f.cancelled() or f.exception() is None
+            or print(f"Failed to forward photo to admin: {f.exception()}")
+        )
+
+async def _isolated(stage: str, coro):
+    """Runs one side effect of a handler; its failure is logged and counted, not raised."""
+    try:
+        await coro
+    except Exception as e:
+        ERRORS.inc(stage)
+        logging.error(f"{stage} failed: {e!r}")
+
 @router.message(F.photo)
 async def photo_handler(message: types.Message):
     """Saves photos sent directly to the bot and forwards to admin."""
-    from config import ADMIN_ID
-    
     # Check if we should save this photo:
     # 1. Private chat (direct message to bot)
     # 2. Reply to bot's message
@@ -103,10 +241,12 @@ async def photo_handler(message: types.Message):
         is_reply_to_bot = message.reply_to_message.from_user.id == message.bot.id
     
     is_bot_mentioned = False
-    bot_info = await message.bot.get_me()
-    bot_username = f"@{bot_info.username}".lower() if bot_info.username else None
-    if bot_username and message.caption:
-        is_bot_mentioned = bot_username in message.caption.lower()
+    caption = NormalizedMessage(message.caption) if message.caption else None
+    if caption:
+        # Cached identity: no getMe round trip per photo
+        bot_info = await bot_identity.get(message.bot)
+        if bot_info and bot_info.username:
+            is_bot_mentioned = f"@{bot_info.username}".casefold() in caption.casefolded
     
     # Skip if none of the conditions are met
     if not (is_private or is_reply_to_bot or is_bot_mentioned):
@@ -115,205 +255,218 @@ async def photo_handler(message: types.Message):
     # Get the largest photo (last in the array)
     photo = message.photo[-1]
     
-    photo_data = {
-        "file_id": photo.file_id,
-        "file_unique_id": photo.file_unique_id,
-        "file_size": photo.file_size,
-        "width": photo.width,
-        "height": photo.height
-    }
-    
-    save_chat_photo(
-        chat_id=message.chat.id,
-        user_id=message.from_user.id,
-        message_id=message.message_id,
-        photo_data=photo_data,
-        caption=message.caption
-    )
-    
-    # Forward photo to admin
-    if ADMIN_ID:
-        try:
-            user = message.from_user
-            chat_title = message.chat.title or "Private Chat"
-            username = f"@{user.username}" if user.username else "No username"
-            
-            # Build message link
-            msg_link = "No link"
-            if message.chat.username:
-                msg_link = f"https://t.me/{message.chat.username}/{message.message_id}"
-            elif message.chat.id < 0:
-                cid = str(message.chat.id).replace("-100", "")
-                msg_link = f"https://t.me/c/{cid}/{message.message_id}"
-            
+    # Independent side effects run side by side; one failing does not stop the others
+    side_effects = []
+    if not seen_photos.seen(photo.file_unique_id):
+        side_effects.append(_isolated("photo_save", save_photo(message, photo)))
+        if ADMIN_ID:
             # Indicate why photo was captured
             reason = "📩 Direct" if is_private else ("↩️ Reply" if is_reply_to_bot else "📣 Mention")
-            
-            info_text = (
-                f"📸 <b>New Photo</b> ({reason})\n\n"
-                f"👤 <b>From:</b> {user.full_name} ({username})\n"
-                f"💬 <b>Chat:</b> {chat_title}\n"
-                f"🔗 <a href=\"{msg_link}\">View message</a>"
-            )
-            
-            if message.caption:
-                info_text += f"\n📝 <b>Caption:</b> {message.caption[:100]}"
-            
-            await message.bot.send_photo(
-                chat_id=ADMIN_ID,
-                photo=photo.file_id,
-                caption=info_text,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Failed to forward photo to admin: {e}")
-    
-    # Continue to check for triggers in caption
-    if message.caption:
-        await process_triggers(message, message.caption)
+            side_effects.append(_isolated("photo_forward", forward_photo_to_admin(message, photo, reason)))
+    if caption:
+        side_effects.append(_isolated("photo_triggers", process_triggers(message, caption)))
+    await asyncio.gather(*side_effects)
 
-async def process_triggers(message: types.Message, text: str):
-    """Process triggers for a message with given text."""
-    if message.chat.type == 'private':
-        return
+async def send_ai_reply(message: types.Message, trigger: dict, text: NormalizedMessage) -> str | None:
+    """
+    Replies to a message with the AI answer for a trigger.
+    Streams the answer into an edited placeholder when streaming is enabled
+    (AI_STREAMING, or the trigger's ai_stream flag). Returns None if no reply was sent.
+    """
+    stream = trigger.get('ai_stream')
+    if stream is None:
+        stream = AI_STREAMING
     
-    if not TRIGGERS_CACHE:
-        await refresh_triggers()
+    request = dict(
+        system_prompt=trigger['response'],
+        user_message=text,
+        model=trigger.get('ai_model'),  # Use custom model from trigger if specified
+        chat_id=message.chat.id,  # Enable context memory
+        cache_ttl=trigger.get('ai_cache_ttl')
+    )
     
-    trigger = check_message_for_triggers(text, TRIGGERS_CACHE, chat_id=message.chat.id)
+    if not stream:
+        response_text = await get_ai_response(**request)
+        if response_text is not None:
+            await outbound.send(message.chat.id, lambda: message.reply(response_text, parse_mode="Markdown"))
+        return response_text
     
+    reply = StreamingReply(message, STREAM_EDIT_INTERVAL, outbound=outbound)
+    await reply.start()
+    response_text = await get_ai_response(**request, on_delta=reply.push)
+    if response_text is None:
+        await reply.cancel()
+    else:
+        await reply.finish(response_text)
+    return response_text
+
+# Trigger pipeline: normalize → match → cooldown → respond → notify.
+# Every message with text (captions included) goes through it via process_triggers().
+
+def normalize_stage(message: types.Message, text) -> NormalizedMessage | None:
+    """
+    The text to match on, normalized once for all later stages, or None if the
+    message is not for triggers (private chats, no text).
+    """
+    # Triggers only work in groups/channels
+    if message.chat.type == 'private' or not text:
+        return None
+    return normalized(text)
+
+async def match_stage(message: types.Message, text: NormalizedMessage) -> dict | None:
+    """The trigger the text matches in this chat, or None."""
+    # Most messages match nothing; rule them out before the full matching
+    with STAGE_SECONDS.time("prefilter"):
+        candidate = TRIGGERS_INDEX.may_match(text, chat_id=message.chat.id)
+    PREFILTER_CHECKED.inc()
+    if not candidate:
+        PREFILTER_REJECTED.inc()
+        return None
+
+    # Inline, or in a worker process for large trigger sets
+    with STAGE_SECONDS.time("match"):
+        trigger = await match_pool.match(text, chat_id=message.chat.id)
     if trigger:
-        chat_id = message.chat.id
-        trigger_id = trigger['id']
-        cooldown = trigger.get('cooldown', 60)
-        msg_date = message.date.timestamp()
+        TRIGGER_HITS.inc(message.chat.id)
+    return trigger
 
-        if cooldown_manager.can_trigger(chat_id, trigger_id, cooldown, timestamp=msg_date):
-            cooldown_manager.mark_triggered(chat_id, trigger_id, timestamp=msg_date)
-            
-            response_text = trigger['response']
-            resp_type = trigger.get('type', 'text')
-            
-            try:
-                if resp_type == 'ai':
-                    custom_model = trigger.get('ai_model')
-                    response_text = await get_ai_response(
-                        system_prompt=response_text,
-                        user_message=text,
-                        model=custom_model,
-                        chat_id=chat_id  # Enable context memory
-                    )
-                    await message.reply(response_text, parse_mode="Markdown")
-                elif resp_type == 'sticker':
-                    await message.reply_sticker(response_text)
-                elif resp_type == 'photo':
-                    await message.reply_photo(response_text)
-                else:
-                    await message.reply(response_text, parse_mode="Markdown")
-            except Exception as e:
-                print(f"Failed to send response: {e}")
+def cooldown_stage(message: types.Message, trigger: dict) -> bool:
+    """Claims the trigger's cooldown in this chat; False if it is still cooling down."""
+    # Use message date for strict cooldown (avoids lag issues); claimed before the
+    # (possibly slow) response so concurrent messages cannot fire it twice
+    with STAGE_SECONDS.time("cooldown"):
+        claimed = chat_state.claim_cooldown(
+            message.chat.id, trigger['id'], trigger.get('cooldown', 60), timestamp=message.date.timestamp()
+        )
+    if not claimed:
+        COOLDOWN_BLOCKED.inc()
+    return claimed
 
-@router.message()
-async def message_handler(message: types.Message):
-    # Skip trigger processing in private chats (only work in groups/channels)
-    if message.chat.type == 'private':
-        return
+async def respond_stage(message: types.Message, trigger: dict, text: NormalizedMessage) -> bool:
+    """Sends the trigger's response. Returns whether one was sent."""
+    chat_id = message.chat.id
+    response_text = trigger['response']
+    resp_type = trigger.get('type', 'text')
     
-    if not TRIGGERS_CACHE:
-        await refresh_triggers()
-        
-    text = message.text or message.caption or ""
-    if not text:
-        return
+    try:
+        if resp_type == 'ai':
+            # For AI, the trigger response acts as the system prompt
+            response_text = await send_ai_reply(message, trigger, text)
+            if response_text is None:
+                # A newer message from this chat took over the AI request
+                return False
+        elif resp_type == 'sticker':
+            await outbound.send(chat_id, lambda: message.reply_sticker(response_text))
+        elif resp_type == 'photo':
+            await outbound.send(chat_id, lambda: message.reply_photo(response_text))
+        else:
+            # Text triggers with Markdown support
+            await outbound.send(chat_id, lambda: message.reply(response_text, parse_mode="Markdown"))
+    except Exception as e:
+        ERRORS.inc("respond")
+        print(f"Failed to send response: {e}")
+        return False
+    return True
 
-    trigger = check_message_for_triggers(text, TRIGGERS_CACHE, chat_id=message.chat.id)
+def notify_stage(message: types.Message, trigger: dict, text: NormalizedMessage):
+    """Tells the admin a trigger fired (in the next digest, or right away). Not awaited."""
+    if not ADMIN_ID:
+        return
+    chat_id = message.chat.id
+    chat_title = message.chat.title or "Private Chat"
+    user = message.from_user.full_name or "Unknown"
+    username = message.from_user.username or "NoUsername"
     
-    if trigger:
-        chat_id = message.chat.id
-        trigger_id = trigger['id']
-        cooldown = trigger.get('cooldown', 60)
-        
-        # Use message date for strict cooldown (avoids lag issues)
-        msg_date = message.date.timestamp()
+    # Try to build a message link
+    msg_link = "No link available"
+    if message.chat.username:
+        msg_link = f"https://t.me/{message.chat.username}/{message.message_id}"
+    elif message.chat.id < 0:
+        # Private group IDs start with -100, remove it for link
+        cid = str(message.chat.id).replace("-100", "")
+        msg_link = f"https://t.me/c/{cid}/{message.message_id}"
+
+    # User-provided text is Markdown-escaped; the message snippet comes escaped already
+    trigger_snippet = text.snippet_markdown
 
-        if cooldown_manager.can_trigger(chat_id, trigger_id, cooldown, timestamp=msg_date):
-            # Mark as triggered IMMEDIATELY to prevent race conditions with async AI requests
-            cooldown_manager.mark_triggered(chat_id, trigger_id, timestamp=msg_date)
-            
-            response_text = trigger['response']
-            resp_type = trigger.get('type', 'text')
-            
+    notification_text = (
+        f"🔔 **Trigger Used!**\n"
+        f"👤 **User:** {escape_markdown(user)} (@{username})\n"
+        f"📍 **Chat:** {escape_markdown(chat_title)}\n"
+        f"🔗 **Link:** [Message]({msg_link})\n"
+        f"📝 **Trigger:** {trigger_snippet}"
+    )
+    
+    async def notify_admin():
+        try:
+            await message.bot.send_message(chat_id=ADMIN_ID, text=notification_text, parse_mode="Markdown")
+        except TelegramRetryAfter:
+            # Let the dispatcher wait and retry the whole notification
+            raise
+        except Exception as e:
+            # If Markdown fails, send as plain text
+            print(f"Failed to notify admin with Markdown: {e}")
             try:
-                if resp_type == 'ai':
-                    # For AI, response_text acts as the system prompt
-                    # Use custom model from trigger if specified
-                    custom_model = trigger.get('ai_model')
-                    response_text = await get_ai_response(
-                        system_prompt=response_text,
-                        user_message=text,
-                        model=custom_model,
-                        chat_id=chat_id  # Enable context memory
-                    )
-                    await message.reply(response_text, parse_mode="Markdown")
-                elif resp_type == 'sticker':
-                    await message.reply_sticker(response_text)
-                elif resp_type == 'photo':
-                     await message.reply_photo(response_text)
-                else:
-                    # Text triggers with Markdown support
-                    await message.reply(response_text, parse_mode="Markdown")
+                plain_notification = (
+                    f"🔔 Trigger Used!\n"
+                    f"👤 User: {user} (@{username})\n"
+                    f"📍 Chat: {chat_title}\n"
+                    f"🔗 Link: {msg_link}\n"
+                    f"📝 Trigger: {text.snippet}"
+                )
+                await message.bot.send_message(chat_id=ADMIN_ID, text=plain_notification)
+            except TelegramRetryAfter:
+                raise
+            except Exception as e2:
+                print(f"Failed to notify admin even with plain text: {e2}")
+    
+    if ADMIN_DIGEST_SECONDS > 0 and not trigger.get('notify_immediately'):
+        notifier.add_trigger(
+            message.bot, chat_id, chat_title, trigger, user, username, msg_link, text.snippet
+        )
+    else:
+        # Queued behind trigger replies; not awaited
+        outbound.submit(int(ADMIN_ID), notify_admin, priority=PRIORITY_NOTIFY)
 
-                # Admin Notification
-                from config import ADMIN_ID
-                if ADMIN_ID:
-                    chat_title = message.chat.title or "Private Chat"
-                    user = message.from_user.full_name or "Unknown"
-                    username = message.from_user.username or "NoUsername"
-                    
-                    # Try to build a message link
-                    msg_link = "No link available"
-                    if message.chat.username:
-                        msg_link = f"https://t.me/{message.chat.username}/{message.message_id}"
-                    elif message.chat.id < 0:
-                        # Private group IDs start with -100, remove it for link
-                        cid = str(message.chat.id).replace("-100", "")
-                        msg_link = f"https://t.me/c/{cid}/{message.message_id}"
+async def respond_and_notify(message: types.Message, trigger: dict, text: NormalizedMessage):
+    if await respond_stage(message, trigger, text):
+        notify_stage(message, trigger, text)
 
-                    # Escape Markdown special characters in user-provided text
-                    def escape_markdown(text: str) -> str:
-                        """Escape Markdown special characters."""
-                        special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-                        for char in special_chars:
-                            text = text.replace(char, '\\' + char)
-                        return text
-                    
-                    trigger_snippet = escape_markdown(text[:50])
-                    if len(text) > 50:
-                        trigger_snippet += "..."
+async def run_trigger_stages(message: types.Message, text: NormalizedMessage):
+    """
+    One message through the trigger stages; runs inside its chat's pipeline slot.
+    AI replies leave the slot once the cooldown is claimed: the next message of
+    the chat is matched meanwhile, and if it asks the AI too, the scheduler
+    coalesces the two requests instead of the chat's queue filling up.
+    """
+    if not TRIGGERS_CACHE:
+        await refresh_triggers()
+    
+    trigger = await match_stage(message, text)
+    if trigger is None or not cooldown_stage(message, trigger):
+        return
+    if trigger.get('type') == 'ai':
+        pipeline.detach(_isolated("respond", respond_and_notify(message, trigger, text)))
+        return
+    await respond_and_notify(message, trigger, text)
+
+async def process_triggers(message: types.Message, text):
+    """
+    Queues a message for its chat's trigger pipeline and waits until it has been
+    handled (an AI reply may still be on its way), or shed because the chat is
+    flooding. text is the message text or its NormalizedMessage.
+    """
+    text = normalize_stage(message, text)
+    if text is None:
+        return
+    
+    # Replies to the bot are kept longest when the chat's queue overflows
+    reply_to = message.reply_to_message
+    is_reply_to_bot = bool(reply_to and reply_to.from_user and reply_to.from_user.id == message.bot.id)
+    priority = PRIORITY_HIGH if is_reply_to_bot else PRIORITY_LOW
+    
+    await pipeline.submit(message.chat.id, lambda: run_trigger_stages(message, text), priority)
 
-                    notification_text = (
-                        f"🔔 **Trigger Used!**\n"
-                        f"👤 **User:** {escape_markdown(user)} (@{username})\n"
-                        f"📍 **Chat:** {escape_markdown(chat_title)}\n"
-                        f"🔗 **Link:** [Message]({msg_link})\n"
-                        f"📝 **Trigger:** {trigger_snippet}"
-                    )
-                    
-                    try:
-                        await message.bot.send_message(chat_id=ADMIN_ID, text=notification_text, parse_mode="Markdown")
-                    except Exception as e:
-                        # If Markdown fails, send as plain text
-                        print(f"Failed to notify admin with Markdown: {e}")
-                        try:
-                            plain_notification = (
-                                f"🔔 Trigger Used!\n"
-                                f"👤 User: {user} (@{username})\n"
-                                f"📍 Chat: {chat_title}\n"
-                                f"🔗 Link: {msg_link}\n"
-                                f"📝 Trigger: {text[:50]}{'...' if len(text) > 50 else ''}"
-                            )
-                            await message.bot.send_message(chat_id=ADMIN_ID, text=plain_notification)
-                        except Exception as e2:
-                            print(f"Failed to notify admin even with plain text: {e2}")
-            except Exception as e:
-                print(f"Failed to send response: {e}")
+@router.message()
+async def message_handler(message: types.Message):
+    await process_triggers(message, message.text or message.caption or "")
@@ -0,0 +1,111 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+
+class ChatSession:
+    """One chat's AI conversation: a fixed-size ring of messages and its start time."""
+
+    __slots__ = ("messages", "session_start")
+
+    def __init__(self, max_messages: int, session_start: float):
+        self.messages = deque(maxlen=max_messages)
+        self.session_start = session_start
+
+
+class ChatHistoryStore:
+    """
+    Bounded in-memory AI conversation memory.
+
+    Holds at most max_chats sessions in LRU order; the least recently used chat
+    is dropped when a new one would exceed the limit. A session expires
+    expiration_seconds after it started, either when the chat is next seen or
+    when the state backend's sweeper calls sweep(), whichever comes first.
+    """
+
+    def __init__(self, max_chats: int = 5000, max_messages: int = 5, expiration_seconds: float = 6 * 3600):
+        self.max_chats = max_chats
+        self.max_messages = max_messages
+        self.expiration_seconds = expiration_seconds
+        self._sessions = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._sessions),
+            "messages": sum(len(session.messages) for session in self._sessions.values()),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def _is_expired(self, session: ChatSession, now: float) -> bool:
+        return now - session.session_start > self.expiration_seconds
+
+    def get(self, chat_id: int) -> list:
+        """Messages for a chat, oldest first. Does not create a session."""
+        session = self._sessions.get(chat_id)
+        if session is None:
+            return []
+
+        if self._is_expired(session, time.time()):
+            logging.info(f"⏳ Chat history session expired for chat {chat_id} (6 hours passed since start)")
+            del self._sessions[chat_id]
+            self.expired += 1
+            return []
+
+        self._sessions.move_to_end(chat_id)
+        return list(session.messages)
+
+    def add(self, chat_id: int, role: str, content: str):
+        """Append a message. Starts a new session if there is none or it has expired."""
+        current_time = time.time()
+        session = self._sessions.get(chat_id)
+
+        if session is None or not session.messages or self._is_expired(session, current_time):
+            session = ChatSession(self.max_messages, current_time)
+            self._sessions[chat_id] = session
+            logging.info(f"🆕 Started new 6-hour AI session for chat {chat_id}")
+
+        self._sessions.move_to_end(chat_id)
+        # deque(maxlen) drops the oldest message itself, no list rebuild
+        session.messages.append({"role": role, "content": content})
+
+        while len(self._sessions) > self.max_chats:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def clear(self, chat_id: int):
+        self._sessions.pop(chat_id, None)
+
+    def export(self) -> list:
+        """Sessions as [chat_id, session_start, messages], least recently used first."""
+        return [
+            [chat_id, session.session_start, list(session.messages)]
+            for chat_id, session in self._sessions.items()
+        ]
+
+    def restore(self, items: list):
+        """Load sessions produced by export(). Expired ones are skipped."""
+        now = time.time()
+        for chat_id, session_start, messages in items:
+            session = ChatSession(self.max_messages, session_start)
+            if self._is_expired(session, now) or not messages:
+                continue
+            session.messages.extend(messages)
+            self._sessions[chat_id] = session
+            self._sessions.move_to_end(chat_id)
+        while len(self._sessions) > self.max_chats:
+            self._sessions.popitem(last=False)
+
+    def sweep(self, now: float = None) -> int:
+        """Drop every expired session. Returns how many were removed."""
+        now = now if now is not None else time.time()
+        expired = [chat_id for chat_id, session in self._sessions.items() if self._is_expired(session, now)]
+        for chat_id in expired:
+            del self._sessions[chat_id]
+        self.expired += len(expired)
+        return len(expired)
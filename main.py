@@ -1,23 +1,195 @@
 import asyncio
 import logging
+import secrets
+import signal
 from aiogram import Bot, Dispatcher
-from config import BOT_TOKEN
-from handlers import router, refresh_triggers
+from config import (
+    BOT_TOKEN, LOOP_MONITOR_INTERVAL, LOOP_MONITOR_REPORT_SECONDS, AI_HISTORY_SWEEP_SECONDS,
+    SNAPSHOT_PATH, SNAPSHOT_INTERVAL, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST,
+    WEBHOOK_PORT, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WORKERS, WORKER_CONCURRENCY, STATE_BACKEND,
+    RECORD_UPDATES_PATH, METRICS_HOST, METRICS_PORT
+)
+from ai_client import refresh_ai_config, ai_scheduler, get_cache_stats, get_summary_stats, get_config_stats, close_ai
+from db import shutdown_db
+from handlers import (
+    router, refresh_triggers, photo_queue, trigger_sync, outbound, notifier, pipeline, bot_identity, match_pool
+)
+from utils import LoopStallMonitor
+from snapshot import load_snapshot, save_snapshot, run_snapshots
+from webhook import WebhookServer, wait_for_stop_signal
+from sharding import ShardRouter, WorkerPool, serve_shard
+from state_backend import chat_state, run_sweeper
+from update_recorder import UpdateRecorder
+from metrics import registry, start_metrics_server
 
 # Basic logging
 logging.basicConfig(level=logging.INFO)
 
+async def reconcile_with_db():
+    """After a warm start, bring the snapshot state up to date with the DB."""
+    await refresh_triggers()
+    await refresh_ai_config()
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    secret = WEBHOOK_SECRET
+    if not secret and WEBHOOK_URL:
+        # We register the webhook ourselves, so a random secret works; token_urlsafe
+        # only uses characters Telegram allows in it
+        secret = secrets.token_urlsafe(32)
+    elif not secret:
+        logging.warning("WEBHOOK_SECRET is not set: webhook requests are not authenticated")
+    server = WebhookServer(dp, bot, WEBHOOK_PATH, secret, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS)
+    registry.collector("webhook", server.stats)
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL or None)
+    try:
+        await wait_for_stop_signal()
+    finally:
+        await server.close()
+
+async def serve_updates(dp: Dispatcher, bot: Bot):
+    """Receive updates in the configured BOT_MODE until the bot is stopped."""
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        # getUpdates is refused while a webhook is registered (e.g. after running in webhook mode)
+        await bot.delete_webhook()
+        print("Bot started polling...")
+        await dp.start_polling(bot, close_bot_session=False)
+
+async def start_metrics():
+    """Start the /metrics endpoint if METRICS_PORT is set. Returns its runner or None."""
+    if not METRICS_PORT:
+        return None
+    try:
+        return await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        logging.error(f"Metrics endpoint not started on port {METRICS_PORT}: {e!r}")
+        return None
+
+async def run_bot(dp: Dispatcher, bot: Bot, serve):
+    """Start the background services, run serve() until it returns, then shut down cleanly."""
+    background_tasks = []
+    if LOOP_MONITOR_INTERVAL > 0:
+        stall_monitor = LoopStallMonitor(LOOP_MONITOR_INTERVAL, LOOP_MONITOR_REPORT_SECONDS)
+        background_tasks.append(asyncio.create_task(stall_monitor.run()))
+        registry.collector("event_loop", stall_monitor.stats)
+    
+    # Queue depths, counters and cache stats the components already keep, exported on each scrape
+    registry.collector("pipeline", pipeline.stats)
+    registry.collector("match_pool", match_pool.stats)
+    registry.collector("outbound", outbound.stats)
+    registry.collector("ai_scheduler", ai_scheduler.stats)
+    registry.collector("ai_cache", get_cache_stats)
+    registry.collector("ai_summaries", get_summary_stats)
+    registry.collector("app_config", get_config_stats)
+    registry.collector("photo_queue", photo_queue.stats)
+    registry.collector("state", chat_state.stats)
+    metrics_runner = await start_metrics()
+    
+    photo_queue.start()
+    background_tasks.append(asyncio.create_task(run_sweeper(chat_state, AI_HISTORY_SWEEP_SECONDS)))
+    
+    try:
+        # Serve from the local snapshot right away if there is one; the DB catches up in the background
+        if SNAPSHOT_PATH and await load_snapshot(SNAPSHOT_PATH):
+            background_tasks.append(asyncio.create_task(reconcile_with_db()))
+        else:
+            # Load triggers and the app_config table on startup
+            await refresh_triggers()
+            await refresh_ai_config()
+        # Pick up trigger edits from the DB without a manual /reload
+        background_tasks.append(asyncio.create_task(trigger_sync.run()))
+        if SNAPSHOT_PATH and SNAPSHOT_INTERVAL > 0:
+            background_tasks.append(asyncio.create_task(run_snapshots(SNAPSHOT_PATH, SNAPSHOT_INTERVAL)))
+        
+        await serve()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        if SNAPSHOT_PATH:
+            try:
+                await save_snapshot(SNAPSHOT_PATH)
+            except Exception as e:
+                logging.error(f"Failed to save snapshot on shutdown: {e!r}")
+        # Finish the messages already queued per chat, send the pending digest,
+        # then let queued replies and notifications go out
+        await pipeline.close()
+        await close_ai()
+        match_pool.close()
+        await notifier.close()
+        await outbound.close()
+        # Write out buffered photo rows before the DB executor goes away
+        await photo_queue.close()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        chat_state.close()
+        shutdown_db()
+
+async def run_ingress(dp: Dispatcher, bot: Bot):
+    """Receive updates and route each chat to its worker process; the workers do the rest."""
+    if STATE_BACKEND == "memory":
+        logging.warning("STATE_BACKEND=memory: cooldowns and AI history do not move with chats "
+                        "if WORKERS changes; use STATE_BACKEND=sqlite to share them")
+    pool = WorkerPool(worker_main, WORKERS)
+    pool.start()
+    # The router is only included so polling/setWebhook ask for the update types it uses;
+    # ShardRouter passes every update on before any handler runs
+    dp.include_router(router)
+    shard_router = ShardRouter(pool.queues)
+    dp.update.outer_middleware(shard_router)
+    supervisor = asyncio.create_task(pool.supervise())
+    registry.collector("ingress", lambda: {
+        "routed": sum(shard_router.routed), "worker_restarts": pool.restarts
+    })
+    metrics_runner = await start_metrics()
+    print(f"Ingress started with {WORKERS} workers")
+    try:
+        await serve_updates(dp, bot)
+    finally:
+        supervisor.cancel()
+        await pool.stop()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+async def run_worker(updates):
+    bot = Bot(token=BOT_TOKEN)
+    dp = Dispatcher()
+    dp.include_router(router)
+    await bot_identity.refresh(bot)
+    await run_bot(dp, bot, lambda: serve_shard(updates, dp, bot, WORKER_CONCURRENCY))
+
+def worker_main(index: int, updates):
+    """Entry point of a worker process (see sharding.WorkerPool)."""
+    # Ctrl+C reaches the whole process group; the ingress decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(updates))
+    print(f"Worker {index} stopped")
+
 async def main():
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
     
-    dp.include_router(router)
+    # Handlers and the update recorder read the bot's username from here instead of calling getMe
+    await bot_identity.refresh(bot)
     
-    # Load triggers on startup
-    await refresh_triggers()
+    # Registered first, so it sees every update before routing or handling
+    recorder = None
+    if RECORD_UPDATES_PATH:
+        recorder = UpdateRecorder(RECORD_UPDATES_PATH, bot_username=bot_identity.username)
+        dp.update.outer_middleware(recorder)
     
-    print("Bot started polling...")
-    await dp.start_polling(bot)
+    try:
+        if WORKERS > 1:
+            await run_ingress(dp, bot)
+            return
+        
+        dp.include_router(router)
+        await run_bot(dp, bot, lambda: serve_updates(dp, bot))
+    finally:
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == "__main__":
     import sys
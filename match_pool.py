@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from normalize import NormalizedMessage
+from trigger_index import TriggerIndex
+from utils import check_message_for_triggers
+
+# Compiled indexes a worker process keeps: generation -> TriggerIndex
+_worker_indexes = {}
+
+
+def _worker_index(snapshot_path: str, generation: int) -> TriggerIndex:
+    index = _worker_indexes.get(generation)
+    if index is None:
+        with open(snapshot_path, "rb") as f:
+            rows = pickle.load(f)
+        # Buckets the change did not touch are taken over from the newest index compiled here
+        previous = _worker_indexes[max(_worker_indexes)] if _worker_indexes else None
+        index = TriggerIndex(rows, previous)
+        # The current and the previous generation, for requests sent just before a reload
+        for old in sorted(_worker_indexes)[:-1]:
+            del _worker_indexes[old]
+        _worker_indexes[generation] = index
+    return index
+
+
+def _match_in_worker(snapshot_path: str, generation: int, text: str, chat_id: int) -> int | None:
+    """Runs in a worker process: the id of the matched trigger, or None. Normalizes text here."""
+    trigger = check_message_for_triggers(text, _worker_index(snapshot_path, generation), chat_id=chat_id)
+    return trigger['id'] if trigger else None
+
+
+def _warm_worker(snapshot_path: str, generation: int) -> int:
+    return len(_worker_index(snapshot_path, generation))
+
+
+class MatchPool:
+    """
+    Trigger matching in worker processes, for trigger sets large enough that
+    fuzzy scoring would hold up the event loop.
+
+    On every reload the trigger rows are pickled once to a snapshot file
+    with a new generation number (prepare() does that off the event loop);
+    each worker compiles its own TriggerIndex from it the first time it sees
+    that generation, reusing the buckets that did not change. A request carries only
+    the message text, chat id and generation (the worker normalizes the text, which
+    is cheaper than pickling a NormalizedMessage with its forms and tokens), and
+    returns the matched trigger's id, which is mapped back to the row here.
+
+    match() runs inline instead when the pool is disabled (workers=0), when
+    the loaded set has fewer than min_triggers triggers (the inter-process
+    round trip would cost more than matching), or after the pool broke. A
+    request failing for any other reason is matched inline on its own.
+    """
+
+    def __init__(self, workers: int = 0, min_triggers: int = 2000):
+        self.workers = workers
+        self.min_triggers = min_triggers
+        self._index = TriggerIndex([])
+        self._by_id = {}
+        self._executor = None
+        self._generation = 0
+        self._snapshot_path = None
+        self._old_snapshots = []
+        self.offloaded = 0
+        self.inline = 0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        return {
+            "offloading": self._offloading(),
+            "generation": self._generation,
+            "offloaded": self.offloaded,
+            "inline": self.inline,
+            "failures": self.failures,
+        }
+
+    def _offloading(self) -> bool:
+        return self.workers > 0 and self._snapshot_path is not None and len(self._index) >= self.min_triggers
+
+    def prepare(self, index: TriggerIndex) -> str | None:
+        """
+        Writes the worker snapshot for index if it is large enough to offload and
+        returns its path (else None), for load(). Changes no state, so it can run
+        in an executor thread.
+        """
+        if self.workers <= 0 or len(index) < self.min_triggers:
+            return None
+        fd, path = tempfile.mkstemp(prefix="triggers-", suffix=".pickle")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(list(index.triggers), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def load(self, index: TriggerIndex, snapshot_path: str = None):
+        """Use a newly compiled index, with the snapshot prepare() wrote for it (written here if not given)."""
+        self._index = index
+        self._by_id = {trigger['id']: trigger for trigger in index.triggers}
+        if snapshot_path is None:
+            snapshot_path = self.prepare(index)
+        if snapshot_path is None:
+            return
+        if self.workers <= 0:
+            # The pool broke while the snapshot was written
+            self._remove(snapshot_path)
+            return
+
+        self._generation += 1
+        if self._snapshot_path is not None:
+            self._old_snapshots.append(self._snapshot_path)
+        self._snapshot_path = snapshot_path
+        # Workers may still be answering requests of the previous generation
+        while len(self._old_snapshots) > 1:
+            self._remove(self._old_snapshots.pop(0))
+
+        if self._executor is None:
+            # spawn: no copy of the bot's threads, sockets or event loop in the workers
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            logging.info(f"🧮 Matching offloaded to {self.workers} processes ({len(index)} triggers)")
+        # Compile ahead of the first message (best effort: idle workers pick these up)
+        for _ in range(self.workers):
+            self._executor.submit(_warm_worker, snapshot_path, self._generation)
+
+    async def match(self, message, chat_id: int = None) -> dict | None:
+        """Same result as check_message_for_triggers(message, index, chat_id) on the loaded index."""
+        if not self._offloading():
+            self.inline += 1
+            return check_message_for_triggers(message, self._index, chat_id=chat_id)
+
+        loop = asyncio.get_running_loop()
+        text = message.text if isinstance(message, NormalizedMessage) else message
+        try:
+            trigger_id = await loop.run_in_executor(
+                self._executor, _match_in_worker, self._snapshot_path, self._generation, text, chat_id
+            )
+        except BrokenProcessPool as e:
+            # A worker died; match here from now on rather than fail every message
+            self.failures += 1
+            logging.error(f"🧮 Match pool broke, matching inline from now on: {e!r}")
+            self.workers = 0
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            return check_message_for_triggers(message, self._index, chat_id=chat_id)
+        except Exception as e:
+            # The pool itself is fine (e.g. the snapshot file vanished): this message is matched here
+            self.failures += 1
+            logging.warning(f"🧮 Offloaded match failed, matching inline: {e!r}")
+            return check_message_for_triggers(message, self._index, chat_id=chat_id)
+        self.offloaded += 1
+        return self._by_id.get(trigger_id) if trigger_id is not None else None
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        for path in self._old_snapshots + ([self._snapshot_path] if self._snapshot_path else []):
+            self._remove(path)
+        self._old_snapshots = []
+        self._snapshot_path = None
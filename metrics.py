@@ -0,0 +1,198 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from aiohttp import web
+
+# Seconds; covers sub-millisecond matching up to slow AI calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label combination, like Prometheus'.
+
+    observe() is a bisect and three additions; time() wraps a block.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process in the Prometheus text format.
+
+    Besides counters and histograms it takes collectors: callables returning
+    a (possibly nested) stats() dict, as most components here already have.
+    Their numbers are exported as untyped samples named
+    bot_<prefix>_<key>; string values become a label of a sample set to 1.
+    """
+
+    def __init__(self, namespace: str = "bot"):
+        self.namespace = namespace
+        self._metrics = []
+        self._collectors = {}
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        metric = Counter(f"{self.namespace}_{name}", documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.namespace}_{name}", documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, prefix: str, stats):
+        """Export stats() on every scrape. Registering a prefix again replaces it."""
+        self._collectors[prefix] = stats
+
+    def _flatten(self, prefix: str, stats: dict, lines: list):
+        for key, value in stats.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                self._flatten(name, value, lines)
+            elif isinstance(value, bool):
+                lines.append(f"{name} {int(value)}")
+            elif isinstance(value, (int, float)):
+                lines.append(f"{name} {value}")
+            elif isinstance(value, str):
+                lines.append(f'{name}{{value="{_escape(value)}"}} 1')
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats in self._collectors.items():
+            try:
+                self._flatten(f"{self.namespace}_{prefix}", stats(), lines)
+            except Exception as e:
+                logging.warning(f"Metrics collector {prefix} failed: {e!r}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Per-stage latency of message handling
+STAGE_SECONDS = registry.histogram(
+    "stage_duration_seconds", "Time spent per handling stage (queue, prefilter, match, cooldown)", ("stage",)
+)
+DB_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "Supabase query time by query and outcome", ("query", "outcome")
+)
+AI_SECONDS = registry.histogram(
+    "ai_request_duration_seconds", "AI completion time by model and outcome", ("model", "outcome")
+)
+AI_FIRST_TOKEN_SECONDS = registry.histogram(
+    "ai_first_token_seconds", "Time from the streaming placeholder to the first visible AI tokens"
+)
+SEND_SECONDS = registry.histogram(
+    "telegram_send_duration_seconds", "Telegram API call time by outcome", ("outcome",)
+)
+TRIGGER_HITS = registry.counter("trigger_hits_total", "Messages that matched a trigger, per chat", ("chat_id",))
+COOLDOWN_BLOCKED = registry.counter("cooldown_blocked_total", "Matches suppressed by a cooldown")
+AI_CACHE_HITS = registry.counter("ai_cache_hits_total", "AI replies served from the response cache", ("model",))
+ERRORS = registry.counter("errors_total", "Errors by stage", ("stage",))
+AI_PROMPT_TOKENS = registry.counter("ai_prompt_tokens_total", "Estimated prompt tokens sent, by model", ("model",))
+AI_CONTEXT_DROPPED = registry.counter(
+    "ai_context_dropped_total", "History messages left out (or cut) to fit the token budget", ("model",)
+)
+PIPELINE_DROPPED = registry.counter("pipeline_dropped_total", "Messages shed by a flooding chat's queue", ("reason",))
+PREFILTER_CHECKED = registry.counter("prefilter_checked_total", "Messages run through the trigger pre-filter")
+PREFILTER_REJECTED = registry.counter(
+    "prefilter_rejected_total", "Messages the pre-filter ruled out before full matching"
+)
+
+
+def _prefilter_stats() -> dict:
+    checked = PREFILTER_CHECKED.get()
+    return {"rejection_rate": round(PREFILTER_REJECTED.get() / checked, 4) if checked else 0.0}
+
+
+registry.collector("prefilter", _prefilter_stats)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve GET /metrics; returns the runner to clean up on shutdown."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"📈 Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,128 @@
+import re
+
+# Characters of a trigger snippet shown in admin notifications
+SNIPPET_LENGTH = 50
+
+# Markdown special characters, escaped in one translate() pass
+_MARKDOWN_ESCAPES = str.maketrans({char: "\\" + char for char in "_*[]()~`>#+-=|{}.!"})
+
+# Latin letters that look like Cyrillic ones (lowercase, or casefolded uppercase like B, H, M, T)
+_LATIN_TO_CYRILLIC = str.maketrans("abcehkmoptxy", "авсенкмортху")
+_CYRILLIC = re.compile("[а-џ]")
+_LATIN_LOOKALIKE = re.compile("[abcehkmoptxy]")
+_LETTERS = re.compile(r"[^\W\d_]+")
+_LATIN_LETTERS = re.compile("[a-z]+")
+
+
+def escape_markdown(text: str) -> str:
+    """Escape Markdown special characters."""
+    return text.translate(_MARKDOWN_ESCAPES)
+
+
+def _fold_latin(match) -> str:
+    # A Latin stretch with any other letter ("hello" in "helloпривет") is really Latin
+    latin = match.group()
+    return latin if latin.strip("abcehkmoptxy") else latin.translate(_LATIN_TO_CYRILLIC)
+
+
+def _fold_word(match) -> str:
+    word = match.group()
+    if _CYRILLIC.search(word) and _LATIN_LOOKALIKE.search(word):
+        return _LATIN_LETTERS.sub(_fold_latin, word)
+    return word
+
+
+def _fold(casefolded: str) -> tuple:
+    """(fold_text(casefolded), its tokens), splitting the text only once."""
+    if casefolded.isascii():
+        return casefolded, casefolded.split()
+    folded = casefolded.replace("ё", "е")
+    tokens = folded.split()
+    # No first pass over the whole text: it cost as much as this loop, in which
+    # Latin-only words (ASCII) are skipped without a search
+    lookalike = _LATIN_LOOKALIKE.search
+    for token in tokens:
+        if not token.isascii() and lookalike(token) and _CYRILLIC.search(token):
+            folded = _LETTERS.sub(_fold_word, folded)
+            return folded, folded.split()
+    return folded, tokens
+
+
+def fold_text(casefolded: str) -> str:
+    """
+    Matching form of casefolded text: ё is read as е, and in words mixing
+    Cyrillic and Latin letters the Latin look-alikes become Cyrillic ("пpивeт"
+    with Latin p and e reads as "привет"). Words are runs of letters, so
+    punctuation splits them ("hello,мир" stays as is), and only Latin stretches
+    made entirely of look-alikes are folded ("helloпривет" stays as is).
+    Words in one script are left as they are. ASCII text is returned as is,
+    without a copy.
+    """
+    return _fold(casefolded)[0]
+
+
+def normalize_keyword(keyword: str) -> str:
+    """A trigger keyword in the same form as NormalizedMessage.folded."""
+    return fold_text(keyword.casefold())
+
+
+class NormalizedMessage:
+    """
+    A message text with the forms the handlers need, each computed once per
+    update: casefolded, the matching form (see fold_text) and its tokens,
+    built up front; the notification snippets and the AI cache form on
+    first use, since most messages never need them.
+    """
+
+    __slots__ = (
+        "text", "casefolded", "folded", "tokens", "_casefolded_tokens", "_snippet", "_snippet_markdown", "_cache_text"
+    )
+
+    def __init__(self, text: str):
+        self.text = text
+        self.casefolded = text.casefold()
+        self.folded, self.tokens = _fold(self.casefolded)
+        self._casefolded_tokens = None
+        self._snippet = None
+        self._snippet_markdown = None
+        self._cache_text = None
+
+    def __bool__(self) -> bool:
+        return bool(self.text)
+
+    @property
+    def casefolded_tokens(self) -> list:
+        """Tokens of casefolded (the same list as tokens when folding changed nothing)."""
+        if self._casefolded_tokens is None:
+            casefolded = self.casefolded
+            self._casefolded_tokens = self.tokens if casefolded == self.folded else casefolded.split()
+        return self._casefolded_tokens
+
+    @property
+    def snippet(self) -> str:
+        """Start of the text for notifications, with "..." if it was cut."""
+        if self._snippet is None:
+            text = self.text
+            self._snippet = text if len(text) <= SNIPPET_LENGTH else text[:SNIPPET_LENGTH] + "..."
+        return self._snippet
+
+    @property
+    def snippet_markdown(self) -> str:
+        """snippet with Markdown special characters escaped (the "..." is not)."""
+        if self._snippet_markdown is None:
+            text = self.text
+            escaped = escape_markdown(text[:SNIPPET_LENGTH])
+            self._snippet_markdown = escaped if len(text) <= SNIPPET_LENGTH else escaped + "..."
+        return self._snippet_markdown
+
+    @property
+    def cache_text(self) -> str:
+        """Matching form with runs of whitespace collapsed, for AI response cache keys."""
+        if self._cache_text is None:
+            self._cache_text = " ".join(self.tokens)
+        return self._cache_text
+
+
+def normalized(text) -> NormalizedMessage:
+    """text as a NormalizedMessage (returned as is if it already is one)."""
+    return text if isinstance(text, NormalizedMessage) else NormalizedMessage(text)
@@ -0,0 +1,160 @@
+import asyncio
+import html
+import logging
+from aiogram.types import InputMediaPhoto
+from outbound import PRIORITY_NOTIFY
+
+MAX_MESSAGE_LENGTH = 4096
+MEDIA_GROUP_SIZE = 10
+LINKS_PER_GROUP = 3
+
+
+class NotificationAggregator:
+    """
+    Collects admin notifications and sends one digest per window.
+
+    Trigger events are grouped by chat and trigger with a count, the last
+    user and links to the first few messages. Captured photos are sent as
+    media groups of up to 10. Everything goes through the outbound
+    dispatcher in the notification lane.
+    """
+
+    def __init__(self, outbound, admin_id: str, window: float = 60.0):
+        """
+        Args:
+            outbound: OutboundDispatcher used for sending
+            admin_id: Chat that receives the digests
+            window: Seconds between the first event of a window and its digest
+        """
+        self.outbound = outbound
+        self.admin_id = admin_id
+        self.window = window
+        self._bot = None
+        self._triggers = {}
+        self._photos = []
+        self._pending = asyncio.Event()
+        self._task = None
+        self.digests_sent = 0
+        self.events = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the timer and send whatever is still collected."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    def add_trigger(self, bot, chat_id: int, chat_title: str, trigger: dict, user: str, username: str,
+                    msg_link: str, snippet: str):
+        """Record a fired trigger for the next digest."""
+        self._bot = bot
+        self.events += 1
+        key = (chat_id, trigger['id'])
+        entry = self._triggers.get(key)
+        if entry is None:
+            entry = self._triggers[key] = {
+                "chat_title": chat_title,
+                "trigger_id": trigger['id'],
+                "count": 0,
+                "links": [],
+            }
+        entry["count"] += 1
+        entry["last_user"] = f"{user} (@{username})"
+        entry["last_snippet"] = snippet
+        if msg_link.startswith("http") and len(entry["links"]) < LINKS_PER_GROUP:
+            entry["links"].append(msg_link)
+        self._wake()
+
+    def add_photo(self, bot, file_id: str, caption_html: str):
+        """Record a captured photo for the next media group."""
+        self._bot = bot
+        self.events += 1
+        self._photos.append((file_id, caption_html))
+        self._wake()
+
+    def _wake(self):
+        self.start()
+        self._pending.set()
+
+    async def _run(self):
+        while True:
+            await self._pending.wait()
+            await asyncio.sleep(self.window)
+            self._pending.clear()
+            self.flush()
+
+    def _digest_lines(self, triggers: dict) -> list:
+        by_chat = {}
+        for (chat_id, _), entry in triggers.items():
+            by_chat.setdefault(chat_id, []).append(entry)
+
+        lines = []
+        for entries in by_chat.values():
+            lines.append(f"\n📍 <b>{html.escape(entries[0]['chat_title'])}</b>")
+            for entry in entries:
+                links = " ".join(
+                    f"<a href=\"{html.escape(link)}\">[{n}]</a>" for n, link in enumerate(entry["links"], 1)
+                )
+                lines.append((
+                    f"• Trigger #{entry['trigger_id']} ×{entry['count']} — "
+                    f"last: {html.escape(entry['last_user'])}: <i>{html.escape(entry['last_snippet'])}</i> {links}"
+                ).rstrip())
+        return lines
+
+    def flush(self):
+        """Send the collected events now."""
+        triggers, self._triggers = self._triggers, {}
+        photos, self._photos = self._photos, []
+        bot = self._bot
+        if bot is None or not self.admin_id:
+            return
+
+        if triggers:
+            total = sum(entry["count"] for entry in triggers.values())
+            header = f"🔔 <b>Triggers used: {total}</b> (last {int(self.window)}s)"
+            chunk = header
+            for line in self._digest_lines(triggers):
+                if len(chunk) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                    self._send_text(bot, chunk)
+                    chunk = line.lstrip("\n")
+                else:
+                    chunk += "\n" + line
+            self._send_text(bot, chunk)
+
+        for start in range(0, len(photos), MEDIA_GROUP_SIZE):
+            group = photos[start:start + MEDIA_GROUP_SIZE]
+            self._send_photos(bot, group)
+
+    def _send_text(self, bot, text: str):
+        self.digests_sent += 1
+        future = self.outbound.submit(
+            int(self.admin_id),
+            lambda: bot.send_message(chat_id=self.admin_id, text=text, parse_mode="HTML",
+                                     disable_web_page_preview=True),
+            priority=PRIORITY_NOTIFY
+        )
+        future.add_done_callback(_report_failure)
+
+    def _send_photos(self, bot, group: list):
+        self.digests_sent += 1
+        if len(group) == 1:
+            file_id, caption = group[0]
+            factory = lambda: bot.send_photo(chat_id=self.admin_id, photo=file_id, caption=caption, parse_mode="HTML")
+        else:
+            media = [InputMediaPhoto(media=file_id, caption=caption, parse_mode="HTML") for file_id, caption in group]
+            factory = lambda: bot.send_media_group(chat_id=self.admin_id, media=media)
+        future = self.outbound.submit(int(self.admin_id), factory, priority=PRIORITY_NOTIFY)
+        future.add_done_callback(_report_failure)
+
+
+def _report_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Failed to send admin digest: {future.exception()!r}")
@@ -0,0 +1,283 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter
+from metrics import SEND_SECONDS
+
+# Priority lanes: lower value goes first
+PRIORITY_REPLY = 0
+PRIORITY_NOTIFY = 1
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, holding at most capacity."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "factory", "future", "enqueued", "attempts")
+
+    def __init__(self, priority: int, seq: int, factory, future, enqueued: float):
+        self.priority = priority
+        self.seq = seq
+        self.factory = factory
+        self.future = future
+        self.enqueued = enqueued
+        self.attempts = 0
+
+
+class _ChatQueue:
+    __slots__ = ("jobs", "busy", "blocked_until")
+
+    def __init__(self):
+        self.jobs = deque()
+        self.busy = False
+        self.blocked_until = 0.0
+
+
+class OutboundDispatcher:
+    """
+    Single exit point for Telegram sends.
+
+    Each send is a zero-argument coroutine factory (e.g. `lambda: message.reply(...)`),
+    so any object with the same methods (a fake bot) can be used offline.
+
+    - A global token bucket and one bucket per chat (groups get a lower rate)
+      keep the bot under Telegram's flood limits.
+    - Sends to a chat go out one at a time in submission order.
+    - Among chats that may send, the job with the better priority lane
+      (PRIORITY_REPLY before PRIORITY_NOTIFY), then the oldest, goes first.
+    - TelegramRetryAfter pauses the chat for the requested time and the same
+      job is retried, up to max_retries times.
+    """
+
+    def __init__(self, global_rate: float = 25.0, chat_rate: float = 1.0, group_rate: float = 20 / 60,
+                 chat_burst: float = 3.0, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats = {}
+        self._buckets = {}
+        self._global = None
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._deliveries = set()
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.queue_latency_total = 0.0
+        self.queue_latency_max = 0.0
+
+    def queued(self) -> int:
+        return sum(len(queue.jobs) for queue in self._chats.values())
+
+    def stats(self) -> dict:
+        started = self.sent + self.failed
+        return {
+            "queued": self.queued(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "avg_queue_latency_seconds": round(self.queue_latency_total / started, 4) if started else 0.0,
+            "max_queue_latency_seconds": round(self.queue_latency_max, 4),
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10.0):
+        """Wait (up to timeout) for queued and in-flight sends to finish, then stop."""
+        if self._task is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._chats and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._deliveries:
+            # A send can still be running when the queues time out
+            _, pending = await asyncio.wait(set(self._deliveries), timeout=max(0.0, deadline - loop.time()))
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+                logging.warning(f"📤 Cancelled {len(pending)} sends still running at shutdown")
+        for queue in self._chats.values():
+            for job in queue.jobs:
+                if not job.future.done():
+                    job.future.cancel()
+        self._chats.clear()
+
+    def submit(self, chat_id: int, factory, priority: int = PRIORITY_REPLY) -> asyncio.Future:
+        """Queue a send and return a future for its result (no need to await it)."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_log_unretrieved_error)
+        job = _Job(priority, next(self._seq), factory, future, loop.time())
+
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = _ChatQueue()
+        queue.jobs.append(job)
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id: int, factory, priority: int = PRIORITY_REPLY):
+        """Queue a send and wait until it has been delivered. Raises what the send raised."""
+        return await self.submit(chat_id, factory, priority)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _dispatch(self, now: float) -> float | None:
+        """Start every job that may go now. Returns seconds until the next one might, or None."""
+        if self._global is None:
+            self._global = TokenBucket(self.global_rate, self.global_rate, now)
+
+        next_wake = None
+        ready = []
+        for chat_id, queue in self._chats.items():
+            if queue.busy or not queue.jobs:
+                continue
+            if queue.blocked_until > now:
+                delay = queue.blocked_until - now
+                next_wake = delay if next_wake is None else min(next_wake, delay)
+                continue
+            head = queue.jobs[0]
+            ready.append((head.priority, head.seq, chat_id))
+        ready.sort()
+
+        for _, _, chat_id in ready:
+            delay = self._global.wait_time(now)
+            if delay > 0:
+                next_wake = delay if next_wake is None else min(next_wake, delay)
+                break
+            bucket = self._chat_bucket(chat_id, now)
+            delay = bucket.wait_time(now)
+            if delay > 0:
+                next_wake = delay if next_wake is None else min(next_wake, delay)
+                continue
+            self._global.consume()
+            bucket.consume()
+            queue = self._chats[chat_id]
+            queue.busy = True
+            task = asyncio.create_task(self._deliver(chat_id, queue, queue.jobs[0]))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+        return next_wake
+
+    async def _deliver(self, chat_id: int, queue: _ChatQueue, job: _Job):
+        loop = asyncio.get_running_loop()
+        if job.attempts == 0:
+            latency = loop.time() - job.enqueued
+            self.queue_latency_total += latency
+            if latency > self.queue_latency_max:
+                self.queue_latency_max = latency
+        job.attempts += 1
+
+        started = loop.time()
+        outcome = "error"
+        try:
+            result = await job.factory()
+            outcome = "ok"
+        except TelegramRetryAfter as e:
+            outcome = "retry_after"
+            if job.attempts <= self.max_retries:
+                self.retries += 1
+                queue.blocked_until = loop.time() + e.retry_after
+                logging.warning(f"📤 Flood limit in chat {chat_id}, retrying in {e.retry_after}s")
+                return
+            self._finish(chat_id, queue, job, error=e)
+        except Exception as e:
+            self._finish(chat_id, queue, job, error=e)
+        else:
+            self._finish(chat_id, queue, job, result=result)
+        finally:
+            SEND_SECONDS.observe(loop.time() - started, outcome)
+            queue.busy = False
+            self._wakeup.set()
+
+    def _finish(self, chat_id: int, queue: _ChatQueue, job: _Job, result=None, error: Exception = None):
+        queue.jobs.popleft()
+        if not queue.jobs:
+            del self._chats[chat_id]
+        if error is None:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        else:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+
+    def _prune_buckets(self, now: float):
+        """Forget per-chat buckets that have refilled completely."""
+        idle = [chat_id for chat_id, bucket in self._buckets.items()
+                if chat_id not in self._chats and bucket.is_full(now)]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_prune = loop.time()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            delay = self._dispatch(now)
+            if now - last_prune > 60:
+                self._prune_buckets(now)
+                last_prune = now
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+def _log_unretrieved_error(future: asyncio.Future):
+    # Retrieving the exception keeps asyncio from warning about fire-and-forget sends
+    if not future.cancelled() and future.exception() is not None:
+        logging.debug(f"Outbound send failed: {future.exception()!r}")
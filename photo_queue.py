@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+
+_STOP = object()
+
+
+class PhotoWriteQueue:
+    """
+    Write-behind buffer for chat_photos rows.
+
+    Handlers put() rows and return immediately; a background task flushes them
+    as one bulk insert when max_batch rows are buffered or flush_interval
+    seconds have passed since the first buffered row. put() waits when
+    max_pending rows are already queued (backpressure). Batches that cannot be
+    written are appended to a local JSON-lines spill file and retried after
+    the next successful flush. A spilled batch still rejected after
+    max_replays such retries (e.g. a constraint error, while the DB takes
+    other rows) is moved to a ".rejected" file next to the spill file.
+    """
+
+    def __init__(self, insert_rows, max_batch: int = 50, flush_interval: float = 2.0,
+                 max_pending: int = 1000, spill_path: str = "chat_photos.spill.jsonl",
+                 max_replays: int = 3):
+        """
+        Args:
+            insert_rows: async callable(rows) doing the bulk insert; returns None on failure
+            max_batch: Rows per insert
+            flush_interval: Max seconds a row waits in the buffer
+            max_pending: Queue capacity before put() blocks
+            spill_path: Append-only file for batches the DB rejected
+            max_replays: Failed retries of a spilled batch before it is set aside
+        """
+        self._insert_rows = insert_rows
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.rejected_path = spill_path + ".rejected"
+        self.max_replays = max_replays
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+        self.flushed = 0
+        self.duplicates = 0
+        self.spilled = 0
+        self.rejected = 0
+        # Failed replays of the first batch of the spill file, in a row
+        self._replay_failures = 0
+        # A spill file may be left over from a previous run
+        self._spill_pending = os.path.exists(spill_path)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, row: dict):
+        """Queue a row for insertion. Waits while the queue is full."""
+        await self._queue.put(row)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "flushed": self.flushed,
+            "duplicates": self.duplicates,
+            "spilled": self.spilled,
+            "rejected": self.rejected,
+        }
+
+    async def close(self):
+        """Flush everything still queued and stop the background task."""
+        if self._task is None:
+            rows = []
+            while not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            for start in range(0, len(rows), self.max_batch):
+                await self._flush(rows[start:start + self.max_batch])
+            return
+
+        # The stop marker queues behind every pending row, so all of them are flushed first
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row = await self._queue.get()
+            if row is _STOP:
+                return
+
+            batch = [row]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logging.error(f"📸 Photo flush failed: {e!r}")
+            if stopping:
+                return
+
+    def _dedupe(self, rows: list) -> list:
+        unique = {}
+        for row in rows:
+            key = row.get("file_unique_id") or id(row)
+            if key not in unique:
+                unique[key] = row
+        self.duplicates += len(rows) - len(unique)
+        return list(unique.values())
+
+    async def _flush(self, rows: list):
+        rows = self._dedupe(rows)
+        if not rows:
+            return
+
+        if await self._insert_rows(rows) is None:
+            await asyncio.to_thread(self._spill, self.spill_path, rows)
+            self._spill_pending = True
+            self.spilled += len(rows)
+            logging.warning(f"📸 DB unavailable, spilled {len(rows)} photo rows to {self.spill_path}")
+            return
+
+        self.flushed += len(rows)
+        logging.info(f"📸 Saved {len(rows)} photos")
+        if self._spill_pending:
+            await self._replay_spill()
+
+    def _spill(self, path: str, rows: list):
+        with open(path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def _read_spill(self) -> list:
+        if not os.path.exists(self.spill_path):
+            return []
+        with open(self.spill_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    async def _replay_spill(self):
+        """Re-insert spilled rows once the DB accepts writes again."""
+        rows = await asyncio.to_thread(self._read_spill)
+        if not rows:
+            self._spill_pending = False
+            return
+
+        written = 0
+        for start in range(0, len(rows), self.max_batch):
+            batch = rows[start:start + self.max_batch]
+            if await self._insert_rows(batch) is not None:
+                written += len(batch)
+                self._replay_failures = 0
+                continue
+            self._replay_failures += 1
+            if self._replay_failures < self.max_replays:
+                # Keep what has not been written yet for the next attempt
+                await asyncio.to_thread(self._rewrite_spill, rows[start:])
+                self.flushed += written
+                return
+            # Replays follow a successful flush: the DB is up, and it rejects this batch itself
+            await asyncio.to_thread(self._spill, self.rejected_path, batch)
+            self._replay_failures = 0
+            self.rejected += len(batch)
+            logging.error(
+                f"📸 {len(batch)} spilled photo rows rejected {self.max_replays} times, moved to {self.rejected_path}"
+            )
+
+        await asyncio.to_thread(os.remove, self.spill_path)
+        self._spill_pending = False
+        self.flushed += written
+        logging.info(f"📸 Replayed {written} spilled photo rows")
+
+    def _rewrite_spill(self, rows: list):
+        tmp_path = self.spill_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.spill_path)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import random
+from collections import deque
+from metrics import STAGE_SECONDS, PIPELINE_DROPPED
+
+# Message priorities: lower value is kept longer when a chat floods
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+
+class _Item:
+    __slots__ = ("priority", "factory", "future", "enqueued")
+
+    def __init__(self, priority: int, factory, future, enqueued: float):
+        self.priority = priority
+        self.factory = factory
+        self.future = future
+        self.enqueued = enqueued
+
+
+class ChatPipeline:
+    """
+    Runs the message jobs of each chat one at a time, in arrival order.
+
+    Each job is a zero-argument coroutine factory running the stages for one
+    message. Every chat has a bounded queue drained by its own task, so a
+    chat never has more than one job running and a flooding chat only fills
+    (and sheds from) its own queue while other chats go on as usual.
+
+    Load shedding, per chat:
+    - once a queue is past shed_watermark of its size, only shed_sample of
+      new PRIORITY_LOW messages are let in;
+    - a full queue drops its oldest PRIORITY_LOW message to make room, or
+      the new message if everything queued is PRIORITY_HIGH (or the new
+      message is PRIORITY_LOW itself).
+    Dropped messages resolve their submit() with None and are counted.
+
+    A job can hand its slow tail to detach(): the chat's next job starts
+    right away, so the ordering covers matching and the steps before it.
+    """
+
+    def __init__(self, max_queue: int = 20, shed_watermark: float = 0.5, shed_sample: float = 0.25):
+        self.max_queue = max_queue
+        self.shed_watermark = shed_watermark
+        self.shed_sample = shed_sample
+        self._chats = {}
+        self._tasks = set()
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._chats.values())
+
+    def stats(self) -> dict:
+        return {
+            "active_chats": len(self._chats),
+            "queued": self.queued(),
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def _drop(self, item: _Item, reason: str):
+        self.dropped += 1
+        PIPELINE_DROPPED.inc(reason)
+        if not item.future.done():
+            item.future.set_result(None)
+
+    def _admit(self, queue: deque, item: _Item) -> bool:
+        """Applies the shedding rules; returns whether item should be queued."""
+        if item.priority == PRIORITY_LOW and len(queue) >= self.max_queue * self.shed_watermark:
+            if random.random() >= self.shed_sample:
+                self._drop(item, "sampled")
+                return False
+        if len(queue) < self.max_queue:
+            return True
+        if item.priority != PRIORITY_LOW:
+            for queued in queue:
+                if queued.priority == PRIORITY_LOW:
+                    queue.remove(queued)
+                    self._drop(queued, "overflow")
+                    return True
+        self._drop(item, "overflow")
+        return False
+
+    def submit(self, chat_id: int, factory, priority: int = PRIORITY_LOW) -> asyncio.Future:
+        """
+        Queue a job for chat_id. The returned future resolves to the job's
+        result once it ran, or to None if it was shed.
+        """
+        loop = asyncio.get_running_loop()
+        item = _Item(priority, factory, loop.create_future(), loop.time())
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+            task = asyncio.create_task(self._drain(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._admit(queue, item):
+            queue.append(item)
+        return item.future
+
+    async def _drain(self, chat_id: int, queue: deque):
+        loop = asyncio.get_running_loop()
+        try:
+            while queue:
+                item = queue.popleft()
+                STAGE_SECONDS.observe(loop.time() - item.enqueued, "queue")
+                try:
+                    result = await item.factory()
+                except Exception as e:
+                    self.failed += 1
+                    logging.error(f"Pipeline job for chat {chat_id} failed: {e!r}")
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                else:
+                    self.processed += 1
+                    if not item.future.done():
+                        item.future.set_result(result)
+        finally:
+            if self._chats.get(chat_id) is queue:
+                del self._chats[chat_id]
+            for item in queue:
+                item.future.cancel()
+
+    def detach(self, coro) -> asyncio.Task:
+        """
+        Runs coro as a task of its own, outside any chat's slot, so a slow
+        step (an AI reply) does not hold up the chat's next jobs. close()
+        waits for it like for queued jobs.
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self, timeout: float = 10.0):
+        """Wait (up to timeout) for queued jobs and detached tasks to finish, then cancel the rest."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Jobs still running can detach new tasks, so wait until none are left
+        while self._tasks and loop.time() < deadline:
+            await asyncio.wait(set(self._tasks), timeout=deadline - loop.time())
+        pending = set(self._tasks)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
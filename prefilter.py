@@ -0,0 +1,369 @@
+from collections import Counter
+from functools import lru_cache
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+# Exact hits: each keyword is anchored by its rarest substring of this length
+# (shorter keywords by themselves), looked up among the substrings of each word
+ANCHOR_LENGTH = 4
+# Words up to this long are checked through their deletion neighbourhood
+MAX_HASHED_WORD = 11
+# Most variants a word of one length, or a keyword against one word length, may
+# have; past these, per-length anchors stand in for them (see _anchors_for_length)
+WORD_VARIANTS_MAX = 256
+KEYWORD_VARIANTS_MAX = 1000
+# In messages of up to GATE_WORDS words, words first need an anchor of a hashed
+# keyword (as for the rest), so that most such messages are ruled out before any
+# hashing; longer messages nearly always have a word that passes. There is no
+# gate past GATE_MAX anchors: nearly every word has one
+GATE_WORDS = 8
+GATE_MAX = 256
+# Hashes a message computes and looks up at a time
+LOOKUP_HASHES = 1024
+
+# A string's hash is the sum of its character codes times these, by position (mod 2**64),
+# so all subsequences and substrings of a batch of words are hashed in one matrix product.
+# Substrings (exact anchors) get their own weights: both kinds share one set of hashes
+_WEIGHTS, _ANCHOR_WEIGHTS = np.random.default_rng(0).integers(
+    0, 2 ** 64, (2, MAX_HASHED_WORD), dtype=np.uint64, endpoint=False) | 1
+
+
+def common_length(kw_len: int, word_len: int, threshold: int) -> int | None:
+    """
+    Shortest common subsequence a keyword and a word of these lengths need for
+    round(fuzz.ratio) to reach threshold, or None if no word of word_len can.
+    fuzz.ratio is 200 * lcs / (kw_len + word_len), so this is the smallest lcs
+    with 400 * lcs >= (2 * threshold - 1) * (kw_len + word_len).
+    """
+    needed = -(-(2 * threshold - 1) * (kw_len + word_len) // 400)
+    return needed if needed <= min(kw_len, word_len) else None
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _codes(strings: list, size: int) -> np.ndarray:
+    """Character codes of strings, all of length size, one row each."""
+    return _text_codes("".join(strings)).reshape(len(strings), size)
+
+
+def _text_codes(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype="<u4").astype(np.uint64)
+
+
+def _fingerprints(hashes: np.ndarray) -> np.ndarray:
+    return (hashes >> np.uint64(32)).astype(np.uint32)
+
+
+@lru_cache(maxsize=256)
+def _projection(size: int, lengths: tuple, windows: tuple = ()) -> np.ndarray:
+    """
+    Matrix turning the codes of strings of size into the hashes of their
+    subsequences of each of lengths, then of their substrings of each of windows.
+    """
+    columns = []
+    for length in lengths:
+        for positions in combinations(range(size), length):
+            column = np.zeros(size, dtype=np.uint64)
+            column[list(positions)] = _WEIGHTS[:length]
+            columns.append(column)
+    for length in windows:
+        for start in range(size - length + 1):
+            column = np.zeros(size, dtype=np.uint64)
+            column[start:start + length] = _ANCHOR_WEIGHTS[:length]
+            columns.append(column)
+    return np.array(columns, dtype=np.uint64).reshape(len(columns), size).T.copy()
+
+
+class _HashSet:
+    """
+    Set of 64-bit hashes, kept as their top 32 bits (a collision only lets a
+    word through), with a vectorized any(): a sorted array, and for larger
+    lookups a table of two to four slots per hash, indexed by the top bits,
+    that rules out most of them first.
+    """
+
+    __slots__ = ("_sorted", "_slots", "_shift")
+
+    # Lookups of up to this many hashes go straight to the sorted array
+    DIRECT_LOOKUPS = 256
+
+    def __init__(self, fingerprints: np.ndarray):
+        """
+        Args:
+            fingerprints: A new array of _fingerprints(), sorted in place (np.unique() would copy it twice)
+        """
+        fingerprints.sort()
+        distinct = np.empty(len(fingerprints), dtype=bool)
+        distinct[:1] = True
+        np.not_equal(fingerprints[1:], fingerprints[:-1], out=distinct[1:])
+        self._sorted = fingerprints[distinct]
+        bits = max((len(self._sorted) * 2).bit_length(), 4)
+        self._shift = np.uint64(64 - bits)
+        self._slots = np.zeros(1 << bits, dtype=bool)
+        self._slots[self._sorted >> np.uint32(32 - bits)] = True
+
+    def contains_any(self, hashes: np.ndarray) -> bool:
+        if not len(self._sorted):
+            return False
+        if len(hashes) > self.DIRECT_LOOKUPS:
+            # As int64: a uint64 index would be copied to one first
+            hashes = hashes[self._slots[(hashes >> self._shift).view(np.int64)]]
+        fingerprints = _fingerprints(hashes)
+        found = self._sorted.take(self._sorted.searchsorted(fingerprints), mode="clip")
+        return bool((found == fingerprints).any())
+
+
+class KeywordFilter:
+    """
+    Token-level pre-filter over the keywords of a trigger bucket: may_match()
+    is False only for words none of which can match a keyword, exactly or
+    fuzzily (round(fuzz.ratio) >= the keyword's threshold).
+
+    - Exact: a keyword inside the text has each of its whitespace-free pieces
+      inside one word, so the rarest ANCHOR_LENGTH-gram of one piece is enough.
+    - Fuzzy: a word and a keyword of lengths w and k reaching the threshold
+      share a subsequence of common_length(k, w, threshold) characters. Each
+      keyword's subsequences of the lengths it needs (its deletion neighbourhood,
+      whitespace left out) are stored as hashes; a word looks up its own
+      subsequences of the lengths its length needs. Only words up to
+      MAX_HASHED_WORD and neighbourhoods within WORD_VARIANTS_MAX and
+      KEYWORD_VARIANTS_MAX are hashed (they grow combinatorially).
+    - The rest (long words, low thresholds far from the word's length) go
+      through per-length anchors: a bigram or character a keyword shares with
+      any word it can match.
+
+    Words up to MAX_HASHED_WORD are hashed a batch per length, in one matrix
+    product (see _projection).
+    """
+
+    __slots__ = (
+        "always", "_keywords", "_anchors", "_anchor_lengths", "_word_lengths", "_projections", "_hashes",
+        "_keys", "_length_cache", "_anchor_sets"
+    )
+
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords: (keyword, threshold) pairs, every form of a keyword that is matched
+        """
+        self._keywords = tuple(dict.fromkeys(keywords))
+        # Whitespace-only keywords are inside every text; a threshold of 0 matches every word
+        self.always = any(not keyword.strip() or threshold <= 0 for keyword, threshold in self._keywords)
+        self._anchors = frozenset()
+        self._anchor_lengths = ()
+        self._word_lengths = {}
+        # word length -> _projection() for its subsequences and anchor-length substrings
+        self._projections = {}
+        # Hashes of the anchors and of the keyword subsequences the words look up
+        self._hashes = None
+        # Built on the first _anchors_for_length() call
+        self._keys = None
+        # word length -> what a word of that length needs in common with the keywords
+        self._length_cache = {}
+        # One copy of each anchor set: most word lengths share theirs with others
+        self._anchor_sets = {}
+        if not self.always:
+            self._build_hashes()
+
+    def _build_hashes(self):
+        def pieces(keyword):
+            # Whitespace-free stretches of keyword, cut into ANCHOR_LENGTH-grams (or whole if shorter)
+            return {piece[i:i + ANCHOR_LENGTH] for piece in keyword.split()
+                    for i in range(max(len(piece) - ANCHOR_LENGTH, 0) + 1)}
+
+        # Rarity of a gram by its bigrams: a count of every distinct gram would take
+        # far more memory than the hashes themselves in buckets of thousands of keywords
+        frequency = Counter()
+        for keyword, _ in self._keywords:
+            frequency.update(_bigrams(keyword))
+
+        def commonness(gram):
+            return sum(frequency[gram[i:i + 2]] for i in range(len(gram) - 1))
+
+        # Longest first (a short anchor is inside many more words), then rarest
+        anchors = {min(pieces(keyword), key=lambda gram: (-len(gram), commonness(gram), gram))
+                   for keyword, _ in self._keywords}
+        grams_by_length = {}
+        for gram in anchors:
+            grams_by_length.setdefault(len(gram), []).append(gram)
+        self._anchors = frozenset(anchors)
+        self._anchor_lengths = tuple(sorted(grams_by_length))
+        hashes = [_fingerprints(_codes(grams, length) @ _ANCHOR_WEIGHTS[:length])
+                  for length, grams in grams_by_length.items()]
+
+        # Per word length: the subsequence lengths keywords need from its words, longest
+        # (fewest variants) first, as many as fit into WORD_VARIANTS_MAX
+        needs = {}
+        for kw_id, (keyword, threshold) in enumerate(self._keywords):
+            size = len(keyword) - sum(char.isspace() for char in keyword)
+            for word_len in range(1, MAX_HASHED_WORD + 1):
+                length = common_length(len(keyword), word_len, threshold)
+                if length is not None and length <= size and comb(size, length) <= KEYWORD_VARIANTS_MAX:
+                    needs.setdefault(word_len, {}).setdefault(length, []).append(kw_id)
+        word_lengths = {}
+        keyword_lengths = {}
+        for word_len in range(1, MAX_HASHED_WORD + 1):
+            chosen = []
+            budget = WORD_VARIANTS_MAX
+            by_length = needs.get(word_len, {})
+            for length in sorted(by_length, reverse=True):
+                if comb(word_len, length) > budget:
+                    break
+                budget -= comb(word_len, length)
+                chosen.append(length)
+                for kw_id in by_length[length]:
+                    keyword_lengths.setdefault(kw_id, set()).add(length)
+            word_lengths[word_len] = tuple(chosen)
+
+        # Hashes of every keyword subsequence some word length looks up, a batch per (size, lengths)
+        batches = {}
+        for kw_id, lengths in keyword_lengths.items():
+            compact = "".join(self._keywords[kw_id][0].split())
+            batches.setdefault((len(compact), tuple(sorted(lengths))), []).append(compact)
+        hashes.extend(_fingerprints(_codes(compacts, size) @ _projection(size, lengths)).ravel()
+                      for (size, lengths), compacts in batches.items())
+        # Rebound so that the pieces are freed before the set is built
+        hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint32)
+        self._hashes = _HashSet(hashes)
+        self._word_lengths = word_lengths
+        for word_len, lengths in word_lengths.items():
+            windows = tuple(length for length in self._anchor_lengths if length <= word_len)
+            if lengths or windows:
+                # Otherwise no hash is looked up for words of word_len
+                self._projections[word_len] = _projection(word_len, lengths, windows)
+
+    def _prefilter_keys(self) -> tuple:
+        """
+        Per keyword: its repeated bigrams and characters, and its whitespace-free
+        distinct bigrams and characters, rarest (among these keywords) first.
+        Each distinct bigram or character is one shared string, which keeps this
+        small for buckets of thousands of keywords.
+        """
+        bigram_frequency = Counter()
+        char_frequency = Counter()
+        for keyword, _ in self._keywords:
+            bigram_frequency.update(_bigrams(keyword))
+            char_frequency.update(set(keyword))
+        shared = {gram: gram for gram in bigram_frequency}
+        shared.update((char, char) for char in char_frequency)
+        keys = []
+        for keyword, _ in self._keywords:
+            grams = _bigrams(keyword)
+            chars = set(keyword)
+            keys.append((
+                max(len(keyword) - 1, 0) - len(grams),
+                len(keyword) - len(chars),
+                tuple(sorted((shared[gram] for gram in grams if not gram[0].isspace() and not gram[1].isspace()),
+                             key=lambda gram: (bigram_frequency[gram], gram))),
+                tuple(sorted((shared[char] for char in chars if not char.isspace()),
+                             key=lambda char: (char_frequency[char], char))),
+            ))
+        return tuple(keys)
+
+    def _anchors_for_length(self, word_len: int) -> tuple:
+        """
+        What a word of word_len must have in common with a keyword the hashes do
+        not cover for it (every keyword, for words over MAX_HASHED_WORD):
+        (bigrams, characters), one of which it must contain. Then the same for
+        the keywords they do cover and the exact anchors, as a gate in front of
+        the hashing (None past GATE_MAX of them).
+
+        A keyword within indel distance d of the word shares at least
+        max(len) - 1 - 2 * d bigrams with it, counted with repeats, and at least
+        (len_a + len_b - d) / 2 characters (their longest common subsequence).
+        Counted as distinct bigrams or characters, the keyword's repeated ones
+        come off these bounds. A word sharing at least r of the keyword's n
+        distinct bigrams contains one of any n - r + 1 of them, so only the
+        keyword's rarest n - r + 1 bigrams are needed (likewise for characters,
+        used where the bigram bound is not positive).
+        """
+        if self._keys is None:
+            self._keys = self._prefilter_keys()
+        hashed_lengths = self._word_lengths.get(word_len, ())
+        # (bigrams, characters) of the keywords the hashes do not cover, then of those they do
+        anchors = ((set(), set()), (set(), set()))
+        for kw_id, (keyword, threshold) in enumerate(self._keywords):
+            kw_len = len(keyword)
+            size = kw_len - sum(char.isspace() for char in keyword)
+            length = common_length(kw_len, word_len, threshold)
+            if length is None or length > size:
+                # A word has no whitespace, so no word of word_len reaches the threshold
+                continue
+            bigrams, characters = anchors[length in hashed_lengths and comb(size, length) <= KEYWORD_VARIANTS_MAX]
+            total = kw_len + word_len
+            max_distance = (total * (201 - 2 * threshold)) // 200
+            bigram_bound = max(kw_len, word_len) - 1 - 2 * max_distance
+            char_bound = (total - max_distance + 1) // 2
+            repeated_bigrams, repeated_chars, kw_bigrams, kw_chars = self._keys[kw_id]
+            needed = bigram_bound - repeated_bigrams
+            if needed >= 1:
+                bigrams.update(kw_bigrams[:len(kw_bigrams) - needed + 1])
+            else:
+                needed = max(char_bound - repeated_chars, 1)
+                characters.update(kw_chars[:len(kw_chars) - needed + 1])
+        (bigrams, characters), gate = anchors
+        # A word holding an exact anchor holds its first bigram (or character) too
+        for gram in self._anchors:
+            if len(gram) <= word_len:
+                gate[len(gram) == 1].add(gram[:2])
+        entry = (
+            self._shared(bigrams), self._shared(characters),
+            tuple(map(self._shared, gate)) if sum(map(len, gate)) <= GATE_MAX else None
+        )
+        self._length_cache[word_len] = entry
+        return entry
+
+    def _shared(self, anchors: set) -> frozenset:
+        frozen = frozenset(anchors)
+        return self._anchor_sets.setdefault(frozen, frozen)
+
+    def may_match(self, words) -> bool:
+        """False if no keyword can match any of words (whitespace-free tokens), exactly or fuzzily."""
+        if self.always:
+            return True
+        cache = self._length_cache
+        words = dict.fromkeys(words)
+        gated = len(words) <= GATE_WORDS
+        batches = {}
+        for word in words:
+            size = len(word)
+            bigrams, characters, gate = cache.get(size) or self._anchors_for_length(size)
+            if not gated:
+                gate = None
+            if bigrams or characters or gate:
+                word_bigrams = [word[i:i + 2] for i in range(size - 1)]
+                if bigrams and not bigrams.isdisjoint(word_bigrams):
+                    return True
+                if characters and not characters.isdisjoint(word):
+                    return True
+                if gate and gate[0].isdisjoint(word_bigrams) and (not gate[1] or gate[1].isdisjoint(word)):
+                    continue
+            if size > MAX_HASHED_WORD:
+                # Too long for a projection: exact anchors looked up here
+                for length in self._anchor_lengths:
+                    if not self._anchors.isdisjoint([word[i:i + length] for i in range(size - length + 1)]):
+                        return True
+                continue
+            if size in self._projections:
+                batches.setdefault(size, []).append(word)
+        if not batches:
+            return False
+
+        # One encoding for every batch, each a slice of it; at most LOOKUP_HASHES
+        # hashes at a time, so that a long message allocates little
+        codes = _text_codes("".join(word for group in batches.values() for word in group))
+        start = 0
+        for size, group in batches.items():
+            end = start + size * len(group)
+            rows = codes[start:end].reshape(len(group), size)
+            projection = self._projections[size]
+            step = max(LOOKUP_HASHES // projection.shape[1], 1)
+            for row in range(0, len(rows), step):
+                if self._hashes.contains_any((rows[row:row + step] @ projection).ravel()):
+                    return True
+            start = end
+        return False
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(system_prompt: str, model: str, temperature: float, normalized_message: str, history: list) -> str:
+    """
+    Cache key for an AI reply: system prompt hash, resolved model, temperature,
+    normalized user message (NormalizedMessage.cache_text) and a hash of the
+    context sent with it (the history window, after the summary if one is sent).
+    """
+    history_hash = hashlib.sha256(
+        json.dumps(history, ensure_ascii=False, separators=(",", ":")).encode()
+    ).hexdigest()
+    prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+    raw = "\x1f".join((prompt_hash, model, repr(float(temperature)), normalized_message, history_hash))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class AIResponseCache:
+    """
+    LRU cache of AI replies with a per-entry TTL and a total byte budget.
+
+    Entries expire after the TTL given to put(); the least recently used
+    entries are evicted when max_entries or max_bytes would be exceeded.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: str, ttl: float):
+        size = len(key) + len(value.encode())
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
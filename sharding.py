@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+from contextlib import suppress
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Update
+
+# Updates handed from the ingress thread to the loop per wake-up
+READ_BATCH = 100
+
+
+def shard_for(key: int, workers: int) -> int:
+    """Worker that owns a chat. Python's % is non-negative, so group ids (< 0) work too."""
+    return key % workers
+
+
+class ShardRouter(BaseMiddleware):
+    """
+    Outer update middleware for the ingress dispatcher.
+
+    Instead of handling an update it serializes it and puts it on the queue
+    of the worker that owns the chat (the sender for chat-less updates), so
+    every update of a chat is processed by the same worker.
+    """
+
+    def __init__(self, queues: list):
+        self.queues = queues
+        self.routed = [0] * len(queues)
+
+    async def __call__(self, handler, event: Update, data: dict):
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat is not None else (user.id if user is not None else 0)
+        shard = shard_for(key, len(self.queues))
+        # Unbounded multiprocessing queue: put() hands off to a feeder thread and never blocks the loop
+        self.queues[shard].put(event.model_dump_json(exclude_unset=True))
+        self.routed[shard] += 1
+        return None
+
+
+def _read_batch(updates) -> list:
+    """Blocking: wait for one update, then take whatever else is already queued."""
+    batch = [updates.get()]
+    while len(batch) < READ_BATCH and batch[-1] is not None:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def serve_shard(updates, dp: Dispatcher, bot: Bot, concurrency: int = 16, **kwargs):
+    """
+    Worker side: feed updates from the ingress queue to the dispatcher until
+    a None sentinel arrives, then wait for the updates still being handled.
+    At most concurrency updates are handled at once.
+    """
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data, **kwargs}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    slots = asyncio.Semaphore(concurrency)
+    in_flight = set()
+
+    async def handle(update: Update):
+        try:
+            await dp.feed_update(bot, update, **workflow_data)
+        except Exception as e:
+            logging.error(f"Failed to process update {update.update_id}: {e!r}")
+        finally:
+            slots.release()
+
+    try:
+        stopping = False
+        while not stopping:
+            for raw in await asyncio.to_thread(_read_batch, updates):
+                if raw is None:
+                    stopping = True
+                    break
+                await slots.acquire()
+                update = Update.model_validate_json(raw, context={"bot": bot})
+                task = asyncio.create_task(handle(update))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+    finally:
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+
+
+class WorkerPool:
+    """
+    Worker processes of a sharded bot, one update queue each.
+
+    Workers are started with the spawn method and WORKER_INDEX in their
+    environment; a worker that dies is restarted on the same queue, so
+    updates already routed to it are not lost.
+    """
+
+    def __init__(self, target, workers: int):
+        """
+        Args:
+            target: Importable function run in each worker as target(index, queue)
+            workers: Number of worker processes
+        """
+        self.target = target
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.restarts = 0
+
+    def _spawn(self, index: int):
+        os.environ["WORKER_INDEX"] = str(index)
+        try:
+            process = self._context.Process(
+                target=self.target, args=(index, self.queues[index]), name=f"bot-worker-{index}", daemon=False
+            )
+            process.start()
+        finally:
+            del os.environ["WORKER_INDEX"]
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    async def supervise(self, interval: float = 1.0):
+        """Background task: restart workers that exited unexpectedly."""
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logging.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    self.restarts += 1
+                    self._spawn(index)
+
+    async def stop(self, timeout: float = 30.0):
+        """Ask every worker to finish its queue and exit; terminate those that do not in time."""
+        for updates in self.queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for index, process in enumerate(self.processes):
+            await asyncio.to_thread(process.join, max(0.0, deadline - loop.time()))
+            if process.is_alive():
+                logging.warning(f"Worker {index} did not stop in time, terminating")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
+        for updates in self.queues:
+            updates.close()
+            with suppress(Exception):
+                updates.join_thread()
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import handlers
+from ai_client import export_ai_state, restore_ai_state
+from state_backend import chat_state
+
+# One row per section; all sections are replaced in a single transaction
+_SCHEMA = "CREATE TABLE IF NOT EXISTS snapshot (section TEXT PRIMARY KEY, saved_at REAL, data TEXT)"
+
+
+def collect_state() -> dict:
+    """Copy of everything worth keeping across a restart. Runs on the event loop, no I/O."""
+    return {
+        # Cooldowns and history; empty when a shared backend already keeps them on disk
+        **chat_state.export(),
+        "ai_config": export_ai_state()["config"],
+        "triggers": {
+            "rows": list(handlers.TRIGGERS_CACHE),
+            "watermark": handlers.trigger_sync.watermark,
+        },
+    }
+
+
+def write_snapshot(path: str, state: dict):
+    """Blocking write of a collected state to the SQLite file."""
+    saved_at = time.time()
+    rows = [(section, saved_at, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            for section, data in state.items()]
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(_SCHEMA)
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?)", rows)
+    finally:
+        conn.close()
+
+
+def read_snapshot(path: str) -> dict:
+    """Blocking read of all sections. Returns {} if the file is missing or unreadable."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return {}
+    try:
+        return {section: json.loads(data) for section, data in conn.execute("SELECT section, data FROM snapshot")}
+    except (sqlite3.Error, ValueError) as e:
+        logging.warning(f"Ignoring unreadable snapshot {path}: {e!r}")
+        return {}
+    finally:
+        conn.close()
+
+
+async def load_snapshot(path: str) -> bool:
+    """
+    Restore cooldowns, AI state and triggers from the snapshot file.
+    Returns True if a trigger set was restored (the bot can serve right away).
+    """
+    started = time.perf_counter()
+    state = read_snapshot(path)
+    if not state:
+        return False
+
+    chat_state.restore(state)
+    restore_ai_state({"config": state.get("ai_config", {})})
+
+    triggers = state.get("triggers")
+    if triggers is not None:
+        await handlers.trigger_sync.load_snapshot(triggers["rows"], triggers.get("watermark"))
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logging.info(
+        f"💾 Snapshot loaded in {elapsed_ms:.1f} ms: "
+        f"{len(handlers.TRIGGERS_CACHE)} triggers, {chat_state.stats()['cooldowns']['entries']} cooldowns"
+    )
+    return triggers is not None
+
+
+async def save_snapshot(path: str):
+    """Collect state on the loop, write it from a worker thread."""
+    state = collect_state()
+    await asyncio.to_thread(write_snapshot, path, state)
+
+
+async def run_snapshots(path: str, interval: float):
+    """Background task: save a snapshot every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save_snapshot(path)
+        except Exception as e:
+            logging.error(f"Failed to save snapshot: {e!r}")
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from config import STATE_BACKEND, STATE_DB_PATH, AI_HISTORY_MAX_CHATS
+from history_store import ChatHistoryStore
+from utils import CooldownManager
+
+# AI conversation memory per chat
+MAX_HISTORY_LENGTH = 5  # Keep last 5 messages per chat
+MEMORY_EXPIRATION_SECONDS = 6 * 3600  # 6 hours
+# Rows SQLiteStateBackend.sweep() deletes per statement (each one holds the write lock)
+SWEEP_CHUNK = 500
+
+
+class MemoryStateBackend:
+    """
+    Cooldowns and AI chat history held in this process.
+
+    The default, and the fastest: state lives in a CooldownManager and a
+    ChatHistoryStore and is carried across restarts by the local snapshot.
+    With several worker processes each one only sees the chats of its own
+    partition, so state does not follow a chat when the number of workers
+    changes.
+    """
+
+    # sweep() works on the structures the handlers use, so it runs on the loop
+    sweep_in_thread = False
+
+    def __init__(self, cooldowns: CooldownManager, history: ChatHistoryStore):
+        self.cooldowns = cooldowns
+        self.history = history
+
+    def claim_cooldown(self, chat_id: int, trigger_id: int, cooldown_seconds: int, timestamp: float = None) -> bool:
+        """Marks the trigger as fired if it is off cooldown. Returns whether it was."""
+        if not self.cooldowns.can_trigger(chat_id, trigger_id, cooldown_seconds, timestamp=timestamp):
+            return False
+        self.cooldowns.mark_triggered(chat_id, trigger_id, timestamp=timestamp, cooldown_seconds=cooldown_seconds)
+        return True
+
+    def get_history(self, chat_id: int) -> list:
+        return self.history.get(chat_id)
+
+    def add_history(self, chat_id: int, role: str, content: str):
+        self.history.add(chat_id, role, content)
+
+    def clear_history(self, chat_id: int):
+        self.history.clear(chat_id)
+
+    def sweep(self) -> int:
+        return self.history.sweep()
+
+    def export(self) -> dict:
+        """Sections for the local snapshot."""
+        return {"cooldowns": self.cooldowns.export(), "history": self.history.export()}
+
+    def restore(self, sections: dict):
+        self.cooldowns.restore(sections.get("cooldowns", []))
+        self.history.restore(sections.get("history", []))
+
+    def stats(self) -> dict:
+        return {"cooldowns": self.cooldowns.stats(), "history": self.history.stats()}
+
+    def close(self):
+        pass
+
+
+class SQLiteStateBackend:
+    """
+    Cooldowns and AI chat history in a SQLite file shared by all worker processes.
+
+    The file runs in WAL mode, so readers never wait for writers. A cooldown
+    is claimed with a single conditional upsert, which keeps two processes
+    from firing the same trigger even while a chat moves between workers.
+    History follows the same session rules as ChatHistoryStore, except that
+    there is no cap on the number of chats: sweep() drops expired sessions
+    and cooldowns instead.
+
+    Calls are synchronous, run on the event loop and take well under a
+    millisecond on a local disk. A write waits at most busy_timeout for
+    another process holding the write lock, then gives up: the cooldown
+    counts as not claimed, the history change is dropped. sweep() is the
+    exception: it runs in a thread (see run_sweeper) on its own connection,
+    deleting SWEEP_CHUNK rows per statement so that the lock is never held
+    for long.
+    """
+
+    sweep_in_thread = True
+
+    def __init__(self, path: str, max_messages: int = 5, expiration_seconds: float = 6 * 3600,
+                 grace_seconds: float = 60.0, busy_timeout: float = 0.05):
+        """
+        Args:
+            path: SQLite file, shared by every process
+            max_messages: Messages kept per chat
+            expiration_seconds: Session lifetime, counted from its first message
+            grace_seconds: How long a cooldown row is kept past its cooldown
+            busy_timeout: Seconds a write on the event loop waits for the write lock
+        """
+        self.path = path
+        self.max_messages = max_messages
+        self.expiration_seconds = expiration_seconds
+        self.grace_seconds = grace_seconds
+        # Autocommit; multi-statement updates open their own transaction
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        # Opened by the first sweep(), in the sweeper's thread
+        self._sweep_conn = None
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cooldowns (
+                chat_id INTEGER, trigger_id INTEGER, last_time REAL, expires_at REAL,
+                PRIMARY KEY (chat_id, trigger_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER, session_start REAL, role TEXT, content TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chat_history_chat ON chat_history (chat_id, id);
+        """)
+
+    def claim_cooldown(self, chat_id: int, trigger_id: int, cooldown_seconds: int, timestamp: float = None) -> bool:
+        """Marks the trigger as fired if it is off cooldown. Returns whether it was."""
+        current_time = timestamp if timestamp is not None else time.time()
+        try:
+            cursor = self._conn.execute(
+                "INSERT INTO cooldowns VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, trigger_id) DO UPDATE "
+                "SET last_time = excluded.last_time, expires_at = excluded.expires_at "
+                "WHERE excluded.last_time - cooldowns.last_time >= ?",
+                (chat_id, trigger_id, current_time, current_time + cooldown_seconds + self.grace_seconds,
+                 cooldown_seconds)
+            )
+        except sqlite3.OperationalError as e:
+            # Locked past busy_timeout: not firing is the side that cannot fire twice
+            logging.warning(f"Cooldown claim for chat {chat_id} failed: {e!r}")
+            return False
+        return cursor.rowcount == 1
+
+    def _is_expired(self, session_start: float, now: float) -> bool:
+        return now - session_start > self.expiration_seconds
+
+    def get_history(self, chat_id: int) -> list:
+        rows = self._conn.execute(
+            "SELECT session_start, role, content FROM chat_history WHERE chat_id = ? ORDER BY id", (chat_id,)
+        ).fetchall()
+        if not rows:
+            return []
+        if self._is_expired(rows[0][0], time.time()):
+            logging.info(f"⏳ Chat history session expired for chat {chat_id} (6 hours passed since start)")
+            self.clear_history(chat_id)
+            return []
+        return [{"role": role, "content": content} for _, role, content in rows]
+
+    def add_history(self, chat_id: int, role: str, content: str):
+        try:
+            self._add_history(chat_id, role, content)
+        except sqlite3.OperationalError as e:
+            logging.warning(f"AI history update for chat {chat_id} failed: {e!r}")
+
+    def _add_history(self, chat_id: int, role: str, content: str):
+        current_time = time.time()
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT session_start FROM chat_history WHERE chat_id = ? ORDER BY id LIMIT 1", (chat_id,)
+            ).fetchone()
+            if row is None or self._is_expired(row[0], current_time):
+                self._conn.execute("DELETE FROM chat_history WHERE chat_id = ?", (chat_id,))
+                session_start = current_time
+                logging.info(f"🆕 Started new 6-hour AI session for chat {chat_id}")
+            else:
+                session_start = row[0]
+            self._conn.execute(
+                "INSERT INTO chat_history (chat_id, session_start, role, content) VALUES (?, ?, ?, ?)",
+                (chat_id, session_start, role, content)
+            )
+            self._conn.execute(
+                "DELETE FROM chat_history WHERE chat_id = ? AND id NOT IN "
+                "(SELECT id FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+                (chat_id, chat_id, self.max_messages)
+            )
+
+    def clear_history(self, chat_id: int):
+        try:
+            self._conn.execute("DELETE FROM chat_history WHERE chat_id = ?", (chat_id,))
+        except sqlite3.OperationalError as e:
+            logging.warning(f"Clearing AI history of chat {chat_id} failed: {e!r}")
+
+    def sweep(self) -> int:
+        """
+        Drop expired sessions and cooldowns. Returns how many sessions were removed.
+        Uses its own connection, so it can run in a thread next to the event loop.
+        """
+        if self._sweep_conn is None:
+            self._sweep_conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn = self._sweep_conn
+        now = time.time()
+        cutoff = now - self.expiration_seconds
+        expired = conn.execute(
+            "SELECT COUNT(DISTINCT chat_id) FROM chat_history WHERE session_start < ?", (cutoff,)
+        ).fetchone()[0]
+        # A session is read as expired from its first row, so one deleted in parts is still gone
+        while conn.execute(
+            "DELETE FROM chat_history WHERE id IN "
+            "(SELECT id FROM chat_history WHERE session_start < ? LIMIT ?)", (cutoff, SWEEP_CHUNK)
+        ).rowcount == SWEEP_CHUNK:
+            pass
+        while conn.execute(
+            "DELETE FROM cooldowns WHERE (chat_id, trigger_id) IN "
+            "(SELECT chat_id, trigger_id FROM cooldowns WHERE expires_at < ? LIMIT ?)", (now, SWEEP_CHUNK)
+        ).rowcount == SWEEP_CHUNK:
+            pass
+        return expired
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._conn)
+
+    def export(self) -> dict:
+        # Already on disk
+        return {}
+
+    def restore(self, sections: dict):
+        pass
+
+    def stats(self) -> dict:
+        cooldowns = self._conn.execute("SELECT COUNT(*) FROM cooldowns").fetchone()[0]
+        chats, messages = self._conn.execute(
+            "SELECT COUNT(DISTINCT chat_id), COUNT(*) FROM chat_history"
+        ).fetchone()
+        return {"cooldowns": {"entries": cooldowns}, "history": {"chats": chats, "messages": messages}}
+
+    def close(self):
+        self._conn.close()
+        if self._sweep_conn is not None:
+            self._sweep_conn.close()
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT, so read-then-write sequences hold the write lock throughout."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def create_state_backend(kind: str = STATE_BACKEND, path: str = STATE_DB_PATH):
+    """Backend selected by STATE_BACKEND: "memory" (default) or "sqlite"."""
+    if kind == "sqlite":
+        return SQLiteStateBackend(path, max_messages=MAX_HISTORY_LENGTH, expiration_seconds=MEMORY_EXPIRATION_SECONDS)
+    if kind != "memory":
+        logging.warning(f"Unknown STATE_BACKEND {kind!r}, using memory")
+    return MemoryStateBackend(
+        CooldownManager(),
+        ChatHistoryStore(
+            max_chats=AI_HISTORY_MAX_CHATS,
+            max_messages=MAX_HISTORY_LENGTH,
+            expiration_seconds=MEMORY_EXPIRATION_SECONDS
+        )
+    )
+
+
+async def run_sweeper(backend, interval: float = 600.0):
+    """Background task: sweep expired state every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(backend.sweep) if backend.sweep_in_thread else backend.sweep()
+        except Exception as e:
+            logging.error(f"State sweep failed: {e!r}")
+            continue
+        if removed:
+            logging.info(f"🧹 Swept {removed} expired AI sessions")
+
+
+# Cooldowns and AI history for every chat this process handles
+chat_state = create_state_backend()
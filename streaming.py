@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from aiogram import types
+from metrics import AI_FIRST_TOKEN_SECONDS
+
+PLACEHOLDER_TEXT = "…"
+
+
+class StreamingReply:
+    """
+    A reply that grows while an AI completion streams in.
+
+    start() posts a placeholder; push() collects tokens and edits the message,
+    at most once per min_interval seconds (the first tokens are shown right
+    away); finish() writes the final text with Markdown, falling back to plain
+    text if Telegram rejects the markup. Intermediate edits are plain text
+    because half-streamed Markdown is often unbalanced.
+
+    push() runs inside the AI call and its deadline, so it never waits for an
+    edit: edits run in the background, one at a time, each with the text
+    collected so far (tokens pushed meanwhile go out with the next one), and
+    only finish() and cancel() wait for the one in flight.
+    """
+
+    def __init__(self, message: types.Message, min_interval: float = 1.5, outbound=None):
+        """
+        Args:
+            message: Message to reply to
+            min_interval: Minimum seconds between intermediate edits
+            outbound: Optional OutboundDispatcher for the reply and its edits
+        """
+        self.message = message
+        self.outbound = outbound
+        self.min_interval = min_interval
+        self.placeholder = None
+        self.first_token_latency = None
+        self._parts = []
+        self._shown = ""
+        self._started = None
+        self._last_edit = 0.0
+        self._editing = None
+
+    async def _reply(self, text: str, parse_mode: str = None):
+        if self.outbound is None:
+            return await self.message.reply(text, parse_mode=parse_mode)
+        return await self.outbound.send(
+            self.message.chat.id, lambda: self.message.reply(text, parse_mode=parse_mode)
+        )
+
+    async def start(self):
+        self._started = time.monotonic()
+        self.placeholder = await self._reply(PLACEHOLDER_TEXT)
+
+    async def _edit(self, text: str, parse_mode: str = None):
+        if self.outbound is None:
+            await self.placeholder.edit_text(text, parse_mode=parse_mode)
+        else:
+            await self.outbound.send(
+                self.message.chat.id, lambda: self.placeholder.edit_text(text, parse_mode=parse_mode)
+            )
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+    async def push(self, delta: str):
+        """Stream callback: add a chunk of tokens, starting an edit when the throttle allows."""
+        self._parts.append(delta)
+        if self.placeholder is None or self._editing is not None:
+            return
+        if self._shown and time.monotonic() - self._last_edit < self.min_interval:
+            return
+
+        text = "".join(self._parts)
+        if not text.strip() or text == self._shown:
+            return
+        self._editing = asyncio.create_task(self._edit_in_background(text))
+
+    async def _edit_in_background(self, text: str):
+        try:
+            await self._edit(text)
+        except Exception as e:
+            # Typically a flood-control error; the next push or finish() retries
+            logging.warning(f"Streaming edit failed: {e!r}")
+            self._last_edit = time.monotonic()
+            return
+        finally:
+            self._editing = None
+
+        if self.first_token_latency is None:
+            self.first_token_latency = time.monotonic() - self._started
+            AI_FIRST_TOKEN_SECONDS.observe(self.first_token_latency)
+            logging.info(f"⚡ First AI tokens visible after {self.first_token_latency:.2f}s in chat {self.message.chat.id}")
+
+    async def _settle(self):
+        """Wait for the intermediate edit in flight, if any (it handles its own errors)."""
+        if self._editing is not None:
+            await self._editing
+
+    async def finish(self, text: str):
+        """Show the final text."""
+        if self.placeholder is None:
+            await self._reply(text, parse_mode="Markdown")
+            return
+        await self._settle()
+        if text == self._shown and not any(char in text for char in "*_`["):
+            # Already on screen and Markdown would render it the same
+            return
+        try:
+            await self._edit(text, parse_mode="Markdown")
+        except Exception as e:
+            print(f"Final streaming edit with Markdown failed: {e}")
+            if text != self._shown:
+                await self._edit(text)
+
+    async def cancel(self):
+        """Remove the placeholder when no reply will be sent."""
+        if self.placeholder is not None:
+            await self._settle()
+            try:
+                await self.placeholder.delete()
+            except Exception as e:
+                print(f"Failed to delete streaming placeholder: {e}")
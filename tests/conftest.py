@@ -0,0 +1,10 @@
+import os
+import sys
+
+# config.py refuses to load without these; the tests never talk to Telegram or Supabase
+os.environ.setdefault("BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test")
+os.environ.setdefault("NANOGPT_API_KEY", "test-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,159 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import ai_client
+from ai_scheduler import AIScheduler, CircuitOpenError, RequestCoalesced
+
+
+class FakeOpenAI:
+    """Stand-in for AsyncOpenAI: client.chat.completions.create() with a delay and scripted failures."""
+
+    def __init__(self, delay: float = 0.0, fail: int = 0):
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, temperature, messages, stream=False):
+        self.calls.append(messages)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                self.fail -= 1
+                raise RuntimeError("upstream failed")
+            reply = f"reply to {messages[-1]['content']}"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+        finally:
+            self.running -= 1
+
+
+def request(client, text):
+    return lambda: client.chat.completions.create(model="m", temperature=0.5, messages=[{"role": "user", "content": text}])
+
+
+def content(completion):
+    return completion.choices[0].message.content
+
+
+def test_concurrency_is_capped():
+    client = FakeOpenAI(delay=0.02)
+    scheduler = AIScheduler(max_concurrency=3)
+
+    async def scenario():
+        return await asyncio.gather(*(scheduler.submit(None, request(client, str(n))) for n in range(10)))
+
+    results = asyncio.run(scenario())
+    assert [content(r) for r in results] == [f"reply to {n}" for n in range(10)]
+    assert client.max_running == 3
+    assert scheduler.stats()["completed"] == 10
+
+
+def test_newest_waiting_request_per_chat_wins():
+    client = FakeOpenAI(delay=0.02)
+    scheduler = AIScheduler(max_concurrency=4)
+
+    async def scenario():
+        first = asyncio.create_task(scheduler.submit(1, request(client, "first")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(scheduler.submit(1, request(client, "second")))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(scheduler.submit(1, request(client, "third")))
+        other = asyncio.create_task(scheduler.submit(2, request(client, "other chat")))
+        return await asyncio.gather(first, second, third, other, return_exceptions=True)
+
+    first, second, third, other = asyncio.run(scenario())
+    assert content(first) == "reply to first"
+    assert isinstance(second, RequestCoalesced)
+    assert content(third) == "reply to third"
+    assert content(other) == "reply to other chat"
+    assert [call[-1]["content"] for call in client.calls].count("second") == 0
+    assert scheduler.coalesced == 1
+
+
+def test_circuit_opens_after_consecutive_failures_and_recovers():
+    client = FakeOpenAI(fail=3)
+    scheduler = AIScheduler(failure_threshold=3, recovery_seconds=0.05)
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                await scheduler.submit(None, request(client, "x"))
+        assert scheduler.circuit_state == "open"
+        with pytest.raises(CircuitOpenError):
+            await scheduler.submit(None, request(client, "rejected"))
+        assert len(client.calls) == 3
+
+        await asyncio.sleep(0.06)
+        # The probe succeeds and closes the circuit
+        assert content(await scheduler.submit(None, request(client, "probe"))) == "reply to probe"
+        assert scheduler.circuit_state == "closed"
+
+    asyncio.run(scenario())
+    assert scheduler.rejected == 1
+
+
+def test_failed_probe_reopens_the_circuit():
+    client = FakeOpenAI(fail=2)
+    scheduler = AIScheduler(failure_threshold=1, recovery_seconds=0.05)
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await scheduler.submit(None, request(client, "x"))
+        await asyncio.sleep(0.06)
+        with pytest.raises(RuntimeError):
+            await scheduler.submit(None, request(client, "probe"))
+        assert scheduler.circuit_state == "open"
+
+    asyncio.run(scenario())
+
+
+def test_deadline_counts_as_failure():
+    client = FakeOpenAI(delay=1.0)
+    scheduler = AIScheduler(timeout=0.02, failure_threshold=1)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.submit(None, request(client, "slow"))
+
+    asyncio.run(scenario())
+    assert scheduler.timeouts == 1
+    assert scheduler.circuit_state == "open"
+
+
+def test_get_ai_response_with_fake_client(monkeypatch):
+    client = FakeOpenAI(delay=0.01)
+    monkeypatch.setattr(ai_client, "client", client)
+    monkeypatch.setattr(ai_client, "ai_scheduler", AIScheduler(failure_threshold=1, recovery_seconds=60))
+
+    async def scenario():
+        reply = await ai_client.get_ai_response("be brief", "hello", chat_id=42)
+        replaced, latest = await asyncio.gather(
+            ai_client.get_ai_response("be brief", "one", chat_id=7),
+            ai_client.get_ai_response("be brief", "two", chat_id=7),
+        )
+        return reply, replaced, latest
+
+    reply, first, second = asyncio.run(scenario())
+    assert reply == "reply to hello"
+    assert client.calls[0][0] == {"role": "system", "content": "be brief"}
+    assert (first, second) == ("reply to one", "reply to two")
+    ai_client.clear_chat_history(42)
+    ai_client.clear_chat_history(7)
+
+
+def test_get_ai_response_falls_back_on_errors(monkeypatch):
+    monkeypatch.setattr(ai_client, "client", FakeOpenAI(fail=5))
+    monkeypatch.setattr(ai_client, "ai_scheduler", AIScheduler(failure_threshold=1, recovery_seconds=60))
+
+    async def scenario():
+        failed = await ai_client.get_ai_response("p", "hi")
+        rejected = await ai_client.get_ai_response("p", "hi again")
+        return failed, rejected
+
+    assert asyncio.run(scenario()) == (ai_client.AI_FALLBACK_REPLY, ai_client.AI_FALLBACK_REPLY)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from app_config import AppConfig, ConfigSnapshot, parse_bool
+
+
+class CountingInt:
+    """int() that counts its calls, to tell parsed values from cached ones."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, value):
+        self.calls += 1
+        return int(value)
+
+
+class FakeFetch:
+    """The app_config table as get_app_config returns it; None while the DB is down."""
+
+    def __init__(self, values: dict = None):
+        self.values = values
+
+    async def __call__(self):
+        if self.values is None:
+            return None
+        return [{"key": key, "value": value} for key, value in self.values.items()]
+
+
+def test_values_are_parsed_by_the_schema_once():
+    to_int = CountingInt()
+    snapshot = ConfigSnapshot(
+        {"ai_max_tokens": "300", "summaries": "yes", "note": "free text"},
+        schema={"ai_max_tokens": (to_int, 100), "summaries": (parse_bool, False)},
+    )
+    assert snapshot.get("ai_max_tokens") == 300
+    assert snapshot.get("ai_max_tokens") == 300
+    assert to_int.calls == 1
+    assert snapshot.get("summaries") is True
+    # Keys outside the schema are returned as stored
+    assert snapshot.get("note") == "free text"
+
+
+def test_defaults_and_misses_are_cached():
+    to_int = CountingInt()
+    snapshot = ConfigSnapshot({}, schema={"ai_max_tokens": (to_int, 100)})
+    assert snapshot.get("ai_max_tokens") == 100
+    assert snapshot.get("ai_max_tokens", 5) == 100
+    # Neither in the table nor in the schema: the caller's default, whatever it is on each read
+    assert snapshot.get("unknown") is None
+    assert snapshot.get("unknown", 7) == 7
+    assert to_int.calls == 0
+    assert set(snapshot._typed) == {"ai_max_tokens", "unknown"}
+
+
+def test_invalid_values_fall_back_to_the_default_with_one_warning(caplog):
+    snapshot = ConfigSnapshot({"ai_max_tokens": "lots"}, schema={"ai_max_tokens": (int, 100)})
+    with caplog.at_level(logging.WARNING):
+        assert snapshot.get("ai_max_tokens") == 100
+        assert snapshot.get("ai_max_tokens") == 100
+    assert len([record for record in caplog.records if "ai_max_tokens" in record.getMessage()]) == 1
+
+
+def test_per_model_keys_parse_like_their_base_key_without_its_default():
+    snapshot = ConfigSnapshot(
+        {"ai_context_tokens:big-model": "8000", "ai_context_tokens:bad-model": "many"},
+        schema={"ai_context_tokens": (int, 2000)},
+    )
+    assert snapshot.get("ai_context_tokens:big-model") == 8000
+    # Absent or invalid: the caller decides (usually the base key's value)
+    assert snapshot.get("ai_context_tokens:other-model", "base") == "base"
+    assert snapshot.get("ai_context_tokens:bad-model", "base") == "base"
+    assert snapshot.get("ai_context_tokens") == 2000
+
+
+def test_reload_replaces_the_snapshot_and_a_failed_fetch_keeps_it():
+    fetch = FakeFetch({"ai_max_tokens": "300"})
+    config = AppConfig(fetch, {"ai_max_tokens": (int, 100)})
+    assert config.get("ai_max_tokens") == 100
+
+    assert asyncio.run(config.reload())
+    before = config.snapshot
+    assert config.get("ai_max_tokens") == 300
+
+    fetch.values = None
+    assert not asyncio.run(config.reload())
+    assert config.snapshot is before
+    assert config.stats()["version"] == 1
+    assert config.export() == {"ai_max_tokens": "300"}
+
+
+def test_restore_applies_only_until_the_table_is_loaded():
+    fetch = FakeFetch({"ai_max_tokens": "300"})
+    config = AppConfig(fetch, {"ai_max_tokens": (int, 100)})
+    config.restore({"ai_max_tokens": "200"})
+    assert config.get("ai_max_tokens") == 200
+
+    asyncio.run(config.reload())
+    config.restore({"ai_max_tokens": "200"})
+    assert config.get("ai_max_tokens") == 300
+    assert config.stats()["version"] == 2
@@ -0,0 +1,122 @@
+import asyncio
+
+import ai_client
+from ai_scheduler import AIScheduler
+from context import SummaryCache, build_messages
+from test_ai_scheduler import FakeOpenAI
+
+
+def turn(role, content):
+    return {"role": role, "content": content}
+
+
+class Summarizer:
+    """Records what it was asked to summarize; the summary lists every turn it has seen."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, previous, turns):
+        self.calls.append((previous, [t["content"] for t in turns]))
+        await asyncio.sleep(self.delay)
+        return ",".join(filter(None, [previous] + [t["content"] for t in turns]))
+
+
+def test_each_turn_is_summarized_once():
+    summarizer = Summarizer()
+
+    async def scenario():
+        cache = SummaryCache()
+        # Over the budget, still in the history
+        cache.add(1, [turn("user", "a"), turn("assistant", "b")], summarizer)
+        await asyncio.sleep(0.01)
+        cache.add(1, [turn("user", "a"), turn("assistant", "b"), turn("user", "c")], summarizer)
+        await asyncio.sleep(0.01)
+        # Off the ring: "a" is covered already, "z" never made it into a summary
+        cache.add(1, [turn("user", "a")], summarizer, in_history=False)
+        cache.add(1, [turn("user", "z")], summarizer, in_history=False)
+        await asyncio.sleep(0.01)
+        return cache.get(1), cache.stats()
+
+    summary, stats = asyncio.run(scenario())
+    assert summarizer.calls == [(None, ["a", "b"]), ("a,b", ["c"]), ("a,b,c", ["z"])]
+    assert summary == "a,b,c,z"
+    assert stats["summarized_turns"] == 4
+
+
+def test_turns_queued_during_a_summary_go_into_the_next_one():
+    summarizer = Summarizer(delay=0.02)
+
+    async def scenario():
+        cache = SummaryCache()
+        cache.add(1, [turn("user", "a")], summarizer, in_history=False)
+        await asyncio.sleep(0)
+        cache.add(1, [turn("user", "b")], summarizer, in_history=False)
+        cache.add(1, [turn("user", "c")], summarizer, in_history=False)
+        await asyncio.sleep(0.1)
+        return cache.get(1)
+
+    assert asyncio.run(scenario()) == "a,b,c"
+    assert summarizer.calls == [(None, ["a"]), ("a", ["b", "c"])]
+
+
+def test_summary_is_sent_even_when_the_history_fits():
+    messages, dropped = build_messages("p", [turn("user", "hi")], "next", 1000, summary="earlier")
+    assert [m["content"] for m in messages] == ["p", "Summary of the earlier conversation: earlier", "hi", "next"]
+    assert dropped == []
+
+
+def test_turns_falling_off_the_ring_are_summarized_on_their_own_scheduler(monkeypatch):
+    client = FakeOpenAI()
+    replies = AIScheduler()
+    summaries = AIScheduler(max_concurrency=1)
+    monkeypatch.setattr(ai_client, "client", client)
+    monkeypatch.setattr(ai_client, "ai_scheduler", replies)
+    monkeypatch.setattr(ai_client, "summary_scheduler", summaries)
+    monkeypatch.setattr(ai_client, "summaries_enabled", lambda: True)
+    chat_id = 991
+
+    async def scenario():
+        for n in range(1, 6):
+            await ai_client.get_ai_response("p", f"u{n}", chat_id=chat_id)
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        ai_client.clear_chat_history(chat_id)
+
+    summary_inputs = [call[-1]["content"] for call in client.calls if call[0]["content"] == ai_client.SUMMARY_PROMPT]
+    # Exchanges 3, 4 and 5 push u1, then a1 and u2, then a2 and u3 off the 5-message ring; nothing twice
+    assert len(summary_inputs) == 3
+    assert summary_inputs[0] == "user: u1"
+    assert summary_inputs[1].endswith("\nassistant: reply to u1\nuser: u2")
+    assert summary_inputs[2].endswith("\nassistant: reply to u2\nuser: u3")
+    assert summaries.completed == 3
+    assert replies.completed == 5
+    last_prompt = next(call for call in client.calls if call[-1]["content"] == "u5")
+    assert last_prompt[1]["content"].startswith("Summary of the earlier conversation: reply to Earlier summary")
+
+
+def test_cache_key_covers_only_the_context_sent(monkeypatch):
+    client = FakeOpenAI()
+    monkeypatch.setattr(ai_client, "client", client)
+    monkeypatch.setattr(ai_client, "ai_scheduler", AIScheduler())
+    monkeypatch.setattr(ai_client, "get_context_budget", lambda model: 40)
+    # Same recent turn; only chat 1 has an older one, too long for the budget
+    ai_client.add_to_history(1, "user", "x" * 400)
+    for chat_id in (1, 2):
+        ai_client.add_to_history(chat_id, "assistant", "ok")
+
+    async def scenario():
+        first = await ai_client.get_ai_response("p", "hi", chat_id=1, cache_ttl=60)
+        second = await ai_client.get_ai_response("p", "hi", chat_id=2, cache_ttl=60)
+        return first, second
+
+    try:
+        assert asyncio.run(scenario()) == ("reply to hi", "reply to hi")
+    finally:
+        ai_client.clear_chat_history(1)
+        ai_client.clear_chat_history(2)
+    assert len(client.calls) == 1
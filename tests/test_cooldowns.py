@@ -0,0 +1,75 @@
+from utils import CooldownManager
+
+
+def test_cooldown_blocks_until_it_has_passed():
+    manager = CooldownManager()
+    assert manager.can_trigger(1, 7, 30, timestamp=1000.0)
+    manager.mark_triggered(1, 7, timestamp=1000.0, cooldown_seconds=30)
+    assert not manager.can_trigger(1, 7, 30, timestamp=1029.0)
+    # Other triggers and chats are independent
+    assert manager.can_trigger(1, 8, 30, timestamp=1029.0)
+    assert manager.can_trigger(2, 7, 30, timestamp=1029.0)
+    assert manager.can_trigger(1, 7, 30, timestamp=1030.0)
+
+
+def test_entries_are_evicted_once_their_bucket_has_passed():
+    manager = CooldownManager(bucket_seconds=10, grace_seconds=5)
+    manager.mark_triggered(1, 7, timestamp=0.0, cooldown_seconds=30)
+    # Expires at 35, filed in the bucket [30, 40)
+    manager.can_trigger(2, 7, 30, timestamp=39.0)
+    assert len(manager) == 1
+    manager.can_trigger(2, 7, 30, timestamp=40.0)
+    assert len(manager) == 0
+    assert manager.stats() == {"entries": 0, "buckets": 0, "evicted": 1}
+
+
+def test_marking_again_moves_the_entry_to_a_later_bucket():
+    manager = CooldownManager(bucket_seconds=10, grace_seconds=0)
+    manager.mark_triggered(1, 7, timestamp=0.0, cooldown_seconds=30)
+    manager.mark_triggered(1, 7, timestamp=25.0, cooldown_seconds=30)
+    # The first bucket passes; its stale reference is skipped
+    manager.can_trigger(2, 7, 30, timestamp=45.0)
+    assert len(manager) == 1
+    assert manager.evicted == 0
+    manager.can_trigger(2, 7, 30, timestamp=60.0)
+    assert len(manager) == 0
+
+
+def test_grace_keeps_entries_for_messages_behind_the_clock():
+    manager = CooldownManager(bucket_seconds=10, grace_seconds=60)
+    manager.mark_triggered(1, 7, timestamp=100.0, cooldown_seconds=30)
+    # Another chat moves the clock past the cooldown
+    manager.can_trigger(2, 7, 30, timestamp=150.0)
+    # A message timestamped earlier arrives late: the entry is still there, and the clock stays put
+    assert not manager.can_trigger(1, 7, 30, timestamp=120.0)
+    assert manager._clock == 150.0
+    assert manager.can_trigger(1, 7, 30, timestamp=131.0)
+
+
+def test_mark_without_a_cooldown_keeps_the_entry_for_the_longest_cooldown_seen():
+    manager = CooldownManager(bucket_seconds=10, grace_seconds=10)
+    manager.can_trigger(1, 7, 300, timestamp=0.0)
+    manager.mark_triggered(1, 7, timestamp=0.0)
+    # With only the grace period it would have been evicted long before
+    assert not manager.can_trigger(1, 7, 300, timestamp=250.0)
+    assert len(manager) == 1
+    manager.can_trigger(2, 7, 300, timestamp=330.0)
+    assert len(manager) == 0
+
+
+def test_restore_loads_exported_entries_with_their_expiry():
+    source = CooldownManager(bucket_seconds=10, grace_seconds=0)
+    source.mark_triggered(1, 7, timestamp=0.0, cooldown_seconds=30)
+    source.mark_triggered(2, 7, timestamp=0.0, cooldown_seconds=100)
+
+    manager = CooldownManager(bucket_seconds=10, grace_seconds=0)
+    manager.mark_triggered(3, 7, timestamp=0.0, cooldown_seconds=100)
+    manager.mark_triggered(2, 7, timestamp=-50.0, cooldown_seconds=100)
+    manager.restore(source.export())
+    # Chat 3 is kept; chat 2 is overwritten by the exported entry
+    assert len(manager) == 3
+    assert not manager.can_trigger(1, 7, 30, timestamp=20.0)
+    assert not manager.can_trigger(2, 7, 100, timestamp=60.0)
+    manager.can_trigger(4, 7, 30, timestamp=45.0)
+    assert len(manager) == 2
+    assert sorted(entry[:2] for entry in manager.export()) == [[2, 7], [3, 7]]
@@ -0,0 +1,105 @@
+"""
+The batched rapidfuzz matcher returns what the original thefuzz loop returned,
+plus the matches of the folded forms (look-alike letters, ё) on top.
+"""
+import random
+
+import pytest
+
+from normalize import fold_text, normalize_keyword
+from trigger_index import TriggerIndex
+from utils import check_message_for_triggers
+
+thefuzz = pytest.importorskip("thefuzz.fuzz")
+
+KEYWORD_SYLLABLES = (
+    ["при", "вет", "дос", "тав", "ка", "цен", "ник", "ёж", "всё"],
+    ["pri", "ce", "or", "der", "li", "ve", "ry", "shop", "ok", "pc", "coca", "cop"],
+)
+# Message filler shares a few syllables with keywords, so near misses get scored too
+FILLER_SYLLABLES = (["сл", "ов", "ну", "же", "ка", "ро", "ещё"], ["wh", "at", "ju", "st", "ce", "ink", "xo"])
+CHATS = [-1001, -1002, -1003]
+
+
+def reference_match(message_text, triggers_data, chat_id=None):
+    """
+    check_message_for_triggers as it was with thefuzz (plus per-trigger thresholds),
+    run on the text as is and on its folded form: a trigger matches in either.
+    """
+    if not message_text:
+        return None
+    forms = [(message_text.lower(), str.lower), (fold_text(message_text.casefold()), normalize_keyword)]
+
+    def matches_keywords(trigger_obj):
+        threshold = trigger_obj.get("fuzzy_threshold") or 85
+        for text, keyword_form in forms:
+            for keyword in trigger_obj.get("triggers", []):
+                keyword = keyword_form(keyword)
+                if keyword in text:
+                    return True
+                for word in text.split():
+                    if thefuzz.ratio(keyword, word) >= threshold:
+                        return True
+        return False
+
+    chat_specific = [t for t in triggers_data if t.get("chat_id") is not None and t["chat_id"] == chat_id]
+    global_triggers = [t for t in triggers_data if t.get("chat_id") is None]
+    for trigger_obj in chat_specific + global_triggers:
+        if matches_keywords(trigger_obj):
+            return trigger_obj
+    return None
+
+
+def make_word(rng, cyrillic, filler=False):
+    # Mostly one script per word; some mix both, so look-alike folding applies (or must not)
+    syllables = FILLER_SYLLABLES if filler else KEYWORD_SYLLABLES
+    mixed = rng.random() < 0.25
+    return "".join(
+        rng.choice(syllables[rng.randrange(2) if mixed else (0 if cyrillic else 1)])
+        for _ in range(rng.randint(2, 4))
+    )
+
+
+def make_triggers(rng, count):
+    triggers = []
+    for trigger_id in range(1, count + 1):
+        cyrillic = rng.random() < 0.5
+        keywords = [
+            " ".join(make_word(rng, cyrillic) for _ in range(rng.choice([1, 1, 1, 2])))
+            for _ in range(rng.randint(1, 3))
+        ]
+        row = {"id": trigger_id, "triggers": keywords, "chat_id": rng.choice(CHATS + [None, None])}
+        if rng.random() < 0.2:
+            row["fuzzy_threshold"] = rng.choice([60, 75, 90, 100])
+        triggers.append(row)
+    return triggers
+
+
+def make_message(rng, triggers):
+    words = [make_word(rng, rng.random() < 0.5, filler=True) for _ in range(rng.randint(1, 8))]
+    if rng.random() < 0.2:
+        # A keyword glued to a word of the other script, or behind punctuation
+        keyword = rng.choice(rng.choice(triggers)["triggers"]).split()[0]
+        words.append(rng.choice(["", "-", ","]).join(rng.sample([keyword, make_word(rng, rng.random() < 0.5)], 2)))
+    if rng.random() < 0.6:
+        keyword = rng.choice(rng.choice(triggers)["triggers"])
+        if len(keyword) > 3 and rng.random() < 0.5:
+            position = rng.randrange(len(keyword))
+            keyword = keyword[:position] + keyword[position + 1:]
+        words.insert(rng.randrange(len(words) + 1), keyword.upper() if rng.random() < 0.2 else keyword)
+    return " ".join(words)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_same_matches_as_thefuzz(seed):
+    rng = random.Random(seed)
+    triggers = make_triggers(rng, rng.choice([5, 30, 120]))
+    index = TriggerIndex(triggers)
+    for _ in range(400):
+        text = make_message(rng, triggers)
+        chat_id = rng.choice(CHATS + [None])
+        expected = reference_match(text, triggers, chat_id)
+        found = check_message_for_triggers(text, index, chat_id=chat_id)
+        assert (found and found["id"]) == (expected and expected["id"]), text
+        # The pre-filter never rules out a message that matches
+        assert expected is None or index.may_match(text, chat_id), text
@@ -0,0 +1,87 @@
+import history_store
+from history_store import ChatHistoryStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def contents(store, chat_id):
+    return [message["content"] for message in store.get(chat_id)]
+
+
+def test_least_recently_used_chat_is_evicted(monkeypatch):
+    monkeypatch.setattr(history_store.time, "time", Clock())
+    store = ChatHistoryStore(max_chats=2)
+    store.add(1, "user", "a")
+    store.add(2, "user", "b")
+    # Reading chat 1 makes chat 2 the least recently used
+    assert contents(store, 1) == ["a"]
+    store.add(3, "user", "c")
+    assert contents(store, 2) == []
+    assert contents(store, 1) == ["a"]
+    assert contents(store, 3) == ["c"]
+    assert store.stats()["evicted"] == 1
+
+
+def test_each_chat_keeps_its_latest_messages(monkeypatch):
+    monkeypatch.setattr(history_store.time, "time", Clock())
+    store = ChatHistoryStore(max_messages=3)
+    for n in range(5):
+        store.add(1, "user", str(n))
+    assert contents(store, 1) == ["2", "3", "4"]
+    assert store.stats()["messages"] == 3
+
+
+def test_a_session_expires_from_its_start(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history_store.time, "time", clock)
+    store = ChatHistoryStore(expiration_seconds=100)
+    store.add(1, "user", "a")
+    clock.now += 60
+    store.add(1, "assistant", "b")
+    # Timed from the first message, not the last
+    clock.now += 60
+    assert contents(store, 1) == []
+    assert len(store) == 0
+    store.add(1, "user", "c")
+    assert contents(store, 1) == ["c"]
+    assert store.stats()["expired"] == 1
+
+
+def test_sweep_drops_only_expired_sessions(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history_store.time, "time", clock)
+    store = ChatHistoryStore(expiration_seconds=100)
+    store.add(1, "user", "old")
+    clock.now += 50
+    store.add(2, "user", "new")
+    assert store.sweep(now=clock.now + 60) == 1
+    assert store.sweep(now=clock.now + 60) == 0
+    assert contents(store, 2) == ["new"]
+    assert store.stats()["expired"] == 1
+
+
+def test_restore_loads_live_sessions_within_the_limits(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history_store.time, "time", clock)
+    source = ChatHistoryStore(expiration_seconds=100)
+    source.add(1, "user", "stale")
+    clock.now += 50
+    for chat_id in (2, 3, 4):
+        source.add(chat_id, "user", str(chat_id))
+    items = source.export() + [[5, clock.now, []]]
+
+    clock.now += 60
+    store = ChatHistoryStore(max_chats=2, max_messages=5, expiration_seconds=100)
+    store.restore(items)
+    # Chat 1 has expired and chat 5 is empty; of the rest, the most recently used fit
+    assert [chat_id for chat_id, _, _ in store.export()] == [3, 4]
+    assert contents(store, 4) == ["4"]
+    # Sessions keep their original start time
+    clock.now += 50
+    assert contents(store, 3) == []
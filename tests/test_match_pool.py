@@ -0,0 +1,98 @@
+import asyncio
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import match_pool
+from match_pool import MatchPool
+from trigger_index import TriggerIndex
+
+
+def trigger(trigger_id, keywords, chat_id=None):
+    return {"id": trigger_id, "triggers": keywords, "response": "ok", "chat_id": chat_id}
+
+
+TRIGGERS = [trigger(1, ["delivery"]), trigger(2, ["refund"], chat_id=-5)]
+
+
+class BrokenExecutor:
+    """Fails every request the way a pool with a dead worker does."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def pool():
+    # Worker code runs in a thread of this process: same functions, no spawn
+    pool = MatchPool(workers=1, min_triggers=2)
+    pool._executor = ThreadPoolExecutor(1)
+    yield pool
+    pool.close()
+    match_pool._worker_indexes.clear()
+
+
+def match(pool, text, chat_id=None):
+    return asyncio.run(pool.match(text, chat_id=chat_id))
+
+
+def test_large_sets_are_matched_by_the_workers(pool):
+    pool.load(TriggerIndex(TRIGGERS))
+    assert match(pool, "where is my delivary")["id"] == 1
+    assert match(pool, "i want a refund", chat_id=-5)["id"] == 2
+    assert match(pool, "i want a refund", chat_id=-6) is None
+    # The row comes from this process, not from the worker
+    assert match(pool, "delivery") is pool._by_id[1]
+    assert pool.stats()["offloaded"] == 4
+    assert pool.inline == 0
+
+
+def test_small_sets_are_matched_inline(pool):
+    pool.load(TriggerIndex(TRIGGERS[:1]))
+    assert match(pool, "delivery")["id"] == 1
+    assert pool.stats() == {"offloading": False, "generation": 0, "offloaded": 0, "inline": 1, "failures": 0}
+
+
+def test_each_reload_is_a_new_generation_and_old_snapshots_are_removed(pool):
+    pool.load(TriggerIndex(TRIGGERS))
+    first = pool._snapshot_path
+    pool.load(TriggerIndex(TRIGGERS + [trigger(3, ["invoice"])]))
+    second = pool._snapshot_path
+    # The previous snapshot stays for requests sent before the reload
+    assert os.path.exists(first)
+    assert match(pool, "invoice")["id"] == 3
+    pool.load(TriggerIndex(TRIGGERS))
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert pool.stats()["generation"] == 3
+    assert match(pool, "invoice") is None
+    # Workers keep the current generation and the one before it
+    assert sorted(match_pool._worker_indexes) == [2, 3]
+
+
+def test_a_failed_request_is_matched_inline(pool):
+    pool.load(TriggerIndex(TRIGGERS))
+    # After the warm-up load() queued, the snapshot is gone
+    pool._executor.submit(int).result()
+    os.remove(pool._snapshot_path)
+    match_pool._worker_indexes.clear()
+    assert match(pool, "delivery")["id"] == 1
+    assert pool.failures == 1
+    # Only that message: the pool is still used
+    assert pool.stats()["offloading"]
+
+
+def test_a_broken_pool_switches_to_inline_matching(pool):
+    pool.load(TriggerIndex(TRIGGERS))
+    pool._executor.shutdown()
+    pool._executor = BrokenExecutor()
+    assert match(pool, "delivery")["id"] == 1
+    assert match(pool, "delivery")["id"] == 1
+    assert pool.stats() == {"offloading": False, "generation": 1, "offloaded": 0, "inline": 1, "failures": 1}
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from outbound import OutboundDispatcher, PRIORITY_NOTIFY, PRIORITY_REPLY, TokenBucket
+
+
+class FakeBot:
+    """Records when each send_message call ran; can be slowed down or made to hit flood control."""
+
+    def __init__(self, delay: float = 0.0, flood: int = 0, retry_after: float = 0.05):
+        self.delay = delay
+        self.flood = flood
+        self.retry_after = retry_after
+        self.sent = []
+        self.attempts = 0
+
+    async def send_message(self, chat_id, text):
+        self.attempts += 1
+        if self.flood:
+            self.flood -= 1
+            error = TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Too Many Requests", 1)
+            error.retry_after = self.retry_after
+            raise error
+        await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, text, asyncio.get_running_loop().time()))
+        return text
+
+
+def send(dispatcher, bot, chat_id, text, priority=PRIORITY_REPLY):
+    return dispatcher.submit(chat_id, lambda: bot.send_message(chat_id, text), priority)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2.0, capacity=2.0, now=0.0)
+    bucket.consume()
+    bucket.consume()
+    assert bucket.wait_time(0.0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.5) == 0.0
+    assert not bucket.is_full(0.5)
+    assert bucket.is_full(10.0)
+
+
+def test_sends_to_a_chat_keep_order_and_rate():
+    bot = FakeBot()
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(chat_rate=20.0, chat_burst=1.0)
+        futures = [send(dispatcher, bot, 5, str(n)) for n in range(4)]
+        results = await asyncio.gather(*futures)
+        await dispatcher.close()
+        return results, dispatcher.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == ["0", "1", "2", "3"]
+    assert [text for _, text, _ in bot.sent] == ["0", "1", "2", "3"]
+    times = [at for _, _, at in bot.sent]
+    # One token every 50 ms after the first
+    assert times[-1] - times[0] >= 0.14
+    assert stats["sent"] == 4 and stats["failed"] == 0
+
+
+def test_group_chats_get_the_lower_rate():
+    dispatcher = OutboundDispatcher(chat_rate=1.0, group_rate=0.25)
+    assert dispatcher._chat_bucket(-100, 0.0).rate == 0.25
+    assert dispatcher._chat_bucket(100, 0.0).rate == 1.0
+
+
+def test_replies_go_before_notifications():
+    bot = FakeBot()
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        notify = send(dispatcher, bot, 1, "notify", PRIORITY_NOTIFY)
+        reply = send(dispatcher, bot, 2, "reply", PRIORITY_REPLY)
+        await asyncio.gather(notify, reply)
+        await dispatcher.close()
+
+    asyncio.run(scenario())
+    assert [text for _, text, _ in bot.sent] == ["reply", "notify"]
+
+
+def test_retry_after_pauses_the_chat_and_retries():
+    bot = FakeBot(flood=2)
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(chat_burst=5.0)
+        result = await send(dispatcher, bot, 3, "hi")
+        await dispatcher.close()
+        return result, dispatcher.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == "hi"
+    assert bot.attempts == 3
+    assert stats["retries"] == 2 and stats["sent"] == 1
+
+
+def test_retry_after_gives_up_after_max_retries():
+    bot = FakeBot(flood=10)
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(chat_burst=5.0, max_retries=1)
+        with pytest.raises(TelegramRetryAfter):
+            await send(dispatcher, bot, 3, "hi")
+        await dispatcher.close()
+        return dispatcher.stats()
+
+    stats = asyncio.run(scenario())
+    assert bot.attempts == 2
+    assert stats["failed"] == 1
+
+
+def test_close_waits_for_sends_in_flight():
+    bot = FakeBot(delay=0.2)
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        future = send(dispatcher, bot, 1, "slow")
+        await asyncio.sleep(0.01)
+        await dispatcher.close(timeout=2.0)
+        return future
+
+    future = asyncio.run(scenario())
+    assert future.result() == "slow"
+    assert [text for _, text, _ in bot.sent] == ["slow"]
+
+
+def test_close_cancels_sends_past_the_timeout():
+    bot = FakeBot(delay=5.0)
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        future = send(dispatcher, bot, 1, "stuck")
+        await asyncio.sleep(0.01)
+        await dispatcher.close(timeout=0.1)
+        return future, dispatcher
+
+    future, dispatcher = asyncio.run(scenario())
+    assert future.cancelled()
+    assert bot.sent == []
+    assert not dispatcher._deliveries
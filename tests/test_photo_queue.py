@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from photo_queue import PhotoWriteQueue
+
+
+class FakeInsert:
+    """
+    Records inserted batches. Fails while down (and goes down after down_after
+    batches), and always for rows marked bad, like a constraint error.
+    """
+
+    def __init__(self, down: bool = False):
+        self.down = down
+        self.down_after = None
+        self.batches = []
+
+    async def __call__(self, rows):
+        if self.down_after is not None and len(self.batches) >= self.down_after:
+            self.down = True
+        if self.down or any(row.get("bad") for row in rows):
+            return None
+        self.batches.append([row["file_unique_id"] for row in rows])
+        return rows
+
+
+def row(file_id, **extra):
+    return {"file_unique_id": file_id, **extra}
+
+
+def spilled(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["file_unique_id"] for line in f]
+
+
+@pytest.fixture
+def spill_path(tmp_path):
+    return str(tmp_path / "photos.spill.jsonl")
+
+
+def test_flushes_when_the_batch_is_full_and_deduplicates_it(spill_path):
+    insert = FakeInsert()
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, max_batch=3, flush_interval=60, spill_path=spill_path)
+        queue.start()
+        for file_id in ("a", "b", "a", "c"):
+            await queue.put(row(file_id))
+        await asyncio.sleep(0.05)
+        # "a", "b", "a" filled the batch long before the interval; "c" still waits
+        assert insert.batches == [["a", "b"]]
+        await queue.close()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert insert.batches == [["a", "b"], ["c"]]
+    assert stats["duplicates"] == 1
+    assert stats["flushed"] == 3
+
+
+def test_flushes_after_the_interval(spill_path):
+    insert = FakeInsert()
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, max_batch=50, flush_interval=0.05, spill_path=spill_path)
+        queue.start()
+        await queue.put(row("a"))
+        await asyncio.sleep(0.01)
+        assert insert.batches == []
+        await asyncio.sleep(0.15)
+        assert insert.batches == [["a"]]
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_put_waits_while_the_queue_is_full(spill_path):
+    insert = FakeInsert()
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, max_batch=10, flush_interval=0.01, max_pending=2, spill_path=spill_path)
+        await queue.put(row("a"))
+        await queue.put(row("b"))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.put(row("c")), 0.05)
+        # Once the writer drains the queue, put() goes through
+        queue.start()
+        await asyncio.wait_for(queue.put(row("c")), 1)
+        await queue.close()
+
+    asyncio.run(scenario())
+    assert [file_id for batch in insert.batches for file_id in batch] == ["a", "b", "c"]
+
+
+def test_failed_batches_are_spilled_and_replayed_after_the_next_flush(spill_path):
+    insert = FakeInsert(down=True)
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, max_batch=2, spill_path=spill_path)
+        await queue._flush([row("a"), row("b")])
+        await queue._flush([row("c")])
+        assert spilled(spill_path) == ["a", "b", "c"]
+        insert.down = False
+        await queue._flush([row("d")])
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert insert.batches == [["d"], ["a", "b"], ["c"]]
+    assert not os.path.exists(spill_path)
+    assert stats["spilled"] == 3
+    assert stats["flushed"] == 4
+
+
+def test_a_spill_left_by_a_previous_run_is_replayed(spill_path):
+    with open(spill_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(row("old")) + "\n")
+    insert = FakeInsert()
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, spill_path=spill_path)
+        await queue._flush([row("new")])
+
+    asyncio.run(scenario())
+    assert insert.batches == [["new"], ["old"]]
+    assert not os.path.exists(spill_path)
+
+
+def test_a_replay_that_fails_midway_keeps_only_the_unwritten_rows(spill_path):
+    insert = FakeInsert(down=True)
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, max_batch=2, spill_path=spill_path)
+        await queue._flush([row("a"), row("b")])
+        await queue._flush([row("c"), row("d")])
+        # "e" goes in, then the first spilled batch, then the DB goes down again
+        insert.down = False
+        insert.down_after = 2
+        await queue._flush([row("e")])
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert insert.batches == [["e"], ["a", "b"]]
+    assert spilled(spill_path) == ["c", "d"]
+    assert stats["flushed"] == 3
+
+
+def test_a_batch_the_db_keeps_rejecting_is_set_aside(spill_path):
+    insert = FakeInsert()
+
+    async def scenario():
+        queue = PhotoWriteQueue(insert, max_batch=1, spill_path=spill_path, max_replays=2)
+        await queue._flush([row("bad", bad=True)])
+        insert.down = True
+        await queue._flush([row("x")])
+        insert.down = False
+        # Replayed after each successful flush: rejected twice, then moved out of the way
+        await queue._flush([row("a")])
+        assert spilled(spill_path) == ["bad", "x"]
+        await queue._flush([row("b")])
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert insert.batches == [["a"], ["b"], ["x"]]
+    assert spilled(spill_path + ".rejected") == ["bad"]
+    assert not os.path.exists(spill_path)
+    assert stats["rejected"] == 1
+    assert stats["flushed"] == 3
+
+
+def test_close_flushes_everything_queued(spill_path):
+    insert = FakeInsert()
+
+    async def scenario(started: bool):
+        queue = PhotoWriteQueue(insert, max_batch=2, flush_interval=60, spill_path=spill_path)
+        if started:
+            queue.start()
+        for file_id in "abcde":
+            await queue.put(row(file_id + str(started)))
+        await queue.close()
+        return queue.stats()
+
+    for started in (True, False):
+        insert.batches.clear()
+        stats = asyncio.run(scenario(started))
+        assert [file_id for batch in insert.batches for file_id in batch] == [c + str(started) for c in "abcde"]
+        assert stats["pending"] == 0
+        assert stats["flushed"] == 5
@@ -0,0 +1,92 @@
+import asyncio
+
+from pipeline import ChatPipeline, PRIORITY_HIGH, PRIORITY_LOW
+
+
+def test_jobs_of_a_chat_run_in_order_one_at_a_time():
+    log = []
+
+    def job(name, delay):
+        async def run():
+            log.append(f"start {name}")
+            await asyncio.sleep(delay)
+            log.append(f"end {name}")
+            return name
+        return run
+
+    async def scenario():
+        pipeline = ChatPipeline()
+        results = await asyncio.gather(
+            pipeline.submit(1, job("a", 0.02)),
+            pipeline.submit(1, job("b", 0)),
+        )
+        await pipeline.close()
+        return results
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert log == ["start a", "end a", "start b", "end b"]
+
+
+def test_detached_work_does_not_hold_up_the_chat():
+    log = []
+
+    async def slow_reply():
+        await asyncio.sleep(0.05)
+        log.append("reply")
+
+    async def scenario():
+        pipeline = ChatPipeline()
+
+        async def first():
+            log.append("match 1")
+            pipeline.detach(slow_reply())
+
+        async def second():
+            log.append("match 2")
+
+        await pipeline.submit(1, first)
+        await pipeline.submit(1, second)
+        # close() waits for the detached reply
+        await pipeline.close()
+
+    asyncio.run(scenario())
+    assert log == ["match 1", "match 2", "reply"]
+
+
+def test_close_cancels_detached_work_past_the_timeout():
+    async def scenario():
+        pipeline = ChatPipeline()
+        task = pipeline.detach(asyncio.sleep(5))
+        await pipeline.close(timeout=0.05)
+        return task
+
+    assert asyncio.run(scenario()).cancelled()
+
+
+def test_full_queue_sheds_low_priority_messages_first():
+    async def scenario():
+        pipeline = ChatPipeline(max_queue=2, shed_watermark=1.0)
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+            return "running"
+
+        def done(name):
+            async def run():
+                return name
+            return run
+
+        running = pipeline.submit(1, blocked)
+        await asyncio.sleep(0)
+        low = pipeline.submit(1, done("low"), PRIORITY_LOW)
+        high = pipeline.submit(1, done("high"), PRIORITY_HIGH)
+        newest = pipeline.submit(1, done("newest"), PRIORITY_HIGH)
+        gate.set()
+        results = await asyncio.gather(running, low, high, newest)
+        await pipeline.close()
+        return results, pipeline.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == ["running", None, "high", "newest"]
+    assert stats["dropped"] == 1
@@ -0,0 +1,94 @@
+import asyncio
+
+import ai_client
+import response_cache
+from ai_scheduler import AIScheduler
+from response_cache import AIResponseCache
+from test_ai_scheduler import FakeOpenAI
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    cache = AIResponseCache()
+    cache.put("a", "short", ttl=10)
+    cache.put("b", "long", ttl=60)
+    clock.now += 30
+    assert cache.get("a") is None
+    assert cache.get("b") == "long"
+    # The expired entry is dropped on lookup, with its bytes
+    assert len(cache) == 1
+    assert cache.bytes == len("b") + len("long")
+    cache.put("c", "never", ttl=0)
+    assert cache.get("c") is None
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = AIResponseCache(max_entries=2)
+    cache.put("a", "1", ttl=60)
+    cache.put("b", "2", ttl=60)
+    assert cache.get("a") == "1"
+    cache.put("c", "3", ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_total_size_stays_within_max_bytes():
+    cache = AIResponseCache(max_bytes=20)
+    cache.put("a", "x" * 9, ttl=60)
+    cache.put("b", "y" * 9, ttl=60)
+    assert cache.bytes == 20
+    # Sizes count encoded bytes: "ё" is two
+    cache.put("c", "ё" * 2, ttl=60)
+    assert cache.get("a") is None
+    assert cache.bytes == 15
+    # Larger than the whole budget: not cached, nothing evicted for it
+    cache.put("d", "z" * 20, ttl=60)
+    assert cache.get("d") is None
+    assert len(cache) == 2
+    # Replacing an entry releases the old value's bytes
+    cache.put("b", "y", ttl=60)
+    assert cache.bytes == 7
+
+
+def test_hits_and_misses_are_counted():
+    cache = AIResponseCache()
+    cache.put("a", "1", ttl=60)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {"entries": 1, "bytes": 2, "hits": 2, "misses": 1, "evictions": 0}
+
+
+def test_a_cached_reply_is_recorded_in_the_chat_history(monkeypatch):
+    client = FakeOpenAI()
+    monkeypatch.setattr(ai_client, "client", client)
+    monkeypatch.setattr(ai_client, "ai_scheduler", AIScheduler())
+    monkeypatch.setattr(ai_client, "_response_cache", AIResponseCache())
+    monkeypatch.setattr(ai_client, "summaries_enabled", lambda: False)
+    chat_id = 992
+
+    async def scenario():
+        # Both requests send the same (empty) context, so the second one is a hit
+        first = await ai_client.get_ai_response("p", "hi", cache_ttl=60)
+        second = await ai_client.get_ai_response("p", "hi", chat_id=chat_id, cache_ttl=60)
+        return first, second
+
+    try:
+        assert asyncio.run(scenario()) == ("reply to hi", "reply to hi")
+        history = ai_client.get_chat_history(chat_id)
+    finally:
+        ai_client.clear_chat_history(chat_id)
+    assert len(client.calls) == 1
+    assert [(m["role"], m["content"]) for m in history] == [("user", "hi"), ("assistant", "reply to hi")]
+    assert ai_client.get_cache_stats()["hits"] == 1
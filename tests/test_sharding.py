@@ -0,0 +1,79 @@
+import asyncio
+import json
+import queue
+from types import SimpleNamespace
+
+from sharding import ShardRouter, serve_shard, shard_for
+
+
+class FakeUpdate:
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+
+    def model_dump_json(self, exclude_unset=False):
+        return json.dumps({"update_id": self.update_id})
+
+
+class FakeDispatcher:
+    """Records the updates fed to it; update 13 fails, and feeds can be slowed down."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.workflow_data = {}
+        self.events = []
+        self.active = 0
+        self.max_active = 0
+
+    async def emit_startup(self, **kwargs):
+        self.events.append("startup")
+
+    async def emit_shutdown(self, **kwargs):
+        self.events.append("shutdown")
+
+    async def feed_update(self, bot, update, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if update.update_id == 13:
+                raise RuntimeError("handler failed")
+            self.events.append(update.update_id)
+        finally:
+            self.active -= 1
+
+
+def test_router_sends_every_update_of_a_chat_to_one_worker():
+    queues = [queue.Queue() for _ in range(3)]
+    router = ShardRouter(queues)
+
+    async def route(update_id, chat=None, user=None):
+        data = {"event_chat": chat and SimpleNamespace(id=chat), "event_from_user": user and SimpleNamespace(id=user)}
+        return await router(None, FakeUpdate(update_id), data)
+
+    async def scenario():
+        assert await route(1, chat=-100) is None
+        await route(2, chat=-100)
+        # Without a chat, the sender decides; without either, worker 0
+        await route(3, user=7)
+        await route(4)
+
+    asyncio.run(scenario())
+    contents = [[json.loads(raw)["update_id"] for raw in q.queue] for q in queues]
+    assert contents[shard_for(-100, 3)][:2] == [1, 2]
+    assert 3 in contents[shard_for(7, 3)]
+    assert 4 in contents[0]
+    assert router.routed == [len(ids) for ids in contents]
+
+
+def test_serve_shard_feeds_updates_until_the_sentinel():
+    updates = queue.Queue()
+    for update_id in (11, 12, 13, 14):
+        updates.put(json.dumps({"update_id": update_id}))
+    updates.put(None)
+    dp = FakeDispatcher(delay=0.01)
+
+    asyncio.run(serve_shard(updates, dp, bot=None, concurrency=2))
+    # A failing update does not stop the others; shutdown waits for those in flight
+    assert dp.events[0] == "startup" and dp.events[-1] == "shutdown"
+    assert sorted(dp.events[1:-1]) == [11, 12, 14]
+    assert dp.max_active == 2
@@ -0,0 +1,102 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import state_backend
+from state_backend import SQLiteStateBackend, run_sweeper
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.sqlite3")
+
+
+@pytest.fixture
+def backend(db_path):
+    backend = SQLiteStateBackend(db_path, max_messages=3, expiration_seconds=100, grace_seconds=10)
+    yield backend
+    backend.close()
+
+
+def test_claim_fires_once_per_cooldown_across_processes(backend, db_path):
+    other = SQLiteStateBackend(db_path, grace_seconds=10)
+    try:
+        assert backend.claim_cooldown(1, 7, 30, timestamp=1000.0)
+        # Another process sees the claim
+        assert not other.claim_cooldown(1, 7, 30, timestamp=1010.0)
+        assert not backend.claim_cooldown(1, 7, 30, timestamp=1029.0)
+        assert other.claim_cooldown(1, 8, 30, timestamp=1010.0)
+        assert other.claim_cooldown(1, 7, 30, timestamp=1030.0)
+        assert not backend.claim_cooldown(1, 7, 30, timestamp=1040.0)
+    finally:
+        other.close()
+    assert backend.stats()["cooldowns"] == {"entries": 2}
+
+
+def test_history_keeps_the_last_messages_of_the_session(backend, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_backend.time, "time", lambda: now[0])
+    for n in range(5):
+        backend.add_history(1, "user", f"m{n}")
+    backend.add_history(2, "user", "other chat")
+    assert [turn["content"] for turn in backend.get_history(1)] == ["m2", "m3", "m4"]
+
+    # The session expires 100 s after its first message; the next one starts afresh
+    now[0] = 1101.0
+    backend.add_history(1, "user", "new")
+    assert backend.get_history(1) == [{"role": "user", "content": "new"}]
+    assert backend.get_history(2) == []
+
+
+def test_sweep_removes_expired_sessions_and_cooldowns_in_chunks(backend, monkeypatch):
+    monkeypatch.setattr(state_backend, "SWEEP_CHUNK", 2)
+    now = time.time()
+    with backend._transaction():
+        backend._conn.executemany(
+            "INSERT INTO chat_history (chat_id, session_start, role, content) VALUES (?, ?, 'user', 'x')",
+            [(chat_id, now - 500) for chat_id in (1, 1, 1, 2, 2)] + [(3, now)]
+        )
+        backend._conn.executemany(
+            "INSERT INTO cooldowns VALUES (?, 7, ?, ?)",
+            [(chat_id, now - 500, now - 400) for chat_id in range(5)] + [(9, now, now + 60)]
+        )
+    assert backend.sweep() == 2
+    assert backend.stats() == {"cooldowns": {"entries": 1}, "history": {"chats": 1, "messages": 1}}
+
+
+def test_writes_give_up_quickly_while_another_process_holds_the_lock(backend, db_path):
+    blocker = sqlite3.connect(db_path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.perf_counter()
+        assert not backend.claim_cooldown(1, 7, 30, timestamp=1000.0)
+        backend.add_history(1, "user", "lost")
+        assert time.perf_counter() - started < 1.0
+        # Reads do not wait for writers
+        assert backend.get_history(1) == []
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert backend.claim_cooldown(1, 7, 30, timestamp=1000.0)
+
+
+def test_sweeper_runs_the_sqlite_sweep_off_the_loop(backend):
+    threads = []
+
+    def sweep():
+        threads.append(threading.current_thread())
+        return 0
+
+    backend.sweep = sweep
+
+    async def scenario():
+        task = asyncio.create_task(run_sweeper(backend, interval=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert threads
+    assert threading.main_thread() not in threads
@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+from metrics import AI_FIRST_TOKEN_SECONDS
+from outbound import OutboundDispatcher
+from streaming import StreamingReply
+
+
+class FakeSent:
+    """A sent message that records its edits."""
+
+    def __init__(self, log: list, text: str):
+        self.log = log
+        self.text = text
+
+    async def edit_text(self, text, parse_mode=None):
+        self.log.append(("edit", text, parse_mode))
+        self.text = text
+        return self
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int = 1):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.log = []
+
+    async def reply(self, text, parse_mode=None):
+        self.log.append(("reply", text, parse_mode))
+        return FakeSent(self.log, text)
+
+
+class CountingDispatcher(OutboundDispatcher):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.submitted = 0
+
+    def submit(self, chat_id, factory, priority=0):
+        self.submitted += 1
+        return super().submit(chat_id, factory, priority)
+
+
+def test_edits_go_through_the_dispatcher_and_first_token_latency_is_recorded():
+    message = FakeMessage()
+    before = AI_FIRST_TOKEN_SECONDS.count()
+
+    async def scenario():
+        outbound = CountingDispatcher(chat_rate=100, chat_burst=10)
+        reply = StreamingReply(message, min_interval=0, outbound=outbound)
+        await reply.start()
+        await reply.push("Hel")
+        while reply.first_token_latency is None:
+            # The edit runs in the background
+            await asyncio.sleep(0)
+        await reply.push("lo")
+        await reply.finish("Hello *there*")
+        await outbound.close()
+        return outbound, reply
+
+    outbound, reply = asyncio.run(scenario())
+    assert message.log == [
+        ("reply", "…", None),
+        ("edit", "Hel", None),
+        ("edit", "Hello", None),
+        ("edit", "Hello *there*", "Markdown"),
+    ]
+    assert outbound.submitted == 4
+    assert outbound.stats()["sent"] == 4
+    assert reply.first_token_latency is not None
+    assert AI_FIRST_TOKEN_SECONDS.count() == before + 1
+
+
+class BlockedSent(FakeSent):
+    """A sent message whose edits wait until released."""
+
+    def __init__(self, log: list, text: str):
+        super().__init__(log, text)
+        self.release = asyncio.Event()
+
+    async def edit_text(self, text, parse_mode=None):
+        await self.release.wait()
+        return await super().edit_text(text, parse_mode)
+
+
+def test_push_does_not_wait_for_a_slow_edit():
+    message = FakeMessage()
+
+    async def scenario():
+        reply = StreamingReply(message, min_interval=0)
+        reply.placeholder = BlockedSent(message.log, "…")
+        reply._started = 0.0
+        await reply.push("a")
+        await asyncio.sleep(0)
+        # The first edit is stuck: later tokens neither wait nor start another edit
+        await asyncio.wait_for(reply.push("b"), 0.1)
+        await asyncio.wait_for(reply.push("c"), 0.1)
+        assert message.log == []
+        finishing = asyncio.create_task(reply.finish("abc"))
+        await asyncio.sleep(0.01)
+        # finish() waits for the edit in flight before writing the final text
+        assert not finishing.done()
+        reply.placeholder.release.set()
+        await finishing
+
+    asyncio.run(scenario())
+    assert message.log == [("edit", "a", None), ("edit", "abc", "Markdown")]
@@ -0,0 +1,158 @@
+import trigger_index
+from normalize import fold_text
+from prefilter import KeywordFilter
+from trigger_index import AhoCorasick, TriggerIndex
+from utils import check_message_for_triggers
+
+CHAT = -1001
+
+
+def trigger(trigger_id, keywords, chat_id=None, **extra):
+    return {"id": trigger_id, "triggers": keywords, "response": "ok", "chat_id": chat_id, **extra}
+
+
+def matched_id(text, triggers, chat_id=CHAT):
+    found = check_message_for_triggers(text, TriggerIndex(triggers), chat_id=chat_id)
+    return found["id"] if found else None
+
+
+def test_automaton_returns_lowest_rank():
+    automaton = AhoCorasick([("he", 2), ("she", 1), ("hers", 0), ("", 5)])
+    assert automaton.first_match("ushers") == 0
+    assert automaton.first_match("she") == 1
+    assert automaton.first_match("ahe") == 2
+    assert automaton.first_match("nothing") is None
+
+
+def test_automaton_follows_failure_links():
+    automaton = AhoCorasick([("abcd", 0), ("bc", 1)])
+    assert automaton.first_match("xabcx") == 1
+    assert automaton.first_match("abcd") == 0
+
+
+def test_exact_substring_match_is_case_insensitive():
+    assert matched_id("Hello THERE friend", [trigger(1, ["there"])]) == 1
+    assert matched_id("no keywords", [trigger(1, ["there"])]) is None
+
+
+def test_chat_triggers_come_before_global_ones():
+    triggers = [trigger(1, ["price"]), trigger(2, ["price"], chat_id=CHAT)]
+    assert matched_id("what is the price", triggers) == 2
+    # Another chat only sees the global trigger
+    assert matched_id("what is the price", triggers, chat_id=-1002) == 1
+    assert matched_id("what is the price", triggers, chat_id=None) == 1
+
+
+def test_chat_trigger_wins_even_if_only_fuzzy():
+    triggers = [trigger(1, ["delivery"]), trigger(2, ["delivery"], chat_id=CHAT)]
+    assert matched_id("delivey please", triggers) == 2
+
+
+def test_earlier_trigger_wins_within_a_bucket():
+    triggers = [trigger(1, ["order"]), trigger(2, ["support"])]
+    assert matched_id("support for my order", triggers) == 1
+
+
+def test_fuzzy_fallback_catches_typos():
+    triggers = [trigger(1, ["доставка"])]
+    assert matched_id("когда доставкa будет", triggers) == 1  # Latin a
+    assert matched_id("когда доствка будет", triggers) == 1
+    assert matched_id("когда будет", triggers) is None
+
+
+def test_fuzzy_fallback_cannot_beat_an_earlier_exact_match():
+    triggers = [trigger(1, ["payment"]), trigger(2, ["refund"])]
+    assert matched_id("refund the paymnt", triggers) == 1
+    assert matched_id("refund the pament", triggers) == 1
+    assert matched_id("refund it", triggers) == 2
+
+
+def test_per_trigger_fuzzy_threshold():
+    strict = [trigger(1, ["delivery"], fuzzy_threshold=99)]
+    loose = [trigger(1, ["delivery"], fuzzy_threshold=70)]
+    assert matched_id("delivey", strict) is None
+    assert matched_id("delivey", loose) == 1
+
+
+def test_invalid_fuzzy_threshold_falls_back_to_default():
+    triggers = [trigger(1, ["delivery"], fuzzy_threshold="high"), trigger(2, ["order"])]
+    index = TriggerIndex(triggers)
+    assert len(index) == 2
+    assert matched_id("delivey", triggers) == 1
+    assert matched_id("my order", triggers) == 2
+
+
+def test_empty_keyword_matches_everything():
+    assert matched_id("anything", [trigger(1, ["zzz"]), trigger(2, [""])]) == 2
+
+
+def test_latin_lookalikes_in_cyrillic_words_are_folded():
+    assert fold_text("пpивeт") == "привет"
+    assert matched_id("Пpивeт всем", [trigger(1, ["привет"])]) == 1
+    assert matched_id("привет всем", [trigger(1, ["пpивeт"])]) == 1
+
+
+def test_latin_keywords_still_match_next_to_cyrillic():
+    assert matched_id("hello,мир", [trigger(1, ["hello"])]) == 1
+    assert matched_id("helloпривет", [trigger(1, ["hello"])]) == 1
+    assert matched_id("coffee-кофе", [trigger(1, ["coffee"])]) == 1
+    assert matched_id("coffee-кофе", [trigger(1, ["кофе"])]) == 1
+
+
+def test_folding_only_adds_matches():
+    # Look-alike-only Latin next to Cyrillic folds, but the text as is still matches
+    assert matched_id("okей всем", [trigger(1, ["ok"])]) == 1
+    assert matched_id("okей всем", [trigger(1, ["окей"])]) == 1
+    assert matched_id("pcпривет", [trigger(1, ["pc"])]) == 1
+    assert matched_id("cocaкола", [trigger(1, ["coca"])]) == 1
+    assert matched_id("copпривет", [trigger(1, ["cop"])]) == 1
+    assert matched_id("всё хорошо", [trigger(1, ["всё"])]) == 1
+    assert matched_id("все хорошо", [trigger(1, ["всё"])]) == 1
+    # Fuzzy scoring sees both forms too
+    assert matched_id("copcocoaя", [trigger(1, ["copcoca"])]) == 1
+
+
+def test_plain_rows_are_compiled_on_the_fly():
+    assert check_message_for_triggers("hello", [trigger(1, ["hello"])])["id"] == 1
+    assert check_message_for_triggers("", [trigger(1, ["hello"])]) is None
+
+
+def test_prefilter_keeps_typos_and_rejects_other_words():
+    index = TriggerIndex([trigger(1, ["delivery"], chat_id=CHAT)])
+    assert index.may_match("delivary please", CHAT)
+    assert index.may_match("where is my delivery", CHAT)
+    assert index.may_match("livery", CHAT)
+    # Shares five of the keyword's bigrams, but no 7-character subsequence (ratio 75)
+    assert not index.may_match("livedery", CHAT)
+    assert not index.may_match("kitchen table", CHAT)
+    assert matched_id("livedery", [trigger(1, ["delivery"], chat_id=CHAT)]) is None
+
+
+def test_prefilter_covers_long_words_and_keywords():
+    keywords = KeywordFilter([("a very long keyword phrase", 85), ("доставка", 85)])
+    # Words past MAX_HASHED_WORD go through the per-length anchors
+    assert keywords.may_match(["averylongkeywordphrasz"])
+    assert keywords.may_match(["доствка"])
+    assert not keywords.may_match(["phrase", "kitchen"])
+    assert KeywordFilter([("delivery", 0)]).always
+    assert KeywordFilter([(" ", 85)]).always
+
+
+def test_prefilter_checks_both_forms():
+    # "cop" is kept as is, "copпривет" folds to "сорпривет": each form has to get through
+    index = TriggerIndex([trigger(1, ["cop"], chat_id=CHAT), trigger(2, ["окей"], chat_id=CHAT)])
+    assert index.may_match("copпривет", CHAT)
+    assert index.may_match("okей всем", CHAT)
+    assert not index.may_match("всем привет", CHAT)
+
+
+def test_prefilter_turns_off_when_it_rejects_too_little(monkeypatch):
+    monkeypatch.setattr(trigger_index, "PREFILTER_SAMPLE", 10)
+    selective = TriggerIndex([trigger(1, ["delivery"], chat_id=CHAT)])
+    busy = TriggerIndex([trigger(1, ["delivery"], chat_id=CHAT)])
+    for _ in range(10):
+        selective.may_match("kitchen table", CHAT)
+        busy.may_match("my delivery", CHAT)
+    assert not selective.may_match("kitchen table", CHAT)
+    # Every sampled message was a candidate, so checking is no longer worth it
+    assert busy.may_match("kitchen table", CHAT)
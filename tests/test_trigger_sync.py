@@ -0,0 +1,155 @@
+import asyncio
+
+from trigger_index import TriggerIndex
+from trigger_sync import MemoryTriggerSource, TriggerSync
+
+
+def row(trigger_id, keyword, **extra):
+    return {"id": trigger_id, "triggers": [keyword], "response": "ok", "chat_id": None, **extra}
+
+
+class Published:
+    """on_snapshot that records every published trigger list."""
+
+    def __init__(self):
+        self.snapshots = []
+
+    async def __call__(self, rows):
+        self.snapshots.append(rows)
+
+    @property
+    def ids(self):
+        return [r["id"] for r in self.snapshots[-1]]
+
+
+class CountingSource:
+    """Wraps a source and counts its queries."""
+
+    def __init__(self, source):
+        self.source = source
+        self.full = 0
+        self.changes = 0
+
+    async def fetch_all(self):
+        self.full += 1
+        return await self.source.fetch_all()
+
+    async def fetch_changes(self, since):
+        self.changes += 1
+        return await self.source.fetch_changes(since)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_incremental_changes_are_applied_and_published():
+    source = MemoryTriggerSource([row(1, "a"), row(2, "b")])
+    published = Published()
+    sync = TriggerSync(source, published)
+
+    async def scenario():
+        await sync.full_sync()
+        assert published.ids == [1, 2]
+        source.upsert(row(3, "c"))
+        source.upsert(row(1, "a2"))
+        assert await sync.sync_once() == 2
+        assert published.ids == [1, 2, 3]
+        assert published.snapshots[-1][0]["triggers"] == ["a2"]
+        source.delete(2)
+        assert await sync.sync_once() == 1
+        assert published.ids == [1, 3]
+
+    run(scenario())
+
+
+def test_nothing_is_published_without_a_change():
+    source = MemoryTriggerSource([row(1, "a")])
+    published = Published()
+    sync = TriggerSync(source, published)
+
+    async def scenario():
+        await sync.full_sync()
+        # Rows at the watermark come back, but they did not change
+        assert await sync.sync_once() == 0
+        assert await sync.full_sync()
+        assert len(published.snapshots) == 1
+
+    run(scenario())
+
+
+def test_full_sync_catches_hard_deletes():
+    source = MemoryTriggerSource([row(1, "a"), row(2, "b")])
+    published = Published()
+    sync = TriggerSync(source, published)
+
+    async def scenario():
+        await sync.full_sync()
+        del source._rows[2]
+        assert await sync.sync_once() == 0
+        assert published.ids == [1, 2]
+        await sync.full_sync()
+        assert published.ids == [1]
+
+    run(scenario())
+
+
+def test_missing_updated_at_column_stops_polling_full_reloads():
+    class NoWatermarkSource:
+        rows = [{"id": 1, "triggers": ["a"]}]
+
+        async def fetch_all(self):
+            return list(self.rows)
+
+        async def fetch_changes(self, since):
+            raise AssertionError("no watermark to query with")
+
+    source = CountingSource(NoWatermarkSource())
+    sync = TriggerSync(source, Published())
+
+    async def scenario():
+        await sync.full_sync()
+        assert not sync.watermarked
+        for _ in range(5):
+            await sync.sync_once()
+        assert source.full == 1
+
+    run(scenario())
+
+
+def test_empty_table_keeps_checking():
+    source = CountingSource(MemoryTriggerSource())
+    published = Published()
+    sync = TriggerSync(source, published)
+
+    async def scenario():
+        await sync.full_sync()
+        assert sync.watermarked
+        source.source.upsert(row(1, "a"))
+        await sync.sync_once()
+        assert published.ids == [1]
+        assert sync.watermark is not None
+        await sync.sync_once()
+        assert source.changes == 1
+
+    run(scenario())
+
+
+def test_failed_fetch_keeps_the_current_set():
+    class BrokenSource:
+        async def fetch_all(self):
+            return None
+
+    published = Published()
+    sync = TriggerSync(BrokenSource(), published)
+    assert run(sync.full_sync()) is False
+    assert published.snapshots == []
+
+
+def test_index_reuses_unchanged_buckets():
+    rows = [row(1, "a"), row(2, "b", chat_id=-1), row(3, "c", chat_id=-2)]
+    first = TriggerIndex(rows)
+    second = TriggerIndex(rows[:2] + [row(3, "changed", chat_id=-2)], first)
+    assert second.buckets_for(-1)[0] is first.buckets_for(-1)[0]
+    assert second.buckets_for(-1)[1] is first.buckets_for(-1)[1]
+    assert second.buckets_for(-2)[0] is not first.buckets_for(-2)[0]
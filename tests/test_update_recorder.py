@@ -0,0 +1,39 @@
+from update_recorder import PIIScrubber, read_bot_username, read_recording, write_recording
+
+
+def test_mentions_are_masked_except_the_bot():
+    scrubber = PIIScrubber(salt=b"salt", bot_username="Shop_Bot")
+    assert scrubber.scrub_text("@shop_bot ask @alice_99 and @SHOP_BOT") == "@shop_bot ask @user and @SHOP_BOT"
+    assert scrubber.scrub_text("mail a.b@example.com or see https://t.me/x") == "mail <email> or see <url>"
+
+
+def test_mentions_are_all_masked_without_a_bot_username():
+    assert PIIScrubber(salt=b"salt").scrub_text("@shop_bot hi") == "@user hi"
+
+
+def test_users_are_pseudonymized_but_the_bot_keeps_its_username():
+    scrubber = PIIScrubber(salt=b"salt", bot_username="shop_bot")
+    update = {
+        "message": {
+            "from": {"id": 42, "is_bot": False, "first_name": "Alice", "username": "alice"},
+            "chat": {"id": 42, "type": "private", "username": "alice"},
+            "reply_to_message": {"from": {"id": 7, "is_bot": True, "first_name": "Shop", "username": "shop_bot"}},
+            "contact": {"phone_number": "+100000000"},
+            "text": "@shop_bot hi",
+        }
+    }
+    message = scrubber.scrub(update)["message"]
+    assert message["from"]["id"] == message["chat"]["id"] == scrubber.pseudonym(42) != 42
+    assert message["from"]["username"] == "username"
+    assert message["from"]["first_name"] == "first_name"
+    assert message["reply_to_message"]["from"] == {"id": 7, "is_bot": True, "first_name": "first_name",
+                                                   "username": "shop_bot"}
+    assert "contact" not in message
+    assert message["text"] == "@shop_bot hi"
+
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / "updates.jsonl.gz")
+    write_recording(path, [(0.0, {"update_id": 1}), (0.5, {"update_id": 2})])
+    assert read_recording(path) == [(0.0, {"update_id": 1}), (0.5, {"update_id": 2})]
+    assert read_bot_username(path) is None
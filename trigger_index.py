@@ -0,0 +1,277 @@
+import logging
+from fuzzy import FuzzyMatcher, FUZZY_THRESHOLD
+from normalize import normalize_keyword, normalized
+from prefilter import KeywordFilter
+
+# A bucket whose pre-filter rules out less than PREFILTER_MIN_REJECTION of the first
+# PREFILTER_SAMPLE messages it checks stops checking: it would cost more than it saves
+PREFILTER_SAMPLE = 1000
+PREFILTER_MIN_REJECTION = 0.1
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring automaton (Aho-Corasick).
+
+    Each pattern carries an integer rank. A single pass over the text
+    returns the lowest rank among all patterns that occur in it.
+    """
+
+    __slots__ = ("_goto", "_fail", "_best")
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns: Iterable of (pattern, rank) pairs. Empty patterns are ignored.
+        """
+        goto = [{}]
+        best = [None]
+
+        for pattern, rank in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                nxt = goto[node].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][char] = nxt
+                    goto.append({})
+                    best.append(None)
+                node = nxt
+            if best[node] is None or rank < best[node]:
+                best[node] = rank
+
+        # Breadth-first pass: failure links and best rank inherited through them
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(char, 0)
+                fail[nxt] = target if target != nxt else 0
+                inherited = best[fail[nxt]]
+                if inherited is not None and (best[nxt] is None or inherited < best[nxt]):
+                    best[nxt] = inherited
+
+        self._goto = tuple(goto)
+        self._fail = tuple(fail)
+        self._best = tuple(best)
+
+    def first_match(self, text: str) -> int | None:
+        """Returns the lowest rank of any pattern found in text, or None."""
+        goto = self._goto
+        fail = self._fail
+        best = self._best
+        node = 0
+        found = None
+
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            rank = best[node]
+            if rank is not None and (found is None or rank < found):
+                found = rank
+                if found == 0:
+                    break
+
+        return found
+
+
+def _fuzzy_threshold(trigger_obj: dict) -> int:
+    """The trigger's fuzzy_threshold, or FUZZY_THRESHOLD if it is unset or invalid."""
+    value = trigger_obj.get('fuzzy_threshold')
+    if value is None:
+        return FUZZY_THRESHOLD
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid fuzzy_threshold {value!r} for trigger {trigger_obj.get('id')}, using {FUZZY_THRESHOLD}")
+        return FUZZY_THRESHOLD
+
+
+class TriggerBucket:
+    """
+    Triggers sharing one scope (a single chat, or global), in priority order.
+
+    A keyword matches in two forms: folded against the message's folded form
+    (see normalize.fold_text), and casefolded as is against the casefolded
+    message, so folding only ever adds matches ("ok" still matches "okей",
+    whose folded form is "окей").
+    """
+
+    __slots__ = (
+        "triggers", "keywords", "raw_keywords", "fuzzy", "raw_fuzzy", "_automaton", "_raw_automaton",
+        "_raw_differs", "_always_rank", "prefilter", "_always_passes", "_prefilter_checked", "_prefilter_rejected"
+    )
+
+    def __init__(self, triggers: list):
+        self.triggers = tuple(triggers)
+        # Keywords are normalized once here (like NormalizedMessage.folded) instead of on every message
+        self.keywords = tuple(
+            tuple(normalize_keyword(keyword) for keyword in (trigger_obj.get('triggers') or []))
+            for trigger_obj in self.triggers
+        )
+        self.raw_keywords = tuple(
+            tuple(keyword.casefold() for keyword in (trigger_obj.get('triggers') or []))
+            for trigger_obj in self.triggers
+        )
+        # Usually folding changes no keyword, and the folded matchers serve both forms
+        self._raw_differs = self.raw_keywords != self.keywords
+        thresholds = tuple(_fuzzy_threshold(trigger_obj) for trigger_obj in self.triggers)
+        self.fuzzy = FuzzyMatcher(self.keywords, thresholds)
+        self.raw_fuzzy = FuzzyMatcher(self.raw_keywords, thresholds) if self._raw_differs else self.fuzzy
+
+        # An empty keyword is a substring of every text
+        self._always_rank = next(
+            (rank for rank, keywords in enumerate(self.keywords) if '' in keywords),
+            None
+        )
+        self._automaton = AhoCorasick(
+            (keyword, rank)
+            for rank, keywords in enumerate(self.keywords)
+            for keyword in keywords
+        )
+        self._raw_automaton = AhoCorasick(
+            (keyword, rank)
+            for rank, keywords in enumerate(self.raw_keywords)
+            for keyword in keywords
+        ) if self._raw_differs else self._automaton
+
+        self.prefilter = KeywordFilter(
+            (keyword, thresholds[rank])
+            for forms in ((self.keywords, self.raw_keywords) if self._raw_differs else (self.keywords,))
+            for rank, keywords in enumerate(forms)
+            for keyword in keywords
+        )
+        self._always_passes = self.prefilter.always
+        self._prefilter_checked = 0
+        self._prefilter_rejected = 0
+
+    def _needs_raw(self, message) -> bool:
+        """Whether the casefolded form of message can match where its folded form does not."""
+        if message.casefolded != message.folded:
+            return True
+        # Keywords changed by folding are not ASCII, so they cannot occur in ASCII text
+        return self._raw_differs and not message.casefolded.isascii()
+
+    def may_match(self, message) -> bool:
+        """
+        Cheap pre-check on a NormalizedMessage:
+        False means no trigger of this bucket can match it, exactly or fuzzily.
+        It is never False for a message that first_exact_match() or the fuzzy
+        matcher would match; it may be True for one they do not. Once it has
+        proven non-selective (see PREFILTER_SAMPLE) it is always True.
+        """
+        if self._always_passes:
+            return True
+        words = message.tokens
+        if message.casefolded != message.folded:
+            # The filter holds both keyword forms; the casefolded words go with the raw ones
+            words = dict.fromkeys(words + message.casefolded_tokens)
+        result = self.prefilter.may_match(words)
+        self._prefilter_checked += 1
+        if not result:
+            self._prefilter_rejected += 1
+        if self._prefilter_checked == PREFILTER_SAMPLE:
+            if self._prefilter_rejected < PREFILTER_MIN_REJECTION * PREFILTER_SAMPLE:
+                self._always_passes = True
+                logging.info(
+                    f"🔎 Pre-filter off for a bucket of {len(self.triggers)} triggers: "
+                    f"it ruled out {self._prefilter_rejected} of {PREFILTER_SAMPLE} messages"
+                )
+        return result
+
+    def first_exact_match(self, message) -> int | None:
+        """Returns the rank of the first trigger with a keyword contained in the NormalizedMessage."""
+        limit = self._always_rank
+        if limit == 0:
+            return 0
+        rank = self._automaton.first_match(message.folded)
+        if self._needs_raw(message):
+            raw_rank = self._raw_automaton.first_match(message.casefolded)
+            if raw_rank is not None and (rank is None or raw_rank < rank):
+                rank = raw_rank
+        if rank is None or (limit is not None and limit < rank):
+            return limit
+        return rank
+
+    def first_fuzzy_match(self, message, limit: int = None) -> int | None:
+        """
+        Returns the lowest trigger rank (below limit) with a keyword that fuzzy-matches
+        a word of the NormalizedMessage, or None.
+        """
+        rank = self.fuzzy.first_match(message.tokens, limit=limit)
+        if not self._needs_raw(message):
+            return rank
+        words = message.casefolded_tokens
+        if self.raw_fuzzy is self.fuzzy:
+            # Words folding left alone were just scored against the same keywords
+            folded = set(message.tokens)
+            words = [word for word in words if word not in folded]
+        raw_rank = self.raw_fuzzy.first_match(words, limit=rank if rank is not None else limit)
+        return raw_rank if raw_rank is not None else rank
+
+
+def _bucket(triggers: list, previous: TriggerBucket = None) -> TriggerBucket:
+    # Rows of an unchanged trigger are usually the very same objects, so this is cheap
+    if previous is not None and previous.triggers == tuple(triggers):
+        return previous
+    return TriggerBucket(triggers)
+
+
+class TriggerIndex:
+    """
+    Immutable compiled view of the trigger table.
+
+    Triggers are bucketed by chat_id; global triggers (chat_id is NULL) live
+    in their own bucket. Built once per reload and shared by all handlers.
+    """
+
+    __slots__ = ("triggers", "_by_chat", "_global")
+
+    def __init__(self, triggers: list, previous: "TriggerIndex" = None):
+        """
+        Args:
+            triggers: Trigger rows in priority order
+            previous: Index of an earlier snapshot; its buckets whose triggers are
+                unchanged are reused instead of compiled again
+        """
+        self.triggers = tuple(triggers or [])
+
+        by_chat = {}
+        global_triggers = []
+        for trigger_obj in self.triggers:
+            trigger_chat_id = trigger_obj.get('chat_id')
+            if trigger_chat_id is not None:
+                by_chat.setdefault(trigger_chat_id, []).append(trigger_obj)
+            else:
+                global_triggers.append(trigger_obj)
+
+        previous_by_chat = previous._by_chat if previous is not None else {}
+        self._by_chat = {cid: _bucket(items, previous_by_chat.get(cid)) for cid, items in by_chat.items()}
+        self._global = _bucket(global_triggers, previous._global if previous is not None else None)
+
+    def __len__(self) -> int:
+        return len(self.triggers)
+
+    def may_match(self, message, chat_id: int = None) -> bool:
+        """
+        Pre-filter for check_message_for_triggers(): one pass over the tokens of
+        message (a NormalizedMessage, or text to normalize). False means no
+        trigger for this chat can match, so the full matching can be skipped;
+        True means it has to run.
+        """
+        message = normalized(message)
+        return any(bucket.may_match(message) for bucket in self.buckets_for(chat_id))
+
+    def buckets_for(self, chat_id: int = None) -> tuple:
+        """Buckets to check for a chat, highest priority first."""
+        chat_bucket = self._by_chat.get(chat_id) if chat_id is not None else None
+        if chat_bucket is None:
+            return (self._global,)
+        return (chat_bucket, self._global)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from db import get_all_triggers, get_triggers_changed_since
+
+
+class SupabaseTriggerSource:
+    """
+    Reads triggers from Supabase.
+
+    Incremental fetches use the triggers.updated_at column as a watermark and
+    include disabled rows so disabling a trigger is seen as a removal.
+    """
+
+    async def fetch_all(self) -> list | None:
+        return await get_all_triggers()
+
+    async def fetch_changes(self, since) -> list | None:
+        return await get_triggers_changed_since(since)
+
+
+class MemoryTriggerSource:
+    """
+    In-process trigger source with the same interface as SupabaseTriggerSource.
+
+    Every upsert/delete bumps an integer updated_at, which makes it a local
+    stand-in for the trigger table when exercising TriggerSync.
+    """
+
+    def __init__(self, rows: list = None):
+        self._version = 0
+        self._rows = {}
+        for row in rows or []:
+            self.upsert(row)
+
+    def upsert(self, row: dict):
+        self._version += 1
+        self._rows[row['id']] = {**row, 'updated_at': self._version}
+
+    def delete(self, trigger_id: int):
+        """Soft delete: the row stays visible to incremental fetches as disabled."""
+        row = self._rows.get(trigger_id)
+        if row is not None:
+            self.upsert({**row, 'enabled': False})
+
+    async def fetch_all(self) -> list | None:
+        return [row for row in self._rows.values() if row.get('enabled', True)]
+
+    async def fetch_changes(self, since) -> list | None:
+        return [row for row in self._rows.values() if row['updated_at'] >= since]
+
+
+class TriggerSync:
+    """
+    Keeps the in-memory trigger set in step with the source.
+
+    Changed rows are applied as deltas to a private id -> row map; every change
+    produces a brand new row list that is handed to on_snapshot in one call, so
+    readers only ever see a complete snapshot. Nothing is published when a fetch
+    changed nothing. Hard deletes are invisible to watermark queries, so every
+    full_sync_every-th cycle is a full reload.
+
+    Without an updated_at column there is no watermark; that is detected on the
+    first full reload, after which only the periodic full reloads run.
+    """
+
+    def __init__(self, source, on_snapshot, interval: float = 30.0, full_sync_every: int = 20):
+        """
+        Args:
+            source: Object with async fetch_all() and fetch_changes(since)
+            on_snapshot: Async callable receiving the complete, ordered list of enabled triggers
+            interval: Seconds between incremental fetches (0 disables the background loop)
+            full_sync_every: Run a full reload every N cycles (0 never)
+        """
+        self.source = source
+        self.on_snapshot = on_snapshot
+        self.interval = interval
+        self.full_sync_every = full_sync_every
+        self.watermark = None
+        # False once the rows turned out to have no updated_at column
+        self.watermarked = True
+        self._rows = {}
+        self._cycles = 0
+        self._lock = asyncio.Lock()
+
+    async def _publish(self):
+        snapshot = sorted(self._rows.values(), key=lambda row: row['id'])
+        await self.on_snapshot(snapshot)
+
+    def _advance_watermark(self, rows: list):
+        stamps = [row['updated_at'] for row in rows if row.get('updated_at') is not None]
+        if stamps:
+            latest = max(stamps)
+            if self.watermark is None or latest > self.watermark:
+                self.watermark = latest
+
+    async def full_sync(self) -> bool:
+        """Reload every enabled trigger. Returns False if the source failed."""
+        async with self._lock:
+            rows = await self.source.fetch_all()
+            if rows is None:
+                return False
+            if rows and self.watermarked and not any('updated_at' in row for row in rows):
+                self.watermarked = False
+                logging.warning(
+                    "triggers.updated_at is missing: trigger changes are picked up by the full reload "
+                    f"every {self.interval * self.full_sync_every:.0f}s only"
+                )
+            fresh = {row['id']: row for row in rows}
+            self.watermark = None
+            self._advance_watermark(rows)
+            if fresh != self._rows:
+                self._rows = fresh
+                await self._publish()
+            return True
+
+    async def load_snapshot(self, rows: list, watermark=None):
+        """Seed the trigger set from a local snapshot and publish it. Call full_sync() later to reconcile."""
+        self._rows = {row['id']: row for row in rows}
+        self.watermark = watermark
+        await self._publish()
+
+    def apply_changes(self, rows: list) -> int:
+        """Apply changed rows to the trigger set. Returns how many rows actually changed."""
+        changed = 0
+        for row in rows:
+            trigger_id = row['id']
+            if row.get('enabled', True):
+                if self._rows.get(trigger_id) != row:
+                    self._rows[trigger_id] = row
+                    changed += 1
+            elif self._rows.pop(trigger_id, None) is not None:
+                changed += 1
+        self._advance_watermark(rows)
+        return changed
+
+    async def sync_once(self) -> int:
+        """Fetch and apply changes since the watermark. Returns the number of changed triggers."""
+        if self.watermark is None:
+            if not self.watermarked:
+                # Changes can only be seen by the periodic full reload
+                return 0
+            # Empty table: a full reload costs no more than a change query
+            await self.full_sync()
+            return 0
+
+        async with self._lock:
+            # gte, not gt: rows sharing the watermark timestamp may have been committed late
+            rows = await self.source.fetch_changes(self.watermark)
+            if not rows:
+                return 0
+            changed = self.apply_changes(rows)
+            if changed:
+                await self._publish()
+                logging.info(f"🔁 Applied {changed} trigger changes")
+            return changed
+
+    async def run(self):
+        """Background loop: incremental fetches with a periodic full reload."""
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            self._cycles += 1
+            try:
+                if self.full_sync_every and self._cycles % self.full_sync_every == 0:
+                    await self.full_sync()
+                else:
+                    await self.sync_once()
+            except Exception as e:
+                logging.error(f"Trigger sync failed: {e!r}")
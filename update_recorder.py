@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import json
+import logging
+import re
+import secrets
+import time
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+RECORDING_VERSION = 1
+
+# Fields that identify people (or are too personal to keep) and carry nothing the handlers match on
+_NAME_FIELDS = ("first_name", "last_name", "username", "title", "bio")
+_DROPPED_FIELDS = ("contact", "location", "venue", "phone_number", "email", "shipping_address")
+_TEXT_FIELDS = ("text", "caption")
+_MENTION = re.compile(r"@(\w{4,})")
+_TEXT_SCRUBBERS = (
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"https?://\S+|t\.me/\S+"), "<url>"),
+    (_MENTION, "@user"),
+    (re.compile(r"\+?\d[\d\s().-]{8,}\d"), "<phone>"),
+)
+
+
+class PIIScrubber:
+    """
+    Strips personal data from raw update dicts.
+
+    User ids (and private chat ids, which equal them) become stable
+    pseudonyms keyed by a per-recording salt, names and usernames become
+    placeholders, contacts and locations are dropped, and emails, links,
+    @mentions and phone numbers in text are masked. Group ids, message ids,
+    dates and the rest of the text are kept, since trigger matching and
+    cooldowns depend on them, and so is the bot's own username (in
+    mentions and in its user), which the handlers check for.
+    """
+
+    def __init__(self, salt: bytes = None, bot_username: str = None):
+        self.salt = salt or secrets.token_bytes(16)
+        self.bot_username = bot_username.casefold() if bot_username else None
+        self._pseudonyms = {}
+
+    def pseudonym(self, user_id: int) -> int:
+        pseudonym = self._pseudonyms.get(user_id)
+        if pseudonym is None:
+            digest = hashlib.blake2b(str(user_id).encode(), key=self.salt, digest_size=6).digest()
+            # Positive, like real user ids, and clear of the bot's own id range
+            pseudonym = self._pseudonyms[user_id] = 10 ** 12 + int.from_bytes(digest, "big")
+        return pseudonym
+
+    def _is_bot_username(self, username: str) -> bool:
+        return self.bot_username is not None and username.casefold() == self.bot_username
+
+    def _mention(self, match) -> str:
+        return match.group() if self._is_bot_username(match.group(1)) else "@user"
+
+    def scrub_text(self, text: str) -> str:
+        for pattern, replacement in _TEXT_SCRUBBERS:
+            text = pattern.sub(self._mention if pattern is _MENTION else replacement, text)
+        return text
+
+    def scrub(self, value):
+        if isinstance(value, list):
+            return [self.scrub(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        is_user = "is_bot" in value
+        is_private_chat = value.get("type") == "private"
+        scrubbed = {}
+        for key, item in value.items():
+            if key in _DROPPED_FIELDS:
+                continue
+            if key == "username" and isinstance(item, str) and self._is_bot_username(item):
+                scrubbed[key] = item
+            elif key in _NAME_FIELDS and isinstance(item, str):
+                scrubbed[key] = key
+            elif key == "id" and (is_user or is_private_chat) and isinstance(item, int):
+                scrubbed[key] = self.pseudonym(item) if not value.get("is_bot") else item
+            elif key in _TEXT_FIELDS and isinstance(item, str):
+                scrubbed[key] = self.scrub_text(item)
+            elif key in ("entities", "caption_entities"):
+                # Offsets no longer line up with the masked text
+                continue
+            else:
+                scrubbed[key] = self.scrub(item)
+        return scrubbed
+
+
+class UpdateRecorder(BaseMiddleware):
+    """
+    Outer update middleware that appends every update, scrubbed of personal
+    data, to a gzip-compressed JSON-lines file for bench/replay.py.
+
+    The first line is a header (with the bot's username, kept in the
+    updates, for the replay to answer getMe with); every following line is
+    [seconds since recording started, update]. Writes are buffered by gzip
+    and flushed every flush_every updates, so recording adds a few
+    microseconds per update.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100, bot_username: str = None):
+        self.path = path
+        self.flush_every = flush_every
+        self.scrubber = PIIScrubber(bot_username=bot_username)
+        self.recorded = 0
+        self._started = time.time()
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._write({"version": RECORDING_VERSION, "started": self._started, "bot_username": bot_username})
+        logging.info(f"⏺ Recording updates to {path}")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    async def __call__(self, handler, event: Update, data: dict):
+        try:
+            raw = event.model_dump(mode="json", exclude_none=True, by_alias=True)
+            self._write([round(time.time() - self._started, 3), self.scrubber.scrub(raw)])
+            self.recorded += 1
+            if self.recorded % self.flush_every == 0:
+                self._file.flush()
+        except Exception as e:
+            logging.warning(f"Failed to record update {event.update_id}: {e!r}")
+        return await handler(event, data)
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path: str) -> list:
+    """
+    Loads a recording as a list of (offset_seconds, update_dict).
+    A file appended to by several runs keeps each run's offsets relative to its own start.
+    """
+    updates = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                if record.get("version") != RECORDING_VERSION:
+                    raise ValueError(f"Unsupported recording version {record.get('version')}")
+                # A new run: continue after the previous one
+                base = updates[-1][0] if updates else 0.0
+                continue
+            offset, update = record
+            updates.append((base + offset, update))
+    return updates
+
+
+def read_bot_username(path: str) -> str | None:
+    """The bot username in the recording's (first) header, if it was recorded."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.loads(f.readline()).get("bot_username")
+
+
+def write_recording(path: str, updates: list):
+    """Writes (offset_seconds, update_dict) pairs in the recording format (used for synthetic loads)."""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({"version": RECORDING_VERSION, "started": time.time()}) + "\n")
+        for offset, update in updates:
+            f.write(json.dumps([offset, update], ensure_ascii=False, separators=(",", ":")) + "\n")
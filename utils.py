@@ -1,34 +1,231 @@
+import asyncio
+import heapq
+import logging
 import time
-from thefuzz import fuzz
+from collections import OrderedDict
+from trigger_index import TriggerIndex
+from normalize import normalized
 
 class CooldownManager:
-    def __init__(self):
-        # self.last_triggered[chat_id][trigger_id] = timestamp
-        self.last_triggered = {}
+    """
+    Per-chat trigger cooldowns that forget entries once they have expired.
+
+    Each (chat_id, trigger_id) key maps to a (last_time, bucket) tuple. The
+    bucket is the entry's expiry time (last_time + cooldown + grace) divided
+    into bucket_seconds slots, and every bucket keeps the set of keys filed in
+    it. Whenever the clock (the newest timestamp seen) moves past a bucket, the
+    keys still filed there are dropped. Re-marking a key files it in a new
+    bucket, and the stale reference in the old one is skipped.
+
+    can_trigger/mark_triggered are O(1) amortized, except that a mark opening
+    a new bucket pushes it onto a heap of the live buckets: O(log b), with b
+    about (max cooldown + grace) / bucket_seconds. Memory per active entry is
+    roughly 250 bytes on 64-bit CPython: a dict slot (~40), the key tuple (56)
+    plus a large chat_id int (32), the value tuple (56) with its float (24), and
+    a slot in the bucket set (~40).
+    """
+
+    def __init__(self, bucket_seconds: float = 10.0, grace_seconds: float = 60.0):
+        """
+        Args:
+            bucket_seconds: Width of an expiry bucket
+            grace_seconds: Extra lifetime past the cooldown, so messages arriving slightly
+                out of order (timestamps behind the clock) still see the entry
+        """
+        self.bucket_seconds = bucket_seconds
+        self.grace_seconds = grace_seconds
+        self._entries = {}
+        self._buckets = {}
+        self._bucket_heap = []
+        self._clock = 0.0
+        self._max_cooldown = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "evicted": self.evicted,
+        }
+
+    def export(self) -> list:
+        """Entries as [chat_id, trigger_id, last_time, expires_at] for snapshots."""
+        width = self.bucket_seconds
+        return [
+            [chat_id, trigger_id, last_time, bucket * width]
+            for (chat_id, trigger_id), (last_time, bucket) in self._entries.items()
+        ]
+
+    def restore(self, entries: list):
+        """Load entries produced by export(). Existing entries are kept unless overwritten."""
+        for chat_id, trigger_id, last_time, expires_at in entries:
+            key = (chat_id, trigger_id)
+            bucket = int(expires_at // self.bucket_seconds)
+            self._entries[key] = (last_time, bucket)
+            keys = self._buckets.get(bucket)
+            if keys is None:
+                keys = self._buckets[bucket] = set()
+                heapq.heappush(self._bucket_heap, bucket)
+            keys.add(key)
+
+    def _advance(self, current_time: float):
+        if current_time > self._clock:
+            self._clock = current_time
+        current_bucket = int(self._clock // self.bucket_seconds)
+        heap = self._bucket_heap
+        while heap and heap[0] < current_bucket:
+            bucket = heapq.heappop(heap)
+            for key in self._buckets.pop(bucket, ()):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == bucket:
+                    del self._entries[key]
+                    self.evicted += 1
 
     def can_trigger(self, chat_id: int, trigger_id: int, cooldown_seconds: int, timestamp: float = None) -> bool:
-        if chat_id not in self.last_triggered:
-            self.last_triggered[chat_id] = {}
-        
-        last_time = self.last_triggered[chat_id].get(trigger_id, 0)
         current_time = timestamp if timestamp is not None else time.time()
+        self._advance(current_time)
+        if cooldown_seconds > self._max_cooldown:
+            self._max_cooldown = cooldown_seconds
+        
+        entry = self._entries.get((chat_id, trigger_id))
+        last_time = entry[0] if entry is not None else 0
         
         if current_time - last_time < cooldown_seconds:
             return False
             
         return True
 
-    def mark_triggered(self, chat_id: int, trigger_id: int, timestamp: float = None):
-        if chat_id not in self.last_triggered:
-            self.last_triggered[chat_id] = {}
+    def mark_triggered(self, chat_id: int, trigger_id: int, timestamp: float = None, cooldown_seconds: int = None):
+        """
+        Records a trigger. cooldown_seconds sets how long the entry is kept; without it
+        the longest cooldown seen so far is used.
+        """
         current_time = timestamp if timestamp is not None else time.time()
-        self.last_triggered[chat_id][trigger_id] = current_time
+        self._advance(current_time)
+        if cooldown_seconds is None:
+            cooldown_seconds = self._max_cooldown
+        
+        key = (chat_id, trigger_id)
+        expiry = current_time + cooldown_seconds + self.grace_seconds
+        bucket = int(expiry // self.bucket_seconds)
+        self._entries[key] = (current_time, bucket)
+        
+        keys = self._buckets.get(bucket)
+        if keys is None:
+            keys = self._buckets[bucket] = set()
+            heapq.heappush(self._bucket_heap, bucket)
+        keys.add(key)
 
-def check_message_for_triggers(message_text: str, triggers_data: list, chat_id: int = None) -> dict | None:
+class LoopStallMonitor:
+    """
+    Measures event-loop stalls.
+
+    Sleeps for a fixed interval and records how late each wake-up is. Any delay
+    means some callback held the loop (e.g. a blocking DB call), so the numbers
+    can be compared before and after a change.
+    """
+
+    def __init__(self, interval: float = 0.1, report_seconds: float = 300.0):
+        self.interval = interval
+        self.report_seconds = report_seconds
+        self.samples = 0
+        self.total_stall = 0.0
+        self.max_stall = 0.0
+        self.stalls_over_100ms = 0
+
+    def stats(self) -> dict:
+        return {
+            "samples": self.samples,
+            "total_stall_seconds": round(self.total_stall, 4),
+            "max_stall_seconds": round(self.max_stall, 4),
+            "stalls_over_100ms": self.stalls_over_100ms,
+        }
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            stall = max(0.0, now - expected)
+            
+            self.samples += 1
+            self.total_stall += stall
+            if stall > self.max_stall:
+                self.max_stall = stall
+            if stall > 0.1:
+                self.stalls_over_100ms += 1
+            
+            if self.report_seconds and now - last_report >= self.report_seconds:
+                last_report = now
+                logging.info(f"⏱ Event loop stalls: {self.stats()}")
+
+class BotIdentity:
+    """
+    The bot's own user (id, username), fetched with getMe once and then
+    refreshed in the background every refresh_seconds instead of per message.
+    """
+
+    def __init__(self, refresh_seconds: float = 6 * 3600):
+        self.refresh_seconds = refresh_seconds
+        self.user = None
+        self._fetched_at = 0.0
+        self._refreshing = None
+
+    @property
+    def username(self) -> str | None:
+        return self.user.username if self.user else None
+
+    async def refresh(self, bot):
+        """Fetch the identity now. Keeps the previous one if getMe fails."""
+        try:
+            self.user = await bot.get_me()
+            self._fetched_at = time.monotonic()
+        except Exception as e:
+            logging.warning(f"Failed to fetch bot identity: {e!r}")
+
+    async def get(self, bot):
+        """The cached identity; fetched inline only when there is none yet."""
+        if self.user is None:
+            await self.refresh(bot)
+        elif time.monotonic() - self._fetched_at > self.refresh_seconds and self._refreshing is None:
+            self._refreshing = asyncio.create_task(self.refresh(bot))
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        return self.user
+
+class RecentKeys:
+    """Bounded set of recently seen keys; the least recently seen are forgotten first."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._keys = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def seen(self, key) -> bool:
+        """Records key; returns whether it had been seen already."""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self.max_entries:
+            self._keys.popitem(last=False)
+        return False
+
+def check_message_for_triggers(message_text, triggers_data, chat_id: int = None) -> dict | None:
     """
     Checks if message contains any of the triggers.
+    message_text is a NormalizedMessage (plain text is normalized on the fly).
     Returns the trigger object if found, else None.
-    Uses fuzzy matching.
+    Uses fuzzy matching (threshold 85 unless the trigger sets fuzzy_threshold).
+    
+    triggers_data is a compiled TriggerIndex (a plain list of trigger rows
+    is compiled on the fly).
     
     Priority:
     1. Chat-specific triggers (chat_id matches)
@@ -36,46 +233,23 @@ def check_message_for_triggers(message_text: str, triggers_data: list, chat_id:
     """
     if not message_text:
         return None
-        
-    message_words = message_text.lower().split()
-    
-    def matches_keywords(trigger_obj: dict) -> bool:
-        """Check if message matches trigger keywords."""
-        keywords = trigger_obj.get('triggers', [])
-        for keyword in keywords:
-            keyword = keyword.lower()
-            # Exact match check first for speed
-            if keyword in message_text.lower():
-                return True
-            # Fuzzy match word by word
-            for word in message_words:
-                ratio = fuzz.ratio(keyword, word)
-                if ratio >= 85:  # Threshold for match
-                    return True
-        return False
-    
-    # Separate triggers into chat-specific and global
-    chat_specific_triggers = []
-    global_triggers = []
-    
-    for trigger_obj in triggers_data:
-        trigger_chat_id = trigger_obj.get('chat_id')
-        if trigger_chat_id is not None:
-            # Chat-specific trigger
-            if trigger_chat_id == chat_id:
-                chat_specific_triggers.append(trigger_obj)
-        else:
-            # Global trigger (chat_id is NULL)
-            global_triggers.append(trigger_obj)
     
-    # Priority 1: Check chat-specific triggers first
-    for trigger_obj in chat_specific_triggers:
-        if matches_keywords(trigger_obj):
-            return trigger_obj
+    if isinstance(triggers_data, TriggerIndex):
+        index = triggers_data
+    else:
+        index = TriggerIndex(triggers_data)
+        
+    message = normalized(message_text)
     
-    # Priority 2: Check global triggers
-    for trigger_obj in global_triggers:
-        if matches_keywords(trigger_obj):
-            return trigger_obj
+    for bucket in index.buckets_for(chat_id):
+        # One pass over the text finds the first trigger with an exact keyword hit;
+        # only triggers ranked before it can still win through fuzzy matching
+        exact_rank = bucket.first_exact_match(message)
+        fuzzy_rank = bucket.first_fuzzy_match(message, limit=exact_rank)
+        
+        if fuzzy_rank is not None:
+            return bucket.triggers[fuzzy_rank]
+        if exact_rank is not None:
+            return bucket.triggers[exact_rank]
                     
     return None
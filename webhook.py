@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import secrets
+import signal
+from contextlib import suppress
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Receives updates from Telegram on a local aiohttp server.
+
+    Requests without the right secret token are refused. Accepted updates go
+    into a bounded queue that a fixed number of workers feed to the
+    dispatcher; when the queue is full the request gets a 503 and Telegram
+    delivers the update again later. close() stops accepting requests and
+    waits for queued and in-flight updates to finish.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = "/webhook", secret: str = "",
+                 queue_size: int = 1000, workers: int = 16):
+        """
+        Args:
+            dp: Dispatcher that handles the updates
+            bot: Bot the updates belong to
+            path: URL path the server listens on
+            secret: Secret token Telegram must send (empty accepts any request)
+            queue_size: Max updates waiting for a worker
+            workers: Number of updates processed concurrently
+        """
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._workers = []
+        self._runner = None
+        self._workflow_data = {}
+
+        # Metrics
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.unauthorized = 0
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+        }
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.unauthorized += 1
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.warning(f"Bad webhook payload: {e!r}")
+            return web.Response(status=400)
+
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update, **self._workflow_data)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Failed to process update {update.update_id}: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    async def start(self, host: str, port: int, url: str = None, **kwargs):
+        """
+        Start the workers and the HTTP server.
+
+        Args:
+            host: Interface to bind
+            port: Port to bind
+            url: Public URL registered with Telegram (None skips setWebhook)
+            **kwargs: Extra data passed to handlers, like start_polling(**kwargs)
+        """
+        self._workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data, **kwargs}
+        await self.dp.emit_startup(bot=self.bot, **self._workflow_data)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        self._runner = web.AppRunner(self.make_app(), handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+        if url:
+            await self.bot.set_webhook(
+                url,
+                secret_token=self.secret or None,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+        print(f"Webhook server listening on {host}:{port}{self.path}")
+
+    async def close(self, timeout: float = 30.0):
+        """Stop accepting updates and wait (up to timeout) for queued ones to be handled."""
+        if self._runner is not None:
+            # The webhook stays registered: Telegram keeps new updates until we are back
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Webhook shutdown: {self._queue.qsize()} updates left unprocessed")
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._workers = []
+        await self.dp.emit_shutdown(bot=self.bot, **self._workflow_data)
+
+
+async def wait_for_stop_signal():
+    """Return on SIGINT/SIGTERM (or when cancelled, e.g. on Windows)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with suppress(NotImplementedError):
+                loop.remove_signal_handler(sig)